@@ -0,0 +1,109 @@
+"""Measure the memory used by subscriptions to a ManagedTree
+
+For each number of subscriptions, a new ManagedTree gets that many
+single-path subscriptions, spread over ``--paths`` distinct paths. The
+script reports the memory allocated per subscription (as measured by
+tracemalloc), the time it took to subscribe and unsubscribe, and the time of
+a full ``gc.collect()`` while the subscriptions are alive.
+
+Run from the root of the repository (or with pykzee installed):
+
+    PYTHONPATH=. python benchmarks/subscription_memory.py 10000 100000 1000000
+"""
+
+import argparse
+import asyncio
+import gc
+import time
+import tracemalloc
+
+from pykzee.core.common import Path
+from pykzee.core.ManagedTree import ManagedTree, PluginInfo
+
+
+def callback(value):
+    pass
+
+
+async def measure(count, path_count):
+    mt = ManagedTree()
+    plugin = PluginInfo(path=Path(("p",)), configuration={})
+    paths = [(f"/d{ i % 100 }/x{ i }",) for i in range(path_count)]
+    # Let the ManagedTree settle, and create the directory nodes once so that
+    # only the subscriptions themselves are measured
+    await asyncio.sleep(0)
+    for unsubscribe in [
+        mt.subscribe(plugin, p, callback, initial=False) for p in paths
+    ]:
+        unsubscribe()
+
+    def subscribe():
+        return [
+            mt.subscribe(
+                plugin, paths[i % path_count], callback, initial=False
+            )
+            for i in range(count)
+        ]
+
+    # Memory and time are measured in separate passes, as tracemalloc slows
+    # down allocations considerably
+    gc.collect()
+    tracemalloc.start()
+    unsubscribe = subscribe()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    for function in unsubscribe:
+        function()
+    del unsubscribe
+
+    gc.collect()
+    start = time.perf_counter()
+    unsubscribe = subscribe()
+    subscribe_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    gc.collect()
+    gc_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for function in unsubscribe:
+        function()
+    unsubscribe_time = time.perf_counter() - start
+    return size / count, subscribe_time, unsubscribe_time, gc_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "counts",
+        nargs="*",
+        type=int,
+        default=[10000, 100000, 1000000],
+        help="numbers of subscriptions to measure",
+    )
+    parser.add_argument(
+        "--paths",
+        type=int,
+        default=5000,
+        help="number of distinct paths subscribed to",
+    )
+    options = parser.parse_args()
+
+    print(
+        f"{ 'subscriptions':>13} { 'bytes each':>10} { 'subscribe':>10} "
+        f"{ 'unsubscribe':>11} { 'gc':>10}"
+    )
+    for count in options.counts:
+        per_subscription, subscribe_time, unsubscribe_time, gc_time = (
+            asyncio.run(measure(count, options.paths))
+        )
+        print(
+            f"{ count:>13} { per_subscription:>10.0f} "
+            f"{ subscribe_time * 1000:>8.0f}ms "
+            f"{ unsubscribe_time * 1000:>9.0f}ms "
+            f"{ gc_time * 1000:>8.0f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
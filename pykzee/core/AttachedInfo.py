@@ -1,19 +1,150 @@
-import functools
+import collections
+import sys
+import weakref
 
 from pyimmutable import ImmutableList, ImmutableDict
-from pykzee.core.common import Undefined, makePath, pathToString
+from pykzee.core.common import Undefined, makePath, Path, pathToString
 
 SameAsData = object()
 
 
+class CacheStats:
+    __slots__ = "hits", "misses", "evictions"
+
+    def __init__(self):
+        self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        return ImmutableDict(
+            hits=self.hits, misses=self.misses, evictions=self.evictions
+        )
+
+
+class CachePolicy:
+    """Limits and statistics for the caches kept in the meta of nodes
+
+    Caches that can grow (``MetaCache``) hold at most ``maxNodeEntries``
+    entries each, evicting the least recently used one. When all of them
+    together hold more than ``maxTotalEntries`` entries, the caches used
+    least recently are cleared until the total is within the budget again.
+    The real path memo of a ``SymlinkTrie`` counts towards the same total,
+    and is cleared once it holds ``maxRealpathEntries`` entries.
+    """
+
+    __slots__ = (
+        "maxNodeEntries",
+        "maxRealpathEntries",
+        "maxTotalEntries",
+        "totalEntries",
+        "stats",
+        "__caches",
+    )
+
+    def __init__(
+        self,
+        *,
+        max_node_entries=256,
+        max_realpath_entries=1 << 16,
+        max_total_entries=1 << 20,
+    ):
+        self.maxNodeEntries = max_node_entries
+        self.maxRealpathEntries = max_realpath_entries
+        self.maxTotalEntries = max_total_entries
+        self.totalEntries = 0
+        self.stats = collections.defaultdict(CacheStats)
+        self.__caches = collections.OrderedDict()  # id -> weakref to cache
+
+    def touch(self, cache):
+        caches = self.__caches
+        key = id(cache)
+        if key in caches:
+            caches.move_to_end(key)
+        else:
+            caches[key] = weakref.ref(cache)
+
+    def forget(self, cache):
+        self.__caches.pop(id(cache), None)
+
+    def enforceBudget(self):
+        caches = self.__caches
+        while self.totalEntries > self.maxTotalEntries and caches:
+            _, ref = caches.popitem(last=False)
+            cache = ref()
+            if cache is not None:
+                cache.clear()
+
+    def info(self):
+        return ImmutableDict(
+            entries=self.totalEntries,
+            max_node_entries=self.maxNodeEntries,
+            max_realpath_entries=self.maxRealpathEntries,
+            max_total_entries=self.maxTotalEntries,
+            caches=ImmutableDict(
+                (name, stats.info()) for name, stats in self.stats.items()
+            ),
+        )
+
+
+cachePolicy = CachePolicy()
+
+
+class MetaCache:
+    """Bounded LRU cache, to be stored in the meta of a node"""
+
+    __slots__ = "__entries", "__stats", "__weakref__"
+
+    def __init__(self, name):
+        self.__entries = collections.OrderedDict()
+        self.__stats = cachePolicy.stats[name]
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __del__(self):
+        cachePolicy.totalEntries -= len(self.__entries)
+        cachePolicy.forget(self)
+
+    def get(self, key, default=None):
+        entries = self.__entries
+        try:
+            value = entries[key]
+        except KeyError:
+            self.__stats.misses += 1
+            return default
+        entries.move_to_end(key)
+        self.__stats.hits += 1
+        return value
+
+    def put(self, key, value):
+        entries = self.__entries
+        if key not in entries:
+            cachePolicy.totalEntries += 1
+            if len(entries) >= cachePolicy.maxNodeEntries:
+                entries.popitem(last=False)
+                self.__stats.evictions += 1
+                cachePolicy.totalEntries -= 1
+        entries[key] = value
+        cachePolicy.touch(self)
+        if cachePolicy.totalEntries > cachePolicy.maxTotalEntries:
+            cachePolicy.enforceBudget()
+
+    def clear(self):
+        self.__stats.evictions += len(self.__entries)
+        cachePolicy.totalEntries -= len(self.__entries)
+        self.__entries.clear()
+
+
 def attribute(key):
+    stats = cachePolicy.stats[key]
+
     def decorator(func):
         def modified_func(data):
             try:
                 result = data.meta[key]
             except KeyError:
-                ...
+                stats.misses += 1
             else:
+                stats.hits += 1
                 return data if result is SameAsData else result
 
             result = func(data)
@@ -29,6 +160,9 @@ def attribute(key):
 ##############################################################################
 
 
+_missing = object()
+
+
 def getSubtree(data, path):
     if not path:
         return data
@@ -39,32 +173,60 @@ def getSubtree(data, path):
     try:
         cache = meta["subtree-cache"]
     except KeyError:
-        cache = meta["subtree-cache"] = {}
+        cache = meta["subtree-cache"] = MetaCache("subtree-cache")
 
-    try:
-        return cache[path]
-    except KeyError:
-        ...
+    result = cache.get(path, _missing)
+    if result is not _missing:
+        return result
 
     try:
         child = data[path[0]]
     except Exception:
-        cache[path] = Undefined
+        cache.put(path, Undefined)
         return Undefined
 
     if len(path) < 2:
-        cache[path] = child
+        cache.put(path, child)
         return child
 
-    result = cache[path] = getSubtree(child, path[1:])
+    result = getSubtree(child, path[1:])
+    cache.put(path, result)
     return result
 
 
+def stateSize(data):
+    """Number of nodes and approximate size in bytes of ``data``
+
+    The result is cached on every ``ImmutableDict``/``ImmutableList`` node,
+    so computing the size of a new state only visits the nodes that changed.
+    Shared subtrees are counted once for every place they appear in.
+    """
+    if type(data) in (ImmutableDict, ImmutableList):
+        return _stateSize(data)
+    return 1, sys.getsizeof(data)
+
+
+@attribute("_stateSize")
+def _stateSize(data):
+    nodes, size = 1, sys.getsizeof(data)
+    if type(data) is ImmutableDict:
+        for key, value in data.items():
+            n, s = stateSize(value)
+            nodes += n
+            size += s + sys.getsizeof(key)
+    else:
+        for value in data:
+            n, s = stateSize(value)
+            nodes += n
+            size += s
+    return nodes, size
+
+
 @attribute("plugins")
 def plugins(data):
     if type(data) is ImmutableDict:
         if "__plugin__" in data:
-            return ImmutableList([((), data)])
+            return ImmutableList([(Path(), data)])
 
     gen = (
         sorted(data.items())
@@ -72,7 +234,7 @@ def plugins(data):
         else enumerate(data)
     )
     return ImmutableList(
-        ((key,) + path, plugin)
+        (Path((key, *path)), plugin)
         for key, value in gen
         if type(value) in (ImmutableDict, ImmutableList)
         for path, plugin in plugins(value)
@@ -95,7 +257,7 @@ def symlinks(data):
     if sl is False:
         return ImmutableList()
     elif sl is not None:
-        return ImmutableList([((), sl)])
+        return ImmutableList([(Path(), sl)])
 
     gen = (
         sorted(data.items())
@@ -103,7 +265,7 @@ def symlinks(data):
         else enumerate(data)
     )
     return ImmutableList(
-        ((key,) + path, dest)
+        (Path((key, *path)), dest)
         for key, value in gen
         if type(value) in (ImmutableDict, ImmutableList)
         for path, dest in symlinks(value)
@@ -119,35 +281,160 @@ def symlinkInfoDict(data):
     return _symlinkInfoDict(symlinks(data))
 
 
+@attribute("_pluginInfoDict")
+def pluginInfoDict(data):
+    return ImmutableDict((pathToString(k), v) for k, v in data)
+
+
+@attribute("_sysReferences")
+def _sysReferences(data):
+    return frozenset(
+        tuple(dest[1:2]) for _, dest in data if dest[0:1] == ("sys",)
+    )
+
+
+def sysReferences(data):
+    """Set of entries of "/sys" that symlinks in ``data`` point into
+
+    Each entry is a tuple with the name of the entry, or an empty tuple if a
+    symlink points at "/sys" itself.
+    """
+    return _sysReferences(symlinks(data))
+
+
 @attribute("realpath")
 def realpath(data):
-    return functools.partial(_realpathImpl, dict(symlinks(data)))
-
-
-def _realpathImpl(symlink_table, location):
-    location = list(location)
-    result = ()
-    location_length_when_symlink_encountered = {}
-
-    while location:
-        first_element = location.pop(0)
-        result = result + (first_element,)
-        dest = symlink_table.get(result)
-        if dest is not None:
-            prevlength = location_length_when_symlink_encountered.get(result)
-            if prevlength is not None and len(location) >= prevlength:
-                # We encountered some sort of cycle
-                return
-            location_length_when_symlink_encountered[result] = len(location)
-            location = list(dest) + location
-            result = ()
+    return SymlinkTrie(symlinks(data)).realpath
+
+
+class SymlinkTrie:
+    """Symlink table compiled into a trie, for resolving real paths
+
+    Resolution results are memoized in a second trie of ``_RealPathNode``,
+    one node per real path visited so far. A symlink becomes an edge to the
+    node of its resolved destination, so resolving a path takes one dict
+    lookup per path element once its prefixes have been resolved before, and
+    the ``Path`` of a node is only built when it is returned. Cycles are
+    detected when the destination of a symlink is resolved, and paths
+    through them resolve to ``None``.
+
+    The memo is accounted for by ``cachePolicy`` like a ``MetaCache``: it
+    is cleared when it reaches ``maxRealpathEntries`` entries, or when the
+    total budget is exceeded and it is the cache used least recently.
+    """
+
+    __slots__ = "__root", "__entries", "__stats", "__weakref__"
+
+    def __init__(self, symlink_table):
+        trie = _SymlinkNode()
+        for location, dest in symlink_table:
+            node = trie
+            for element in location:
+                try:
+                    node = node.children[element]
+                except KeyError:
+                    child = node.children[element] = _SymlinkNode()
+                    node = child
+            node.dest = dest
+        self.__root = _RealPathNode(None, None, trie)
+        self.__root.path = Path()
+        self.__entries = 0
+        self.__stats = cachePolicy.stats["realpath-memo"]
+
+    def __len__(self):
+        return self.__entries
+
+    def __del__(self):
+        cachePolicy.totalEntries -= self.__entries
+        cachePolicy.forget(self)
+
+    def clear(self):
+        self.__stats.evictions += self.__entries
+        cachePolicy.totalEntries -= self.__entries
+        self.__entries = 0
+        self.__root.children.clear()
+
+    def realpath(self, location):
+        entries = self.__entries
+        if entries >= cachePolicy.maxRealpathEntries:
+            self.clear()
+            entries = 0
+        node = self.__resolve(location)
+        if self.__entries == entries:
+            self.__stats.hits += 1
+        else:
+            self.__stats.misses += 1
+            cachePolicy.totalEntries += self.__entries - entries
+            cachePolicy.touch(self)
+            if cachePolicy.totalEntries > cachePolicy.maxTotalEntries:
+                cachePolicy.enforceBudget()
+        path = node.path
+        if path is Undefined:
+            # Build the path of the node from the elements of its ancestors
+            elements = []
+            n = node
+            while n.path is Undefined:
+                elements.append(n.element)
+                n = n.parent
+            elements.extend(reversed(n.path))
+            path = node.path = Path(reversed(elements))
+        return path
+
+    def __step(self, node, element):
+        symlink_node = node.symlinkNode
+        if symlink_node is not None:
+            symlink_node = symlink_node.children.get(element)
+            if symlink_node is not None and symlink_node.dest is not None:
+                if symlink_node.resolving:
+                    return _unresolvable
+                symlink_node.resolving = True
+                try:
+                    return self.__resolve(symlink_node.dest)
+                finally:
+                    symlink_node.resolving = False
+        return _RealPathNode(node, element, symlink_node)
+
+    def __resolve(self, location):
+        node = self.__root
+        for element in location:
+            try:
+                node = node.children[element]
+            except KeyError:
+                child = node.children[element] = self.__step(node, element)
+                self.__entries += 1
+                node = child
+            if node is _unresolvable:
+                break
+        return node
 
-    return result
+
+class _SymlinkNode:
+    __slots__ = "children", "dest", "resolving"
+
+    def __init__(self):
+        self.children = {}
+        self.dest = None
+        self.resolving = False
+
+
+class _RealPathNode:
+    __slots__ = "parent", "element", "symlinkNode", "children", "path"
+
+    def __init__(self, parent, element, symlink_node):
+        self.parent = parent
+        self.element = element
+        self.symlinkNode = symlink_node
+        self.children = {}
+        self.path = Undefined  # computed on demand
+
+
+_unresolvable = _RealPathNode(None, None, None)
+_unresolvable.path = None
 
 
 @attribute("_realpaths")
 def _realpaths(data):
-    rp = functools.partial(_realpathImpl, dict(data))
+    rp = SymlinkTrie(data).realpath
     return ImmutableList(
         (location, real_destination)
         for location, real_destination in (
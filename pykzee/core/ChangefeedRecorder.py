@@ -0,0 +1,79 @@
+import asyncio
+import gzip
+import time
+
+from pyimmutable import ImmutableDict
+from pykzee.core.common import diffState, dumpJson, Path, Undefined
+
+
+class ChangefeedRecorder:
+    """Record every change that reaches a ``ManagedTree`` to a file
+
+    The changefeed is a file of JSON arrays, one per line (gzip-compressed if
+    the file name ends in ``.gz``). The first line is a header,
+    ``["changefeed", 1, start_time]``. It is followed by one entry per change,
+    each with a timestamp in seconds since the start of the recording:
+
+    * ``["raw", t, changes]``: a new raw state was loaded. ``changes`` is the
+      list of ``[path, value]`` (or ``[path]`` for deleted paths) that turn
+      the previous raw state into the new one.
+    * ``["set", t, plugin_path, path, value]`` or
+      ``["set", t, plugin_path, path]``: a plugin set (or deleted) ``path``
+      in its state.
+
+    Entries made during one iteration of the event loop are written
+    together. Use ``ChangefeedReplay`` to replay a changefeed.
+    """
+
+    __slots__ = (
+        "__file",
+        "__start",
+        "__rawState",
+        "__buffer",
+        "__flushScheduled",
+    )
+
+    def __init__(self, filename):
+        if filename.endswith(".gz"):
+            self.__file = gzip.open(filename, "wt")
+        else:
+            self.__file = open(filename, "w")
+        self.__start = time.monotonic()
+        self.__rawState = ImmutableDict()
+        self.__buffer = []
+        self.__flushScheduled = False
+        self.__append(["changefeed", 1, time.time()])
+
+    def rawState(self, state):
+        changes = [
+            [list(path)] if value is Undefined else [list(path), value]
+            for path, value in diffState(self.__rawState, state)
+        ]
+        self.__rawState = state
+        self.__append(["raw", self.__timestamp(), changes])
+
+    def pluginState(self, plugin_path: Path, path: Path, value):
+        entry = ["set", self.__timestamp(), plugin_path.string, list(path)]
+        if value is not Undefined:
+            entry.append(value)
+        self.__append(entry)
+
+    def flush(self):
+        self.__flushScheduled = False
+        if self.__buffer:
+            self.__file.write("".join(self.__buffer))
+            self.__buffer = []
+            self.__file.flush()
+
+    def close(self):
+        self.flush()
+        self.__file.close()
+
+    def __timestamp(self):
+        return round(time.monotonic() - self.__start, 6)
+
+    def __append(self, entry):
+        self.__buffer.append(dumpJson(entry) + "\n")
+        if not self.__flushScheduled:
+            self.__flushScheduled = True
+            asyncio.get_event_loop().call_soon(self.flush)
@@ -0,0 +1,200 @@
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import time
+
+from pyimmutable import ImmutableDict, ImmutableList
+from pykzee.core.common import (
+    getDataForPath,
+    makePath,
+    setDataForPath,
+    Undefined,
+)
+from pykzee.core.ManagedTree import ManagedTree
+
+
+# The ReplayPlugin instances of the running replay, by path. This lives here
+# rather than in the ReplayPlugin module, which ManagedTree re-imports.
+replayPlugins = {}
+
+
+class ChangefeedReplay:
+    """Replay a changefeed written by ``ChangefeedRecorder``
+
+    Raw states and plugin states are fed into a new ``ManagedTree`` in the
+    recorded order, either with the recorded timing (scaled by ``speed``) or,
+    if ``speed`` is ``None``, as fast as possible. Plugins are not run:
+    ``ReplayPlugin`` takes their place and publishes the recorded states,
+    so only one replay can run at a time.
+    The duration of every update cycle is collected in ``cycles``, as
+    ``(duration, state_updated)`` pairs.
+    """
+
+    replayPluginIdentifier = "pykzee.core.ReplayPlugin.ReplayPlugin"
+
+    def __init__(self, filename, *, speed=None, **managed_tree_kwargs):
+        self.filename = filename
+        self.speed = speed
+        self.cycles = []
+        self.managedTree = ManagedTree(
+            update_cycle_callback=lambda duration, state_updated: (
+                self.cycles.append((duration, state_updated))
+            ),
+            **managed_tree_kwargs,
+        )
+        self.duration = None
+
+    async def run(self):
+        replayPlugins.clear()
+        raw_state = replaced_state = ImmutableDict()
+        opener = gzip.open if self.filename.endswith(".gz") else open
+        start = time.monotonic()
+        with opener(self.filename, "rt") as f:
+            header = json.loads(next(f))
+            if header[:2] != ["changefeed", 1]:
+                raise Exception(f"{ self.filename } is not a changefeed")
+            for line in readLines(f):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn write at the end of the changefeed
+                    logging.warning(
+                        f"ChangefeedReplay: ignoring invalid entry { line !r}"
+                    )
+                    continue
+                if self.speed is not None:
+                    delay = start + entry[1] / self.speed - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                if entry[0] == "raw":
+                    for path, *value in entry[2]:
+                        raw_state = setDataForPath(
+                            raw_state, path, value[0] if value else Undefined
+                        )
+                    # Only the changed parts of the raw state are replaced
+                    # again, so unchanged subtrees keep their identity
+                    for path, *_ in entry[2]:
+                        replaced_state = replacePluginsAt(
+                            replaced_state,
+                            raw_state,
+                            path,
+                            self.replayPluginIdentifier,
+                        )
+                    self.managedTree.setRawState(replaced_state)
+                elif entry[0] == "set":
+                    plugin = replayPlugins.get(makePath(entry[2]))
+                    if plugin is None:
+                        logging.warning(
+                            f"ChangefeedReplay: no plugin at { entry[2] }"
+                        )
+                        continue
+                    plugin.set(
+                        entry[3], entry[4] if len(entry) > 4 else Undefined
+                    )
+                if self.speed is None:
+                    # Give the update task a chance to run, as it would have
+                    # between the recorded changes
+                    await asyncio.sleep(0)
+
+        await asyncio.sleep(0)
+        self.duration = time.monotonic() - start
+
+    def report(self):
+        durations = sorted(duration for duration, _ in self.cycles)
+        count = len(durations)
+        lines = [
+            f"replayed { self.filename } in { self.duration :.3f}s",
+            f"update cycles: { count } "
+            f"({ sum(1 for _, updated in self.cycles if updated) } "
+            f"with state changes)",
+        ]
+        if durations:
+            lines.append(
+                "cycle duration (ms): "
+                f"mean { 1000 * sum(durations) / count :.3f}, "
+                f"median { 1000 * durations[count // 2] :.3f}, "
+                f"p95 { 1000 * durations[int(count * 0.95)] :.3f}, "
+                f"max { 1000 * durations[-1] :.3f}"
+            )
+        return "\n".join(lines)
+
+
+def replacePlugins(data, identifier):
+    if type(data) is ImmutableDict:
+        if "__plugin__" in data:
+            return data.set("__plugin__", identifier)
+        return ImmutableDict(
+            (key, replacePlugins(value, identifier))
+            for key, value in data.items()
+        )
+    if type(data) is ImmutableList:
+        return ImmutableList(replacePlugins(x, identifier) for x in data)
+    return data
+
+
+def replacePluginsAt(replaced, raw_state, path, identifier):
+    """Update ``replaced`` for a change of ``raw_state`` at ``path``
+
+    ``replaced`` is the result of ``replacePlugins`` for the raw state
+    before the change. A change within the configuration of a plugin (or
+    of its ``__plugin__`` key) replaces the whole plugin configuration.
+    """
+    path = tuple(path)
+    data = raw_state
+    for idx in range(len(path)):
+        if type(data) is ImmutableDict and "__plugin__" in data:
+            path = path[:idx]
+            break
+        data = getDataForPath(data, path[idx : idx + 1])
+    else:
+        if path and path[-1] == "__plugin__":
+            path = path[:-1]
+    return setDataForPath(
+        replaced,
+        path,
+        replacePlugins(getDataForPath(raw_state, path), identifier),
+    )
+
+
+def readLines(f):
+    # A compressed changefeed that was not closed properly lacks the end of
+    # the gzip stream
+    try:
+        yield from f
+    except EOFError:
+        logging.warning("ChangefeedReplay: the changefeed ends unexpectedly")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Replay a changefeed and report update cycle timings"
+    )
+    parser.add_argument("changefeed", help="changefeed file to replay")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        help=(
+            "replay with the recorded timing, sped up by this factor "
+            "(default: replay as fast as possible)"
+        ),
+    )
+    options = parser.parse_args()
+
+    # When run with `python -m`, this module is __main__, and ReplayPlugin
+    # registers with a separate instance of it
+    from pykzee.core import ChangefeedReplay as module
+
+    async def amain():
+        replay = module.ChangefeedReplay(
+            options.changefeed, speed=options.speed
+        )
+        await replay.run()
+        print(replay.report())
+
+    asyncio.run(amain())
+
+
+if __name__ == "__main__":
+    main()
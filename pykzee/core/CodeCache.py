@@ -0,0 +1,85 @@
+import collections
+import hashlib
+import importlib.util
+import logging
+import marshal
+import os
+import traceback
+
+
+class CodeCache:
+    """Cache of compiled code, for ``CodePlugin``
+
+    Code objects are cached in memory (at most ``maxEntries`` of them) by a
+    hash of the source code and the filename (which is part of the code
+    object), and, if ``directory`` is set, on disk in marshal format.
+
+    The cache lives in this module rather than in the CodePlugin module,
+    which ManagedTree re-imports every time it creates a plugin.
+    """
+
+    __slots__ = "directory", "maxEntries", "hits", "misses", "__entries"
+
+    def __init__(self, *, directory=None, max_entries=1024):
+        self.directory = directory
+        self.maxEntries = max_entries
+        self.hits = self.misses = 0
+        self.__entries = collections.OrderedDict()
+
+    def clear(self):
+        self.__entries.clear()
+
+    def compile(self, source, filename):
+        """Compile ``source`` in "exec" mode, reusing previous results"""
+        key = hashlib.sha256(
+            b"\0".join(
+                (
+                    importlib.util.MAGIC_NUMBER,
+                    filename.encode("utf-8", "surrogatepass"),
+                    source.encode("utf-8", "surrogatepass"),
+                )
+            )
+        ).hexdigest()
+
+        entries = self.__entries
+        code = entries.get(key)
+        if code is not None:
+            entries.move_to_end(key)
+            self.hits += 1
+            return code
+
+        cache_path = None
+        if self.directory is not None:
+            cache_path = os.path.join(self.directory, f"{ key }.marshal")
+            try:
+                with open(cache_path, "rb") as f:
+                    code = marshal.load(f)
+            except FileNotFoundError:
+                ...
+            except Exception:
+                logging.warning(
+                    f"CodeCache: ignoring invalid cache file { cache_path }"
+                )
+
+        if code is None:
+            self.misses += 1
+            code = compile(source, filename, "exec")
+            if cache_path is not None:
+                try:
+                    os.makedirs(self.directory, exist_ok=True)
+                    tmp_path = f"{ cache_path }.{ os.getpid() }.tmp"
+                    with open(tmp_path, "wb") as f:
+                        marshal.dump(code, f)
+                    os.replace(tmp_path, cache_path)
+                except OSError:
+                    traceback.print_exc()
+        else:
+            self.hits += 1
+
+        entries[key] = code
+        if len(entries) > self.maxEntries:
+            entries.popitem(last=False)
+        return code
+
+
+codeCache = CodeCache()
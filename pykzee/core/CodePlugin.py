@@ -3,6 +3,7 @@ import functools
 import inspect
 import traceback
 
+from pykzee.core.CodeCache import codeCache
 from pykzee.core.common import call_soon, Undefined, pathToString
 from pykzee.core.Plugin import Plugin
 
@@ -29,22 +30,32 @@ environment.update(Undefined=Undefined, call_soon=call_soon)
 
 class CodePlugin(Plugin):
     def init(self, config):
+        self.__source = config.get("code.py")
         try:
-            code = compile(
+            code = codeCache.compile(
                 config["code.py"],
                 f"<{ pathToString(self.path + ('code.py',)) }>",
-                "exec",
             )
             globals = {
                 "__builtins__": dict(
                     environment,
                     path=self.path,
                     get=self.get,
+                    history=self.history,
                     subscribe=self.subscribe,
                     command=self.command,
                     set_state=self.set,
+                    edit_state=self.edit,
+                    create_publisher=self.createPublisher,
                     register_command=self.registerCommand,
+                    register_commands=self.registerCommands,
+                    register_query=self.registerQuery,
+                    every=self.every,
+                    at=self.at,
+                    after=self.after,
                     state_from_subscription=self.stateFromSubscription,
+                    reactive_state=self.reactiveState,
+                    restored_state=self.restoredState,
                 )
             }
             exec(code, globals)
@@ -53,6 +64,10 @@ class CodePlugin(Plugin):
                 (), {"exception": str(ex), "traceback": traceback.format_exc()}
             )
 
+    def updateConfig(self, new_config):
+        # Only changes to the code require the plugin to be recreated
+        return new_config.get("code.py") == self.__source
+
     def stateFromSubscription(self, handler, *paths):
         handler = functools.partial(self.subscriptionCallback, handler)
         if paths:
@@ -62,6 +77,28 @@ class CodePlugin(Plugin):
             call_soon(handler)
             return lambda: None
 
+    def reactiveState(self, handler):
+        """Publish the result of ``handler(get)`` as the plugin state
+
+        The handler is re-run whenever any of the state it read through the
+        ``get`` function passed to it changes.
+        """
+
+        async def run(get):
+            try:
+                ret = handler(get)
+                if inspect.isawaitable(ret):
+                    ret = await ret
+                return ret
+            except Exception as ex:
+                return {
+                    "exception": str(ex),
+                    "traceback": traceback.format_exc(),
+                }
+
+        self.set((), "Waiting for first run...")
+        return self.reactive(run, functools.partial(self.set, ()))
+
     async def subscriptionCallback(self, handler, *state):
         try:
             ret = handler(*state)
@@ -2,66 +2,75 @@ import asyncio
 import collections
 import collections.abc
 import functools
-
+import heapq
 import importlib
 import inspect
+import itertools
 import logging
 import sys
+import time
 import traceback
 
 from pyimmutable import ImmutableDict, ImmutableList
 
 from pykzee.core.common import (
-    call_soon,
+    diffState,
     getDataForPath,
     makePath,
-    pathToString,
+    Path,
     PathType,
     print_exception_task_callback,
     sanitize,
     setDataForPath,
+    StateEdits,
+    StateQuotaExceeded,
     Undefined,
 )
 from pykzee.core import AttachedInfo
+from pykzee.core.Query import Query
+from pykzee.core.StateHistory import StateHistory
+from pykzee.core.TimerService import TimerService
 
 
-SubscriptionSlot = collections.namedtuple(
-    "SubscriptionSlot", ("path", "directory")
-)
+class Subscription:
+    """A subscription of a plugin to the data at one or more paths
 
+    The data at the paths is kept in an ``ImmutableList``, which is
+    interned, so subscriptions to the same paths share it.
+    """
 
-class Subscription:
     __slots__ = (
         "plugin",
-        "slots",
+        "directories",
+        "positions",
         "callback",
+        "priority",
+        "queuedAt",
         "__currentState",
         "__reportedState",
+        "__inFlight",
+        "__pending",
         "disabled",
     )
 
-    def __init__(self, plugin, slots, callback, state, initial: bool):
-        if (
-            type(slots) != tuple
-            or any(type(slot) is not SubscriptionSlot for slot in slots)
-            or type(state) != ImmutableList
-            or not len(slots) == len(state)
-        ):
-            logging.error(  # FIXME REMOVE
-                "Subscription constructor called with invalid arguments: "
-                f"slots={ slots !r} len(state)={ len(state) }"
-            )
-            raise Exception(
-                "Subscription constructor called with invalid arguments: "
-                f"slots={ slots !r} len(state)={ len(state) }"
-            )
+    def __init__(
+        self, plugin, directories, callback, initial: bool, priority=0
+    ):
         self.plugin = plugin
-        self.slots = slots
+        self.directories = directories
+        # Index into directories[idx].subscriptions, for each idx
+        self.positions = [None] * len(directories)
         self.callback = callback
-        self.__currentState = state
+        self.priority = priority
+        self.queuedAt = None
+        self.__currentState = ImmutableList([d.state for d in directories])
         self.__reportedState = (
-            ImmutableList(Undefined for _ in slots) if initial else state
+            ImmutableList(Undefined for _ in directories)
+            if initial
+            else self.__currentState
         )
+        self.__inFlight = False
+        self.__pending = False
         self.disabled = False
 
     def setCurrentState(self, idx, state):
@@ -72,21 +81,159 @@ class Subscription:
     def getState(self):
         return self.__currentState
 
-    def update(self):
-        if (
-            not self.disabled
-            and self.__reportedState is not self.__currentState
-        ):
-            self.__reportedState = self.__currentState
-            call_soon(self.callback, *self.__currentState)
+    def cancel(self):
+        if self.disabled:
+            return
+        self.disabled = True
+        for idx, directory in enumerate(self.directories):
+            directory.removeSubscription(self, idx)
+            directory.garbageCollect()
+        self.plugin.subscriptions.discard(self)
+
+    def update(self, dispatcher):
+        if self.disabled or self.__reportedState is self.__currentState:
+            return
+        if self.__inFlight:
+            # The previous (asynchronous) call has not finished yet. It is
+            # followed by a single call with the latest state, superseding
+            # any notification that was already pending.
+            if self.__pending:
+                self.plugin.droppedNotifications += 1
+            self.__pending = True
+            return
+
+        self.__reportedState = self.__currentState
+        try:
+            ret = self.callback(*self.__currentState)
+            if inspect.isawaitable(ret):
+                self.__inFlight = True
+                self.plugin.inFlightNotifications += 1
+                future = asyncio.ensure_future(ret)
+                future.add_done_callback(print_exception_task_callback)
+                future.add_done_callback(
+                    functools.partial(self.__callbackDone, dispatcher)
+                )
+        except Exception:
+            traceback.print_exc()
+
+    def __callbackDone(self, dispatcher, future):
+        self.__inFlight = False
+        self.plugin.inFlightNotifications -= 1
+        if self.__pending:
+            # The call with the latest state is dispatched like any other
+            # notification, in priority order
+            self.__pending = False
+            dispatcher.requeue(self)
+
+
+class SubscriptionDispatcher:
+    """Queue of subscriptions waiting for their callback to be called
+
+    Subscriptions are dispatched in order of descending priority (and in the
+    order they were queued within the same priority). ``dispatch`` returns
+    once its time budget is used up, so that the caller can yield to the
+    event loop in between.
+
+    Callbacks are called directly by ``dispatch`` (rather than scheduled with
+    ``call_soon``), so that their run time counts against the budget and
+    they run in priority order. A callback may call back into the
+    ``ManagedTree``: state it sets is picked up by the next update cycle,
+    subscriptions it cancels are skipped, and subscriptions it makes are
+    notified in the next cycle.
+    """
+
+    __slots__ = "__queue", "__sequence", "__stats", "__wakeup"
+
+    def __init__(self, *, wakeup=None):
+        self.__queue = []  # heap of (-priority, sequence number, sub)
+        self.__sequence = itertools.count()
+        self.__stats = collections.defaultdict(DispatchStats)
+        self.__wakeup = wakeup
+
+    def __bool__(self):
+        return bool(self.__queue)
+
+    def enqueue(self, subs):
+        now = time.monotonic()
+        for sub in subs:
+            if sub.queuedAt is None:
+                sub.queuedAt = now
+                heapq.heappush(
+                    self.__queue, (-sub.priority, next(self.__sequence), sub)
+                )
+                self.__stats[sub.priority].queued += 1
+
+    def requeue(self, sub):
+        """Queue ``sub`` from outside of the update cycle"""
+        self.enqueue((sub,))
+        if self.__wakeup is not None:
+            self.__wakeup()
+
+    def dispatch(self, budget):
+        """Dispatch queued subscriptions for up to ``budget`` seconds
+
+        Returns whether there are subscriptions left in the queue.
+        """
+        queue = self.__queue
+        now = time.monotonic()
+        deadline = now + budget
+        while queue:
+            _, _, sub = heapq.heappop(queue)
+            self.__stats[sub.priority].record(now - sub.queuedAt)
+            sub.queuedAt = None
+            sub.update(self)
+            # At least one subscription is dispatched, but no more once the
+            # budget is used up
+            now = time.monotonic()
+            if now >= deadline:
+                break
+        return bool(queue)
+
+    def stats(self):
+        return ImmutableDict(
+            (str(priority), stats.info())
+            for priority, stats in sorted(self.__stats.items())
+        )
+
+
+class DispatchStats:
+    __slots__ = "queued", "dispatched", "totalLateness", "maxLateness"
+
+    def __init__(self):
+        self.queued = self.dispatched = 0
+        self.totalLateness = self.maxLateness = 0.0
+
+    def record(self, lateness):
+        self.queued -= 1
+        self.dispatched += 1
+        self.totalLateness += lateness
+        self.maxLateness = max(self.maxLateness, lateness)
+
+    def info(self):
+        return ImmutableDict(
+            queued=self.queued,
+            dispatched=self.dispatched,
+            mean_lateness=self.totalLateness / max(1, self.dispatched),
+            max_lateness=self.maxLateness,
+        )
 
 
 class Directory:
+    """A node of the tree of subscribed paths
+
+    Directories exist only for paths that are subscribed to (or lead to
+    one), and are shared by all subscriptions of a path. Subscribers are
+    kept in an array with a parallel array of slot indices; a subscription
+    records its position in it, so that it can be removed in constant time
+    by moving the last entry into its place.
+    """
+
     __slots__ = (
         "parent",
         "pathElement",
         "subdirectories",
         "subscriptions",
+        "indices",
         "state",
     )
 
@@ -94,7 +241,8 @@ class Directory:
         self.parent = parent
         self.pathElement = path_element
         self.subdirectories = {}
-        self.subscriptions = set()  # (sub, idx) tuples
+        self.subscriptions = []
+        self.indices = []  # the slot index of each of self.subscriptions
         self.state = Undefined
         try:
             if type(parent.state) in (ImmutableDict, ImmutableList):
@@ -114,22 +262,37 @@ class Directory:
             d = sd
         return d
 
+    def addSubscription(self, sub, idx):
+        sub.positions[idx] = len(self.subscriptions)
+        self.subscriptions.append(sub)
+        self.indices.append(idx)
+
+    def removeSubscription(self, sub, idx):
+        position = sub.positions[idx]
+        last_sub = self.subscriptions.pop()
+        last_idx = self.indices.pop()
+        if position < len(self.subscriptions):
+            self.subscriptions[position] = last_sub
+            self.indices[position] = last_idx
+            last_sub.positions[last_idx] = position
+
     def garbageCollect(self):
-        parent = self.parent
-        if (
-            parent is not None
-            and not self.subdirectories
-            and not self.subscriptions
+        d = self
+        while (
+            d.parent is not None
+            and not d.subdirectories
+            and not d.subscriptions
         ):
-            del parent.subdirectories[self.pathElement]
-            self.parent = None
-            parent.garbageCollect()
+            parent = d.parent
+            del parent.subdirectories[d.pathElement]
+            d.parent = None
+            d = parent
 
     def update(self, new_state, updated_subscriptions):
         if new_state is self.state:
             return
 
-        for sub, idx in self.subscriptions:
+        for sub, idx in zip(self.subscriptions, self.indices):
             if sub.setCurrentState(idx, new_state):
                 updated_subscriptions.add(sub)
 
@@ -147,7 +310,7 @@ class Directory:
 
 
 class Command:
-    __slots__ = "path", "name", "function", "doc", "plugin", "disabled"
+    __slots__ = "path", "name", "function", "doc", "plugin", "info", "disabled"
 
     def __init__(self, path, name, function, doc, plugin):
         self.path = path
@@ -155,6 +318,9 @@ class Command:
         self.function = function
         self.doc = doc
         self.plugin = plugin
+        self.info = sanitize(
+            {"doc": doc, "signature": str(inspect.signature(function))}
+        )
         self.disabled = False
 
 
@@ -166,6 +332,14 @@ class PluginInfo:
         "state",
         "subscriptions",
         "registeredCommands",
+        "registeredQueries",
+        "quotaViolations",
+        "throttledUntil",
+        "throttledPublish",
+        "inFlightNotifications",
+        "droppedNotifications",
+        "lazy",
+        "lastUsed",
         "disabled",
     )
 
@@ -176,36 +350,156 @@ class PluginInfo:
         self.state = None
         self.subscriptions = set()
         self.registeredCommands = set()
+        self.registeredQueries = set()
+        self.quotaViolations = 0
+        self.throttledUntil = None
+        self.throttledPublish = None
+        self.inFlightNotifications = 0
+        self.droppedNotifications = 0
+        self.lazy = None
+        self.lastUsed = None
         self.disabled = False
 
 
+class LazyConfig:
+    """The ``__lazy__`` setting of a plugin configuration
+
+    ``__lazy__`` is either ``true`` or an object with the optional keys
+    ``idle_timeout`` (seconds without use after which the plugin is shut
+    down again) and ``commands`` (the commands that the plugin registers,
+    each given as a name, for a command at the plugin's path, or as a
+    ``[path, name]`` pair with a path relative to the plugin's).
+    """
+
+    __slots__ = "idleTimeout", "commands"
+
+    def __init__(self, config):
+        if type(config) is not ImmutableDict:
+            config = ImmutableDict()
+        self.idleTimeout = config.get("idle_timeout")
+        self.commands = tuple(
+            ((), command) if type(command) is str else tuple(command)
+            for command in config.get("commands", ())
+        )
+
+
 class ManagedTree:
     __slots__ = """
     __rawState __state __unresolvedState __realpath
     __subscriptionRoot __updatedSubscriptions
-    __pluginInfos __pluginList __coreState
-    __commands
+    __pluginInfos __pluginList __coreState __lazyPlugins
+    __sysSources __lazySysCache __fullState
+    __commands __dirtyCommandPaths __queries __history __journal __changefeed
+    __snapshot
+    __updateCycleCallback
+    __dispatcher __dispatchBudget __timers
     __stateUpdateEvent __stateUpdateTask
     """.strip().split()
 
-    def __init__(self):
+    # Entries of /sys that are only computed when a subscription (or a
+    # symlink) refers to them, or when they are read with `get`
+    lazySysEntries = frozenset(
+        (
+            "raw",
+            "plugins",
+            "symlinks",
+            "unresolved",
+            "sizes",
+            "dispatch",
+            "notifications",
+            "caches",
+            "timers",
+            "lazy_plugins",
+        )
+    )
+
+    def __init__(
+        self,
+        *,
+        history_max_count=1,
+        history_max_age=None,
+        history_max_bytes=None,
+        journal=None,
+        dispatch_budget=0.005,
+        changefeed=None,
+        snapshot=None,
+        update_cycle_callback=None,
+        timer_coalesce_window=0.01,
+    ):
         empty_dict = ImmutableDict()
         self.__rawState = self.__unresolvedState = self.__state = empty_dict
         self.__realpath = makePath
         self.__subscriptionRoot = Directory(None, None)
         self.__updatedSubscriptions = set()
         self.__pluginInfos = []
+        self.__lazyPlugins = {}  # path -> PluginInfo of a lazy plugin
         self.__pluginList = ImmutableList()
-        self.__coreState = ImmutableDict(commands=empty_dict)
+        self.__coreState = ImmutableDict(
+            commands=empty_dict, queries=empty_dict
+        )
+        self.__sysSources = None
+        self.__lazySysCache = {}
+        self.__fullState = None
         self.__commands = {}  # path -> {name: Command}
+        self.__dirtyCommandPaths = set()
+        self.__queries = {}  # name -> (Query, PluginInfo)
+        self.__dispatcher = SubscriptionDispatcher(
+            wakeup=lambda: self.__stateUpdateEvent.set()
+        )
+        self.__dispatchBudget = dispatch_budget
+        self.__timers = TimerService(coalesce_window=timer_coalesce_window)
+        self.__history = StateHistory(
+            max_count=history_max_count,
+            max_age=history_max_age,
+            max_bytes=history_max_bytes,
+        )
+        self.__history.record(time.time(), empty_dict)
+        self.__journal = journal
+        self.__changefeed = changefeed
+        self.__snapshot = snapshot
+        self.__updateCycleCallback = update_cycle_callback
         self.__stateUpdateEvent = asyncio.Event()
         self.__stateUpdateTask = asyncio.create_task(
             self.__stateUpdateTaskImpl()
         )
         self.__stateUpdateTask.add_done_callback(print_exception_task_callback)
 
-    def get(self, path: PathType):
-        return getDataForPath(self.__state, makePath(path))
+    def get(self, path: PathType, *, at=None):
+        """Return the data at ``path``
+
+        If ``at`` is given, return the data at ``path`` in the state that was
+        current at that time (a timestamp as returned by ``time.time()``), or
+        ``Undefined`` if that state is not retained in the state history.
+        """
+        path = makePath(path)
+        if at is not None:
+            return self.__history.get(path, at)
+        if path and path[0] != "sys":
+            if self.__lazyPlugins:
+                started = self.__useLazyPlugin(path)
+                if started is not None:
+                    # The plugin was just started, and its state is not part
+                    # of the current state yet
+                    plugin_info, real_path = started
+                    return getDataForPath(
+                        plugin_info.state, real_path[len(plugin_info.path) :]
+                    )
+            return getDataForPath(self.__state, path)
+
+        if len(path) < 2:
+            return getDataForPath(self.__getFullState(), path)
+        if path[1] in self.lazySysEntries and self.__sysSources is not None:
+            return getDataForPath(self.__getLazySysEntry(path[1]), path[2:])
+        return getDataForPath(self.__state, path)
+
+    def history(self, path: PathType, *, since=None):
+        """List of ``(timestamp, value)`` pairs for the data at ``path``
+
+        The list starts with the value that was current at ``since`` (or the
+        oldest value retained in the state history) and has one entry for
+        every change of the value after that.
+        """
+        return self.__history.history(makePath(path), since)
 
     def setRawState(self, new_state: collections.abc.Mapping):
         new_state = sanitize(new_state)
@@ -218,22 +512,15 @@ class ManagedTree:
         if self.__rawState is new_state:
             return
 
+        if self.__changefeed is not None:
+            self.__changefeed.rawState(new_state)
         self.__rawState = new_state
         self.__updatePlugins()
 
-        new_sys = self.__coreState.update(
-            raw=new_state,
-            plugins=ImmutableDict(
-                (pathToString(path), config)
-                for path, config in self.__pluginList
-            ),
-        )
-
         for plugin in self.__pluginInfos:
             new_state = setDataForPath(new_state, plugin.path, plugin.state)
 
         self.__unresolvedState = new_state
-        self.__coreState = new_sys
         self.__stateUpdateEvent.set()
 
     def __updatePlugins(self):
@@ -260,6 +547,8 @@ class ManagedTree:
 
             if not have_new or (have_old and opi.path < npath):
                 self.__removePlugin(opi)
+                if self.__journal is not None:
+                    self.__journal.discard(opi.path)
                 old_index += 1
             elif not have_old or (have_new and npath < opi.path):
                 new_plugin_infos.append(self.__newPlugin(npath, nconfig))
@@ -277,26 +566,168 @@ class ManagedTree:
         plugin_object = plugin_info.plugin_object
         subscriptions = plugin_info.subscriptions
         registered_commands = plugin_info.registeredCommands
+        registered_queries = plugin_info.registeredQueries
 
         plugin_info.configuration = None
         plugin_info.plugin_object = None
         plugin_info.state = None
         plugin_info.subscriptions = set()
         plugin_info.registeredCommands = set()
+        plugin_info.registeredQueries = set()
+
+        if self.__lazyPlugins.get(plugin_info.path) is plugin_info:
+            del self.__lazyPlugins[plugin_info.path]
 
         for sub in subscriptions:
             self.unsubscribe(sub)
 
-        for cmd in registered_commands:
-            self.unregisterCommand(cmd)
+        self.unregisterCommands(registered_commands)
+        for name in registered_queries:
+            self.unregisterQuery(name)
+        self.__timers.cancelPlugin(plugin_info)
+
+        if plugin_object is not None:
+            try:
+                plugin_object.shutdown()
+            except Exception:
+                ...
+
+    def __newPlugin(self, path, config):
+        path = Path(path)
+        plugin_info = PluginInfo(path=path, configuration=config)
+        lazy = config.get("__lazy__")
+        if not lazy:
+            self.__createPluginObject(plugin_info)
+            return plugin_info
+
+        # Lazy plugins are created on first use. Until then, placeholders
+        # stand in for the commands they declare.
+        try:
+            plugin_info.lazy = LazyConfig(lazy)
+            self.registerCommands(
+                plugin_info,
+                (
+                    (
+                        cmd_path,
+                        name,
+                        self.__lazyCommand(plugin_info, cmd_path, name),
+                        f"Starts the lazy plugin at { path.string }",
+                    )
+                    for cmd_path, name in plugin_info.lazy.commands
+                ),
+            )
+        except Exception as ex:
+            traceback.print_exc()
+            plugin_info.state = ImmutableDict(
+                exception=str(ex), traceback=traceback.format_exc()
+            )
+        else:
+            self.__lazyPlugins[path] = plugin_info
+        return plugin_info
+
+    def __lazyCommand(self, plugin_info, path, name):
+        path = plugin_info.path + makePath(path)
+
+        def command(*args, **kwargs):
+            self.__startLazyPlugin(plugin_info)
+            try:
+                function = self.command(path, name)
+            except KeyError:
+                raise Exception(
+                    f"Lazy plugin did not register command { path }:{ name }"
+                ) from None
+            return function(*args, **kwargs)
 
+        return command
+
+    def __useLazyPlugin(self, path):
+        """Note the use of ``path``, starting the lazy plugin it belongs to
+
+        If the plugin was started, returns it along with the path (``path``
+        or its real path) that lies within the plugin.
+        """
+        paths = {path}
         try:
-            plugin_object.shutdown()
+            paths.add(self.__realpath(path))
         except Exception:
             ...
+        for p in paths:
+            for prefix in (*p.ancestors, p):
+                plugin_info = self.__lazyPlugins.get(prefix)
+                if plugin_info is not None:
+                    if plugin_info.plugin_object is None:
+                        self.__startLazyPlugin(plugin_info)
+                        return plugin_info, p
+                    plugin_info.lastUsed = asyncio.get_event_loop().time()
+
+    def __startLazyPlugin(self, plugin_info):
+        if plugin_info.plugin_object is not None or plugin_info.disabled:
+            return
+        self.unregisterCommands(list(plugin_info.registeredCommands))
+        plugin_info.lastUsed = asyncio.get_event_loop().time()
+        self.__createPluginObject(plugin_info)
+        self.__set(plugin_info.path, plugin_info.state)
+        if plugin_info.lazy.idleTimeout is not None:
+            self.__timers.after(
+                plugin_info,
+                plugin_info.lazy.idleTimeout,
+                functools.partial(self.__checkIdle, plugin_info),
+            )
 
-    def __newPlugin(self, path, config):
-        plugin_info = PluginInfo(path=path, configuration=config)
+    def __checkIdle(self, plugin_info):
+        timeout = plugin_info.lazy.idleTimeout
+        idle = asyncio.get_event_loop().time() - plugin_info.lastUsed
+        if idle < timeout or self.__hasSubscribers(plugin_info):
+            self.__timers.after(
+                plugin_info,
+                max(timeout - idle, timeout / 10),
+                functools.partial(self.__checkIdle, plugin_info),
+            )
+            return
+
+        # Shut the plugin down, and put a dormant one in its place
+        path, config = plugin_info.path, plugin_info.configuration
+        index = self.__pluginInfos.index(plugin_info)
+        self.__removePlugin(plugin_info)
+        new_plugin_info = self.__newPlugin(path, config)
+        self.__pluginInfos[index] = new_plugin_info
+        self.__set(path, new_plugin_info.state)
+
+    def __hasSubscribers(self, plugin_info):
+        """Whether other plugins subscribe to paths within ``plugin_info``
+
+        This includes paths that lead into the plugin through symlinks.
+        """
+        plugin_path = plugin_info.path
+        paths = [plugin_path]
+        for location, dest in AttachedInfo.realpaths(self.__unresolvedState):
+            if dest[: len(plugin_path)] == plugin_path:
+                paths.append(location)
+            elif plugin_path[: len(dest)] == dest:
+                paths.append(location + plugin_path[len(dest) :])
+        directories = [
+            directory
+            for directory in (
+                self.__subscriptionRoot.get(path, create=False)
+                for path in paths
+            )
+            if directory is not None
+        ]
+        while directories:
+            directory = directories.pop()
+            for sub in directory.subscriptions:
+                if sub.plugin is not plugin_info:
+                    return True
+            directories.extend(directory.subdirectories.values())
+        return False
+
+    def __createPluginObject(self, plugin_info):
+        path, config = plugin_info.path, plugin_info.configuration
+        restored_state = Undefined
+        if self.__journal is not None:
+            restored_state = self.__journal.state(path)
+            if restored_state is not Undefined:
+                plugin_info.state = restored_state
 
         try:
             plugin_identifier = config["__plugin__"]
@@ -308,10 +739,15 @@ class ManagedTree:
             PluginType = getattr(mod, class_)
             plugin_info.plugin_object = PluginType(
                 path=path,
-                get=lambda path: self.get(path),
-                subscribe=lambda callback, *paths, initial=True: (
+                get=self.get,
+                history=self.history,
+                subscribe=lambda callback, *paths, initial=True, priority=0: (
                     self.subscribe(
-                        plugin_info, paths, callback, initial=initial
+                        plugin_info,
+                        paths,
+                        callback,
+                        initial=initial,
+                        priority=priority,
                     )
                 ),
                 command=self.command,
@@ -321,6 +757,16 @@ class ManagedTree:
                 register_command=functools.partial(
                     self.registerCommand, plugin_info
                 ),
+                register_commands=functools.partial(
+                    self.registerCommands, plugin_info
+                ),
+                register_query=functools.partial(
+                    self.registerQuery, plugin_info
+                ),
+                every=functools.partial(self.__timers.every, plugin_info),
+                at=functools.partial(self.__timers.at, plugin_info),
+                after=functools.partial(self.__timers.after, plugin_info),
+                restored_state=restored_state,
             )
             plugin_info.plugin_object.init(config)
         except Exception as ex:
@@ -330,8 +776,6 @@ class ManagedTree:
             )
             plugin_info.plugin_object = None
 
-        return plugin_info
-
     def __updatePlugin(self, plugin_info, new_config):
         if plugin_info.configuration is new_config:
             return plugin_info
@@ -377,45 +821,162 @@ class ManagedTree:
                 plugin_info.state, path, value, undefined=None
             )
             if plugin_info.state is not new_state:
+                old_state = plugin_info.state
+                quota = plugin_info.configuration.get("__quota__")
+                within_quota = quota is None or self.__checkQuota(
+                    plugin_info, quota, new_state
+                )
                 plugin_info.state = new_state
-                self.__set(plugin_info.path, new_state)
+                if self.__journal is not None:
+                    self.__journal.record(
+                        plugin_info.path, path, value, new_state
+                    )
+                if self.__changefeed is not None:
+                    if type(value) is StateEdits:
+                        # Record the paths that changed, not the whole subtree
+                        changes = diffState(
+                            getDataForPath(old_state, path),
+                            getDataForPath(new_state, path),
+                            path,
+                        )
+                    else:
+                        changes = (
+                            (makePath(path), getDataForPath(new_state, path)),
+                        )
+                    for changed_path, changed_value in changes:
+                        self.__changefeed.pluginState(
+                            plugin_info.path, changed_path, changed_value
+                        )
+                if within_quota:
+                    self.__set(plugin_info.path, new_state)
+                else:
+                    self.__throttle(plugin_info, quota)
+
+    def __checkQuota(self, plugin_info, quota, new_state):
+        """Check a new plugin state against the plugin's quota
+
+        The quota is given in the plugin configuration as ``__quota__``, an
+        object with the optional keys ``nodes`` and ``bytes`` (limits on the
+        size of the plugin state), and ``action``, which is either
+        ``"reject"`` (the default: raise ``StateQuotaExceeded`` in
+        ``set_state``, leaving the state unchanged) or ``"throttle"``. A
+        plugin whose state exceeds a throttling quota has its state
+        published to the tree at most once every ``throttle_interval``
+        seconds (default: 1), with the latest state. A warning is logged the
+        first time.
+        """
+        nodes, size = AttachedInfo.stateSize(new_state)
+        for limit, value in (("nodes", nodes), ("bytes", size)):
+            max_value = quota.get(limit)
+            if max_value is not None and value > max_value:
+                break
+        else:
+            return True
+
+        plugin_info.quotaViolations += 1
+        ex = StateQuotaExceeded(plugin_info.path, limit, value)
+        if quota.get("action", "reject") != "throttle":
+            raise ex
+        if plugin_info.quotaViolations == 1:
+            logging.warning(str(ex))
+        return False
+
+    def __throttle(self, plugin_info, quota):
+        if plugin_info.throttledPublish is not None:
+            return  # the latest state is published when it is due
+        now = asyncio.get_event_loop().time()
+        interval = quota.get("throttle_interval", 1.0)
+        due = plugin_info.throttledUntil
+        if due is None or due <= now:
+            plugin_info.throttledUntil = now + interval
+            self.__set(plugin_info.path, plugin_info.state)
+            return
+
+        def publish():
+            plugin_info.throttledPublish = None
+            plugin_info.throttledUntil = (
+                asyncio.get_event_loop().time() + interval
+            )
+            self.__set(plugin_info.path, plugin_info.state)
+
+        plugin_info.throttledPublish = self.__timers.after(
+            plugin_info, due - now, publish
+        )
 
     def command(self, path, cmd):
-        return self.__commands[makePath(path)][cmd].function
+        command = self.__commands[makePath(path)][cmd]
+        if command.plugin.lazy is not None:
+            command.plugin.lastUsed = asyncio.get_event_loop().time()
+        return command.function
+
+    def subscribe(
+        self, plugin_info, paths, callback, *, initial=True, priority=0
+    ):
+        """Subscribe to the data at ``paths``
 
-    def subscribe(self, plugin_info, paths, callback, *, initial=True):
+        ``callback`` is called with the data at each of the paths whenever
+        any of it changes. Callbacks of subscriptions with a higher
+        ``priority`` are called first.
+        """
         if plugin_info.disabled:
             raise Exception("disabled plugin must not subscribe")
-        slots = tuple(
-            SubscriptionSlot(path, self.__subscriptionRoot.get(path))
-            for path in map(makePath, paths)
+        paths = tuple(map(makePath, paths))
+        self.__materializeSys(paths)
+        if self.__lazyPlugins:
+            for path in paths:
+                self.__useLazyPlugin(path)
+        directories = tuple(map(self.__subscriptionRoot.get, paths))
+        sub = Subscription(
+            plugin_info, directories, callback, initial, priority
         )
-        state = ImmutableList(slot.directory.state for slot in slots)
-        sub = Subscription(plugin_info, slots, callback, state, initial)
         plugin_info.subscriptions.add(sub)
-        for idx, slot in enumerate(slots):
-            slot.directory.subscriptions.add((sub, idx))
+        for idx, directory in enumerate(directories):
+            directory.addSubscription(sub, idx)
         if initial:
             self.__updatedSubscriptions.add(sub)
             self.__stateUpdateEvent.set()
-        return lambda: self.unsubscribe(sub)
+        return sub.cancel
 
     def unsubscribe(self, sub):
-        sub.disabled = True
-        for idx, slot in enumerate(sub.slots):
-            slot.directory.subscriptions.discard((sub, idx))
-            slot.directory.garbageCollect()
-        sub.plugin.subscriptions.discard(sub)
+        sub.cancel()
 
     def registerCommand(
         self, plugin_info, path, name, function, *, doc=Undefined
     ):
+        return self.registerCommands(
+            plugin_info, ((path, name, function, doc),)
+        )[0]
+
+    def registerCommands(self, plugin_info, commands):
+        """Register many commands at once
+
+        ``commands`` is an iterable of ``(path, name, function)`` or
+        ``(path, name, function, doc)`` tuples. Returns a list of functions
+        that unregister the respective command.
+
+        The "/sys/commands" subtree is updated once per update cycle, for
+        all commands registered or unregistered since the last one.
+        """
         if plugin_info.disabled:
             raise Exception("Disabled plugins cannot register commands")
+        result = []
+        try:
+            for command in commands:
+                result.append(self.__registerCommand(plugin_info, *command))
+        except Exception:
+            for unregister in result:
+                unregister()
+            raise
+        finally:
+            self.__stateUpdateEvent.set()
+        return result
+
+    def __registerCommand(
+        self, plugin_info, path, name, function, doc=Undefined
+    ):
         path = plugin_info.path + makePath(path)
         if doc is Undefined:
             doc = function.__doc__
-        sig = inspect.signature(function)
         try:
             path_commands = self.__commands[path]
         except KeyError:
@@ -425,65 +986,302 @@ class ManagedTree:
         cmd = Command(path, name, function, doc, plugin_info)
         plugin_info.registeredCommands.add(cmd)
         path_commands[name] = cmd
+        self.__dirtyCommandPaths.add(path)
+        return functools.partial(self.unregisterCommand, cmd)
 
-        self.__setCore(
-            ("commands", pathToString(path), name),
-            {"doc": doc, "signature": str(sig)},
-        )
+    def unregisterCommand(self, cmd):
+        self.unregisterCommands((cmd,))
 
-        return lambda: self.__unregisterCommand(cmd)
+    def unregisterCommands(self, cmds):
+        for cmd in cmds:
+            if cmd.disabled:
+                continue
+            cmd.disabled = True
+            path_commands = self.__commands[cmd.path]
+            path_commands.pop(cmd.name)
+            cmd.plugin.registeredCommands.discard(cmd)
+            if not path_commands:
+                del self.__commands[cmd.path]
+            self.__dirtyCommandPaths.add(cmd.path)
+        self.__stateUpdateEvent.set()
 
-    def unregisterCommand(self, cmd):
-        if cmd.disabled:
+    def registerQuery(self, plugin_info, name, spec):
+        """Publish the result of a query at "/sys/queries/<name>"
+
+        See ``Query`` for the query specification. The result is kept up to
+        date with every new state, within the same update cycle. Query names
+        are global: a name can only be registered once, by any plugin, until
+        it is unregistered. Returns a function that unregisters the query.
+        """
+        if plugin_info.disabled:
+            raise Exception("Disabled plugins cannot register queries")
+        if name in self.__queries:
+            raise Exception(f"Query { name !r} already registered")
+        query = Query(spec)
+        query.update(self.__state)
+        self.__queries[name] = query, plugin_info
+        plugin_info.registeredQueries.add(name)
+        self.__setCore(("queries", name), query.result)
+        return functools.partial(self.unregisterQuery, name)
+
+    def unregisterQuery(self, name):
+        query_info = self.__queries.pop(name, None)
+        if query_info is not None:
+            query_info[1].registeredQueries.discard(name)
+            self.__setCore(
+                ("queries",), self.__coreState["queries"].discard(name)
+            )
+
+    def __updateQueries(self):
+        # Returns whether any query result changed. The core state is
+        # changed directly, as the caller puts the results into the state
+        # of the current update cycle.
+        if not self.__queries:
+            return False
+        updates = {
+            name: query.result
+            for name, (query, _) in self.__queries.items()
+            if query.update(self.__state)
+        }
+        if not updates:
+            return False
+        self.__coreState = self.__coreState.set(
+            "queries", self.__coreState["queries"].update(updates)
+        )
+        return True
+
+    def __flushCommands(self):
+        dirty_paths = self.__dirtyCommandPaths
+        if not dirty_paths:
             return
-        cmd.disabled = True
-        path_commands = self.__commands[cmd.path]
-        path_commands.pop(cmd.name)
-        cmd.plugin.registeredCommands.discard(cmd)
-        if not path_commands:
-            del self.__commands[cmd.path]
-            self.__setCore(("commands", pathToString(cmd.path)), Undefined)
+        self.__dirtyCommandPaths = set()
+
+        commands = self.__coreState["commands"]
+        updates = {}
+        for path in dirty_paths:
+            path_commands = self.__commands.get(path)
+            if path_commands:
+                updates[path.string] = ImmutableDict(
+                    (name, cmd.info) for name, cmd in path_commands.items()
+                )
+            else:
+                commands = commands.discard(path.string)
+        self.__setCore(("commands",), commands.update(updates))
+
+    def __demandedSysEntries(self, state):
+        root = self.__subscriptionRoot
+        sysdir = root.subdirectories.get("sys")
+        references = AttachedInfo.sysReferences(state)
+        if (
+            root.subscriptions
+            or (sysdir is not None and sysdir.subscriptions)
+            or () in references
+        ):
+            return self.lazySysEntries
+        names = {name for name, in references}
+        if sysdir is not None:
+            names.update(sysdir.subdirectories)
+        return self.lazySysEntries.intersection(names)
+
+    def __getLazySysEntry(self, name):
+        cache = self.__lazySysCache
+        try:
+            return cache[name]
+        except KeyError:
+            ...
+
+        state, core_state, raw_state, plugin_list = self.__sysSources
+        if name == "raw":
+            value = raw_state
+        elif name == "plugins":
+            value = AttachedInfo.pluginInfoDict(plugin_list)
+        elif name == "symlinks":
+            value = AttachedInfo.symlinkInfoDict(state)
+        elif name == "dispatch":
+            value = self.__dispatcher.stats()
+        elif name == "caches":
+            value = AttachedInfo.cachePolicy.info()
+        elif name == "timers":
+            value = self.__timers.stats()
+        elif name == "lazy_plugins":
+            value = ImmutableDict(
+                (
+                    path.string,
+                    ImmutableDict(active=plugin.plugin_object is not None),
+                )
+                for path, plugin in self.__lazyPlugins.items()
+            )
+        elif name == "sizes":
+            value = self.__stateSizes(state)
+        elif name == "notifications":
+            value = ImmutableDict(
+                (
+                    plugin.path.string,
+                    ImmutableDict(
+                        in_flight=plugin.inFlightNotifications,
+                        dropped=plugin.droppedNotifications,
+                    ),
+                )
+                for plugin in self.__pluginInfos
+            )
+        elif name == "unresolved":
+            value = state.set(
+                "sys",
+                core_state.update(
+                    (n, self.__getLazySysEntry(n))
+                    for n in self.lazySysEntries
+                    if n != "unresolved"
+                ),
+            )
         else:
-            self.__setCore(
-                ("commands", pathToString(cmd.path), cmd.name), Undefined
+            raise KeyError(name)
+
+        cache[name] = value
+        return value
+
+    def __stateSizes(self, state):
+        def size_info(data, **kwargs):
+            nodes, size = AttachedInfo.stateSize(data)
+            return ImmutableDict(nodes=nodes, bytes=size, **kwargs)
+
+        return ImmutableDict(
+            plugins=ImmutableDict(
+                (
+                    plugin.path.string,
+                    size_info(
+                        getDataForPath(state, plugin.path),
+                        quota_violations=plugin.quotaViolations,
+                    ),
+                )
+                for plugin in self.__pluginInfos
+            ),
+            tree=ImmutableDict(
+                (key, size_info(value)) for key, value in state.items()
+            ),
+        )
+
+    def __getFullState(self):
+        if self.__fullState is None:
+            if self.__sysSources is None:
+                return self.__state
+            sys_state = self.__state["sys"]
+            self.__fullState = self.__state.set(
+                "sys",
+                sys_state.update(
+                    (name, self.__getLazySysEntry(name))
+                    for name in self.lazySysEntries
+                ),
+            )
+        return self.__fullState
+
+    def __materializeSys(self, paths):
+        # Make sure the lazy /sys entries the given paths refer to are part
+        # of the current state, before subscriptions are made to them
+        if self.__sysSources is None:
+            return
+        names = set()
+        for path in paths:
+            if not path or (path[0] == "sys" and len(path) == 1):
+                names = self.lazySysEntries
+                break
+            if path[0] == "sys" and path[1] in self.lazySysEntries:
+                names.add(path[1])
+
+        sys_state = self.__state["sys"]
+        missing = [name for name in names if name not in sys_state]
+        if missing:
+            self.__state = self.__state.set(
+                "sys",
+                sys_state.update(
+                    (name, self.__getLazySysEntry(name)) for name in missing
+                ),
+            )
+            self.__subscriptionRoot.update(
+                self.__state, self.__updatedSubscriptions
             )
 
     async def __stateUpdateTaskImpl(self):
-        previous_state = None
-        previous_sys = None
+        previous_sources = None
         while True:
-            state_updated = (
-                self.__unresolvedState is not previous_state
-                or self.__coreState is not previous_sys
+            self.__flushCommands()
+            state_updated = previous_sources is None or (
+                self.__unresolvedState is not previous_sources[0]
+                or self.__coreState is not previous_sources[1]
+                or self.__rawState is not previous_sources[2]
             )
-            if not (state_updated or self.__updatedSubscriptions):
+            if not (
+                state_updated
+                or self.__updatedSubscriptions
+                or self.__dispatcher
+            ):
                 self.__stateUpdateEvent.clear()
                 await self.__stateUpdateEvent.wait()
                 continue
 
+            cycle_start = time.perf_counter()
             if state_updated:
+                previous_sources = (
+                    self.__unresolvedState,
+                    self.__coreState,
+                    self.__rawState,
+                )
                 next_state = self.__unresolvedState.discard("sys")
                 self.__realpath = (
                     lambda func: lambda path: func(makePath(path))
                 )(AttachedInfo.realpath(next_state))
 
-                sys = self.__coreState.set(
-                    "symlinks", AttachedInfo.symlinkInfoDict(next_state)
+                self.__sysSources = (
+                    next_state,
+                    self.__coreState,
+                    self.__rawState,
+                    self.__pluginList,
+                )
+                self.__lazySysCache = {}
+                self.__fullState = None
+                sys_state = self.__coreState.update(
+                    (name, self.__getLazySysEntry(name))
+                    for name in self.__demandedSysEntries(next_state)
                 )
-                next_state = next_state.set("sys", sys)
-                sys = sys.set("unresolved", next_state)
-                next_state = next_state.set("sys", sys)
 
-                self.__state = AttachedInfo.resolved(next_state)
-                previous_state = self.__unresolvedState
-                previous_sys = self.__coreState
-                self.__unresolvedState = next_state
+                self.__state = AttachedInfo.resolved(
+                    next_state.set("sys", sys_state)
+                )
+                if self.__updateQueries():
+                    # Publish the new query results with the state they were
+                    # computed from, rather than in another update cycle
+                    sys_state = sys_state.set(
+                        "queries", self.__coreState["queries"]
+                    )
+                    self.__state = AttachedInfo.resolved(
+                        next_state.set("sys", sys_state)
+                    )
+                    self.__sysSources = (
+                        next_state,
+                        self.__coreState,
+                        self.__rawState,
+                        self.__pluginList,
+                    )
+                    previous_sources = (
+                        self.__unresolvedState,
+                        self.__coreState,
+                        self.__rawState,
+                    )
+                self.__history.record(time.time(), self.__state)
+                if self.__snapshot is not None:
+                    self.__snapshot.publish(self.__state)
 
             self.__subscriptionRoot.update(
                 self.__state, self.__updatedSubscriptions
             )
 
-            updated_subscriptions = self.__updatedSubscriptions
+            self.__dispatcher.enqueue(self.__updatedSubscriptions)
             self.__updatedSubscriptions = set()
-            for sub in updated_subscriptions:
-                sub.update()
+            remaining = self.__dispatcher.dispatch(self.__dispatchBudget)
+            if self.__updateCycleCallback is not None:
+                self.__updateCycleCallback(
+                    time.perf_counter() - cycle_start, state_updated
+                )
+            if remaining:
+                # Let other tasks run before dispatching the remaining
+                # subscriptions, which may by then have newer state
+                await asyncio.sleep(0)
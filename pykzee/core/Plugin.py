@@ -1,3 +1,5 @@
+from pykzee.core.ReactiveComputation import ReactiveComputation
+from pykzee.core.ThreadSafePublisher import ThreadSafePublisher
 from pykzee.core.Tree import Tree
 
 
@@ -5,26 +7,80 @@ class Plugin:
     __slots__ = (
         "path",
         "get",
+        "history",
         "subscribe",
         "command",
         "setState",
         "registerCommand",
+        "registerCommands",
+        "registerQuery",
+        "every",
+        "at",
+        "after",
+        "restoredState",
     )
 
     def __init__(
-        self, *, path, get, subscribe, command, set_state, register_command
+        self,
+        *,
+        path,
+        get,
+        history,
+        subscribe,
+        command,
+        set_state,
+        register_command,
+        register_commands,
+        register_query,
+        every,
+        at,
+        after,
+        restored_state
     ):
         self.path = path
         self.get = get
+        self.history = history
         self.subscribe = subscribe
         self.command = command
         self.set = set_state
         self.registerCommand = register_command
+        self.registerCommands = register_commands
+        self.registerQuery = register_query
+        self.every = every
+        self.at = at
+        self.after = after
+        self.restoredState = restored_state
 
-    def createSubtree(self, path, *, immediate_updates=True):
+    def createSubtree(self, path, *, immediate_updates=True, auto_flush=False):
         return Tree(
             path,
             parent_set=self.set,
             parent_register_command=self.registerCommand,
+            parent_register_commands=self.registerCommands,
             immediate_updates=immediate_updates,
+            auto_flush=auto_flush,
         )
+
+    edit = Tree.edit
+
+    def createPublisher(self):
+        """Return a ``ThreadSafePublisher`` for the state of this plugin
+
+        Use it to set the state of the plugin from other threads.
+        """
+        return ThreadSafePublisher(self.set)
+
+    def reactive(self, function, callback):
+        """Call ``function(get)`` whenever the state it reads changes
+
+        See ``ReactiveComputation``. Returns a function that stops the
+        computation.
+        """
+        computation = ReactiveComputation(
+            get=self.get,
+            subscribe=self.subscribe,
+            function=function,
+            callback=callback,
+        )
+        computation.start()
+        return computation.stop
@@ -0,0 +1,179 @@
+import json
+import operator
+
+from pyimmutable import ImmutableDict, ImmutableList
+from pykzee.core.common import getDataForPath, makePath, Undefined
+
+operators = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "in": lambda value, options: value in options,
+}
+
+
+class Query:
+    """Filter, project and group the children of a subtree
+
+    The query is given as a specification, an object with these keys:
+
+    * ``path``: the subtree whose children are queried
+    * ``where`` (optional): a list of conditions ``[path, operator, value]``,
+      all of which a child must meet. ``path`` is relative to the child, and
+      ``operator`` is one of ``==``, ``!=``, ``<``, ``<=``, ``>``, ``>=``,
+      ``in`` or ``exists`` (which takes no value).
+    * ``select`` (optional): what to output for each matching child: a path
+      relative to the child, or an object mapping output keys to such paths.
+      Defaults to the whole child.
+    * ``group_by`` (optional): a path relative to the child. The result is
+      then grouped by the value found there.
+
+    The result maps the keys of the matching children (for lists: the index
+    as a string) to their selected data, or, with ``group_by``, maps the
+    group values (strings as they are, other values JSON-encoded) to such
+    objects.
+
+    The result is maintained incrementally: ``update`` only looks at the
+    children that are not identical to the ones seen last time.
+    """
+
+    __slots__ = (
+        "path",
+        "__where",
+        "__select",
+        "__groupBy",
+        "__source",
+        "__entries",
+        "result",
+    )
+
+    def __init__(self, spec):
+        self.path = makePath(spec["path"])
+        self.__where = tuple(
+            self.__parseCondition(*condition)
+            for condition in spec.get("where", ())
+        )
+        select = spec.get("select")
+        if select is None:
+            self.__select = None
+        elif type(select) is str:
+            self.__select = makePath(select)
+        else:
+            self.__select = tuple(
+                (key, makePath(path)) for key, path in select.items()
+            )
+        group_by = spec.get("group_by")
+        self.__groupBy = None if group_by is None else makePath(group_by)
+        self.__source = Undefined
+        self.__entries = {}  # key -> (child, group, selected data)
+        self.result = ImmutableDict()
+
+    @staticmethod
+    def __parseCondition(path, op, *value):
+        if op == "exists" and not value:
+            return makePath(path), None, None
+        if op not in operators or len(value) != 1:
+            raise Exception(f"Invalid query condition: { path } { op }")
+        return makePath(path), operators[op], value[0]
+
+    def update(self, state):
+        """Update the result for a new state; return whether it changed"""
+        source = getDataForPath(state, self.path)
+        if source is self.__source:
+            return False
+        self.__source = source
+
+        if type(source) is ImmutableDict:
+            children = source.items()
+        elif type(source) is ImmutableList:
+            children = ((str(idx), child) for idx, child in enumerate(source))
+        else:
+            children = ()
+
+        entries = self.__entries
+        changed = {}  # group -> {key: selected data or Undefined}
+        seen = set()
+        for key, child in children:
+            seen.add(key)
+            entry = entries.get(key)
+            if entry is not None and entry[0] is child:
+                continue
+            if entry is not None and entry[2] is not Undefined:
+                changed.setdefault(entry[1], {})[key] = Undefined
+            group, selected = self.__evaluate(child)
+            entries[key] = child, group, selected
+            if selected is not Undefined:
+                changed.setdefault(group, {})[key] = selected
+
+        for key in [key for key in entries if key not in seen]:
+            _, group, selected = entries.pop(key)
+            if selected is not Undefined:
+                changed.setdefault(group, {})[key] = Undefined
+
+        if not changed:
+            return False
+        old_result = self.result
+        for group, updates in changed.items():
+            self.__applyUpdates(group, updates)
+        return self.result is not old_result
+
+    def __evaluate(self, child):
+        for path, op, value in self.__where:
+            data = getDataForPath(child, path)
+            if data is Undefined:
+                return None, Undefined
+            try:
+                if op is not None and not op(data, value):
+                    return None, Undefined
+            except TypeError:
+                return None, Undefined
+
+        group = None
+        if self.__groupBy is not None:
+            group = getDataForPath(child, self.__groupBy)
+            if group is Undefined:
+                return None, Undefined
+            if type(group) is not str:
+                group = json.dumps(group, separators=(",", ":"))
+
+        select = self.__select
+        if select is None:
+            selected = child
+        elif type(select) is tuple:
+            selected = ImmutableDict(
+                (key, value)
+                for key, value in (
+                    (key, getDataForPath(child, path)) for key, path in select
+                )
+                if value is not Undefined
+            )
+        else:
+            selected = getDataForPath(child, select)
+            if selected is Undefined:
+                selected = None
+        return group, selected
+
+    def __applyUpdates(self, group, updates):
+        if self.__groupBy is None:
+            items = self.result
+        else:
+            items = self.result.get(group, ImmutableDict())
+
+        for key, value in updates.items():
+            if value is Undefined:
+                items = items.discard(key)
+        items = items.update(
+            (key, value)
+            for key, value in updates.items()
+            if value is not Undefined
+        )
+
+        if self.__groupBy is None:
+            self.result = items
+        elif items:
+            self.result = self.result.set(group, items)
+        else:
+            self.result = self.result.discard(group)
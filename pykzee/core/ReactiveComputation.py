@@ -0,0 +1,115 @@
+import inspect
+import traceback
+
+from pykzee.core.common import call_soon, makePath
+
+
+class ReactiveComputation:
+    """Re-run a function whenever any part of the state it read changes
+
+    ``function`` is called with a ``get`` function as its only argument, and
+    may return an awaitable. Every path read through that ``get`` is
+    recorded, and after each run the computation subscribes to exactly the
+    paths read during that run (leaving out paths below another path that was
+    read). ``callback`` is called with the result of every run.
+
+    Changes that arrive while an asynchronous run is in progress cause one
+    more run once it has finished.
+    """
+
+    __slots__ = (
+        "__get",
+        "__subscribe",
+        "__function",
+        "__callback",
+        "__dependencies",
+        "__unsubscribe",
+        "__running",
+        "__dirty",
+        "__stopped",
+    )
+
+    def __init__(self, *, get, subscribe, function, callback):
+        self.__get = get
+        self.__subscribe = subscribe
+        self.__function = function
+        self.__callback = callback
+        self.__dependencies = frozenset()
+        self.__unsubscribe = None
+        self.__running = False
+        self.__dirty = False
+        self.__stopped = False
+
+    @property
+    def dependencies(self):
+        return self.__dependencies
+
+    def start(self):
+        call_soon(self.__run)
+
+    def stop(self):
+        self.__stopped = True
+        if self.__unsubscribe is not None:
+            self.__unsubscribe()
+            self.__unsubscribe = None
+
+    async def __run(self, *state):
+        if self.__stopped:
+            return
+        if self.__running:
+            self.__dirty = True
+            return
+
+        self.__running = True
+        try:
+            while True:
+                self.__dirty = False
+                reads = {}
+
+                def tracked_get(path):
+                    path = makePath(path)
+                    value = self.__get(path)
+                    reads.setdefault(path, value)
+                    return value
+
+                try:
+                    result = self.__function(tracked_get)
+                    if inspect.isawaitable(result):
+                        result = await result
+                except Exception:
+                    traceback.print_exc()
+                    result = None
+                    failed = True
+                else:
+                    failed = False
+
+                if self.__stopped:
+                    return
+                self.__updateDependencies(reads)
+                if any(self.__get(path) is not v for path, v in reads.items()):
+                    # State changed while the function was running
+                    self.__dirty = True
+                if not failed:
+                    self.__callback(result)
+                if not self.__dirty:
+                    break
+        finally:
+            self.__running = False
+
+    def __updateDependencies(self, reads):
+        dependencies = frozenset(
+            path
+            for path in reads
+            if not any(a in reads for a in path.ancestors)
+        )
+        if dependencies == self.__dependencies:
+            return
+
+        if self.__unsubscribe is not None:
+            self.__unsubscribe()
+            self.__unsubscribe = None
+        self.__dependencies = dependencies
+        if dependencies:
+            self.__unsubscribe = self.__subscribe(
+                self.__run, *dependencies, initial=False
+            )
@@ -0,0 +1,20 @@
+from pykzee.core import ChangefeedReplay
+from pykzee.core.Plugin import Plugin
+
+
+class ReplayPlugin(Plugin):
+    """Stand-in for a recorded plugin during a changefeed replay
+
+    ``ChangefeedReplay`` puts this plugin in place of every plugin in the
+    raw state, and sets its state as recorded in the changefeed.
+    """
+
+    def init(self, config):
+        ChangefeedReplay.replayPlugins[self.path] = self
+
+    def updateConfig(self, new_config):
+        return True
+
+    def shutdown(self):
+        if ChangefeedReplay.replayPlugins.get(self.path) is self:
+            del ChangefeedReplay.replayPlugins[self.path]
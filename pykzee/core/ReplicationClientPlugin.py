@@ -0,0 +1,152 @@
+import asyncio
+import itertools
+import json
+import logging
+
+from pykzee.core.common import (
+    makePath,
+    print_exception_task_callback,
+    Undefined,
+)
+from pykzee.core.Plugin import Plugin
+from pykzee.core.ReplicationServerPlugin import send
+
+
+class ReplicationClientPlugin(Plugin):
+    """Mount a subtree exported by a ``ReplicationServerPlugin``
+
+    The state of this plugin is a read-only replica of the exported subtree.
+    Commands registered within the exported subtree are registered at the
+    corresponding paths below this plugin, and calling them forwards the call
+    to the server. After a disconnect, the client reconnects and resumes from
+    the last version it received.
+
+    Configuration keys:
+
+    * ``socket``: path of the server's Unix domain socket
+    * ``export``: name of the exported subtree
+    * ``reconnect_interval``: seconds to wait before reconnecting (defaults
+      to 1)
+    """
+
+    def init(self, config):
+        self.__socketPath = config["socket"]
+        self.__export = config["export"]
+        self.__reconnectInterval = config.get("reconnect_interval", 1.0)
+        self.__epoch = None
+        self.__version = 0
+        self.__writer = None
+        self.__requestIds = itertools.count()
+        self.__requests = {}
+        self.__unregisterCommands = []
+        self.__task = asyncio.ensure_future(self.__run())
+        self.__task.add_done_callback(print_exception_task_callback)
+
+    def shutdown(self):
+        self.__task.cancel()
+        if self.__writer is not None:
+            self.__writer.close()
+
+    async def __run(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(
+                    self.__socketPath
+                )
+            except OSError:
+                ...
+            else:
+                await self.serveConnection(reader, writer)
+            await asyncio.sleep(self.__reconnectInterval)
+
+    async def serveConnection(self, reader, writer):
+        """Replicate the subtree from a server at ``reader`` and ``writer``
+
+        This works with any pair of asyncio streams, e.g. a pipe.
+        """
+        self.__writer = writer
+        try:
+            send(writer, self.__subscribeMessage())
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                self.__handleMessage(json.loads(line))
+        except (ConnectionError, ValueError) as ex:
+            logging.warning(f"ReplicationClientPlugin: { ex }")
+        finally:
+            self.__writer = None
+            writer.close()
+            requests, self.__requests = self.__requests, {}
+            for future in requests.values():
+                if not future.done():
+                    future.set_exception(
+                        ConnectionError("connection to server lost")
+                    )
+
+    def __subscribeMessage(self):
+        return ["subscribe", self.__export, self.__epoch, self.__version]
+
+    def __handleMessage(self, message):
+        kind = message[0]
+        if kind == "delta":
+            _, _, version, changes = message
+            if version <= self.__version:
+                return
+            if version != self.__version + 1:
+                # Missed a delta, ask for the ones following our version
+                send(self.__writer, self.__subscribeMessage())
+                return
+            for path, *value in changes:
+                self.set(path, value[0] if value else Undefined)
+            self.__version = version
+        elif kind == "snapshot":
+            _, _, self.__epoch, self.__version, state = message
+            self.set((), state)
+        elif kind == "commands":
+            self.__setCommands(message[2])
+        elif kind in ("result", "error"):
+            future = self.__requests.pop(message[1], None)
+            if future is None or future.done():
+                return
+            if kind == "result":
+                future.set_result(message[2])
+            else:
+                future.set_exception(Exception(message[2]))
+
+    def __setCommands(self, commands):
+        for unregister in self.__unregisterCommands:
+            unregister()
+        self.__unregisterCommands = self.registerCommands(
+            (
+                makePath(path),
+                name,
+                self.__forwarder(path, name),
+                info.get("doc"),
+            )
+            for path, path_commands in commands.items()
+            for name, info in path_commands.items()
+        )
+
+    def __forwarder(self, path, name):
+        async def forward(*args, **kwargs):
+            if self.__writer is None:
+                raise ConnectionError("not connected to server")
+            request_id = next(self.__requestIds)
+            future = asyncio.get_event_loop().create_future()
+            self.__requests[request_id] = future
+            send(
+                self.__writer,
+                [
+                    "command",
+                    request_id,
+                    self.__export,
+                    path,
+                    name,
+                    args,
+                    kwargs,
+                ],
+            )
+            return await future
+
+        return forward
@@ -0,0 +1,293 @@
+import asyncio
+import collections
+import inspect
+import json
+import logging
+import uuid
+
+from pyimmutable import ImmutableDict
+from pykzee.core.common import (
+    diffState,
+    dumpJson,
+    makePath,
+    print_exception_task_callback,
+    sanitize,
+    Undefined,
+)
+from pykzee.core.Plugin import Plugin
+
+
+class ReplicationServerPlugin(Plugin):
+    """Export subtrees to other pykzee instances
+
+    Other instances mount an exported subtree with ``ReplicationClientPlugin``.
+    The server sends a snapshot of the subtree when a client connects, and an
+    ordered stream of deltas (the paths that changed) after that. Each delta
+    increments the version of the exported subtree. The last ``backlog``
+    deltas are kept, so that a client reconnecting with a recent version
+    only receives the deltas it missed. Commands registered within an
+    exported subtree can be called by the clients.
+
+    A client that does not keep up, so that more than ``max_buffer`` bytes
+    are waiting to be sent to it, stops receiving updates. Once its buffer
+    has drained, it is resynchronised like a reconnecting client (with the
+    deltas it missed, or a new snapshot).
+
+    Configuration keys:
+
+    * ``socket``: path of the Unix domain socket to listen on
+    * ``export``: object mapping export names to the paths of the subtrees
+    * ``backlog``: number of deltas kept per export (defaults to 1000)
+    * ``max_buffer``: bytes buffered for a client before it is considered
+      too slow (defaults to 4 MiB)
+
+    The protocol consists of JSON arrays, one per line. Clients send
+    ``["subscribe", name, epoch, version]`` and
+    ``["command", id, name, path, command, args, kwargs]``. The server sends
+    ``["snapshot", name, epoch, version, state]``,
+    ``["delta", name, version, changes]`` (where ``changes`` is a list of
+    ``[path, value]`` for changed and ``[path]`` for deleted paths),
+    ``["commands", name, commands]``, ``["result", id, value]`` and
+    ``["error", id, message]``. The epoch identifies the server process, so
+    that versions from before a restart are not mistaken for current ones.
+    """
+
+    def init(self, config):
+        self.__epoch = uuid.uuid4().hex
+        self.__unsubscribe = []
+        self.__connections = set()
+        self.__tasks = set()
+        self.__maxBuffer = config.get("max_buffer", 4 << 20)
+        self.__exports = {
+            name: Export(name, makePath(path), config.get("backlog", 1000))
+            for name, path in config["export"].items()
+        }
+        for export in self.__exports.values():
+            self.__unsubscribe.append(
+                self.subscribe(
+                    lambda state, export=export: self.__stateUpdate(
+                        export, state
+                    ),
+                    export.path,
+                )
+            )
+        self.__unsubscribe.append(
+            self.subscribe(self.__commandsUpdate, "/sys/commands")
+        )
+        self.__server = None
+        self.__serverTask = asyncio.ensure_future(
+            self.__startServer(config["socket"])
+        )
+        self.__serverTask.add_done_callback(print_exception_task_callback)
+
+    def shutdown(self):
+        for unsubscribe in self.__unsubscribe:
+            unsubscribe()
+        self.__serverTask.cancel()
+        if self.__server is not None:
+            self.__server.close()
+            self.__server = None
+        for task in list(self.__tasks):
+            task.cancel()
+        for writer in list(self.__connections):
+            writer.close()
+
+    async def __startServer(self, socket_path):
+        self.__server = await asyncio.start_unix_server(
+            self.__accept, path=socket_path
+        )
+        self.__publishStatus()
+
+    def __accept(self, reader, writer):
+        self.__spawn(self.serveConnection(reader, writer))
+
+    async def serveConnection(self, reader, writer):
+        """Serve a client connected through ``reader`` and ``writer``
+
+        This works with any pair of asyncio streams, e.g. a pipe. The
+        connection is closed when the plugin shuts down.
+        """
+        self.__connections.add(writer)
+        self.__publishStatus()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                message = json.loads(line)
+                if message[0] == "subscribe":
+                    self.__subscribeClient(writer, *message[1:])
+                elif message[0] == "command":
+                    self.__spawn(self.__command(writer, *message[1:]))
+                else:
+                    logging.warning(
+                        f"ReplicationServerPlugin: unknown message "
+                        f"{ message[0] !r}"
+                    )
+        except (ConnectionError, ValueError) as ex:
+            logging.warning(f"ReplicationServerPlugin: { ex }")
+        finally:
+            self.__connections.discard(writer)
+            for export in self.__exports.values():
+                export.connections.discard(writer)
+            writer.close()
+            self.__publishStatus()
+
+    def __subscribeClient(self, writer, name, epoch, version):
+        export = self.__exports[name]
+        deltas = None
+        if epoch == self.__epoch:
+            deltas = export.deltasSince(version)
+        if deltas is None:
+            state = export.state
+            if state is Undefined:
+                state = None
+            send(
+                writer,
+                [
+                    "snapshot",
+                    name,
+                    self.__epoch,
+                    export.version,
+                    state,
+                ],
+            )
+        else:
+            for version, changes in deltas:
+                send(writer, ["delta", name, version, changes])
+        send(writer, ["commands", name, export.commands])
+        export.connections.add(writer)
+
+    async def __command(self, writer, request_id, name, path, cmd, args, kw):
+        export = self.__exports[name]
+        try:
+            result = self.command(export.path + makePath(path), cmd)(
+                *args, **kw
+            )
+            if inspect.isawaitable(result):
+                result = await result
+            message = ["result", request_id, sanitize(result)]
+        except Exception as ex:
+            message = ["error", request_id, str(ex)]
+        send(writer, message)
+
+    def __stateUpdate(self, export, state):
+        changes = [
+            [list(path)] if value is Undefined else [list(path), value]
+            for path, value in diffState(export.state, state)
+        ]
+        if not changes:
+            return
+        export.state = state
+        export.version += 1
+        export.backlog.append((export.version, changes))
+        self.__broadcast(
+            export,
+            ["delta", export.name, export.version, changes],
+            export.version - 1,
+        )
+        self.__publishStatus()
+
+    def __commandsUpdate(self, commands):
+        if commands is Undefined:
+            commands = ImmutableDict()
+        for export in self.__exports.values():
+            prefix = export.path.string.rstrip("/")
+            export_commands = ImmutableDict(
+                (path[len(prefix) :] or "/", value)
+                for path, value in commands.items()
+                if path == prefix or path.startswith(prefix + "/")
+            )
+            if export_commands is not export.commands:
+                export.commands = export_commands
+                self.__broadcast(
+                    export,
+                    ["commands", export.name, export_commands],
+                    export.version,
+                )
+
+    def __broadcast(self, export, message, version):
+        # version: the last version the clients have received before this
+        data = encode(message)
+        for writer in list(export.connections):
+            if writer.transport.get_write_buffer_size() > self.__maxBuffer:
+                export.connections.discard(writer)
+                export.resyncs += 1
+                self.__spawn(self.__resync(writer, export, version))
+            else:
+                writer.write(data)
+
+    async def __resync(self, writer, export, version):
+        try:
+            await writer.drain()
+        except ConnectionError:
+            return
+        if writer in self.__connections:
+            self.__subscribeClient(writer, export.name, self.__epoch, version)
+            self.__publishStatus()
+
+    def __spawn(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+        task.add_done_callback(print_exception_task_callback)
+
+    def __publishStatus(self):
+        self.set(
+            (),
+            {
+                "listening": self.__server is not None,
+                "connections": len(self.__connections),
+                "exports": {
+                    name: {
+                        "path": export.path.string,
+                        "version": export.version,
+                        "clients": len(export.connections),
+                        "resyncs": export.resyncs,
+                    }
+                    for name, export in self.__exports.items()
+                },
+            },
+        )
+
+
+class Export:
+    __slots__ = (
+        "name",
+        "path",
+        "state",
+        "version",
+        "backlog",
+        "commands",
+        "connections",
+        "resyncs",
+    )
+
+    def __init__(self, name, path, backlog):
+        self.name = name
+        self.path = path
+        self.state = Undefined
+        self.version = 0
+        self.backlog = collections.deque(maxlen=backlog)
+        self.commands = ImmutableDict()
+        self.connections = set()
+        self.resyncs = 0
+
+    def deltasSince(self, version):
+        """Deltas following ``version``, or ``None`` if not available"""
+        if version == self.version:
+            return ()
+        if version > self.version or not self.backlog:
+            return None
+        first_version = self.backlog[0][0]
+        if version < first_version - 1:
+            return None
+        return list(self.backlog)[version - first_version + 1 :]
+
+
+def encode(message):
+    return dumpJson(message).encode() + b"\n"
+
+
+def send(writer, message):
+    writer.write(encode(message))
@@ -0,0 +1,369 @@
+import asyncio
+import json
+import mmap
+import os
+import struct
+import time
+
+from pyimmutable import ImmutableDict, ImmutableList
+from pykzee.core.common import makePath, PathType, Undefined
+
+MAGIC = b"PYKZSNP1"
+
+# magic, sequence number, version, root offset, end of data, generation,
+# superseded flag
+_header = struct.Struct("<8sQQQQQQ")
+_sequence = struct.Struct("<Q")
+_count = struct.Struct("<I")
+_offset = struct.Struct("<Q")
+_int = struct.Struct("<q")
+_float = struct.Struct("<d")
+
+TAG_NULL, TAG_FALSE, TAG_TRUE = b"N", b"F", b"T"
+TAG_INT, TAG_FLOAT, TAG_STR, TAG_JSON = b"I", b"D", b"S", b"J"
+TAG_LIST, TAG_DICT = b"L", b"M"
+
+
+class SnapshotWriter:
+    """Publish the state to a memory-mapped file, for other processes
+
+    The file starts with a header, followed by the serialized nodes of the
+    state. Every node is a tag byte and its data: lists and objects store
+    the offsets of their elements (objects: of their keys and values,
+    sorted by key), so that ``SnapshotReader`` can look up a path without
+    decoding anything else.
+
+    New nodes are appended after the existing ones, and nodes of subtrees
+    that did not change since an earlier version are reused, so publishing
+    a new version only writes the changed parts of the state. The offset of
+    an object or list is remembered in its meta, so the writer does not
+    keep old states alive. The header,
+    which points to the root of the latest version, is updated last, under
+    a sequence number (odd while it is being written). When the file is
+    full, the current state is written to a new file, which replaces the
+    old one; the old one is then marked as superseded, so that readers
+    switch to the new file.
+
+    ``publish`` writes at most one version every ``min_interval`` seconds;
+    a state published sooner is written when the interval has passed
+    (unless it is superseded by a newer one before then).
+    """
+
+    __slots__ = (
+        "filename",
+        "capacity",
+        "minInterval",
+        "__map",
+        "__end",
+        "__version",
+        "__generation",
+        "__token",
+        "__strings",
+        "__lastPublish",
+        "__pendingState",
+        "__handle",
+    )
+
+    def __init__(self, filename, *, capacity=64 << 20, min_interval=0.0):
+        self.filename = filename
+        self.capacity = capacity
+        self.minInterval = min_interval
+        self.__map = None
+        self.__version = 0
+        self.__lastPublish = None
+        self.__pendingState = Undefined
+        self.__handle = None
+        self.__token = object()
+        self.__strings = {}
+        self.__newFile(b"", 0, capacity)
+
+    @property
+    def version(self):
+        return self.__version
+
+    def publish(self, state):
+        if self.minInterval:
+            now = time.monotonic()
+            if self.__handle is not None:
+                self.__pendingState = state
+                return
+            if (
+                self.__lastPublish is not None
+                and now - self.__lastPublish < self.minInterval
+            ):
+                self.__pendingState = state
+                self.__handle = asyncio.get_event_loop().call_later(
+                    self.__lastPublish + self.minInterval - now,
+                    self.__publishPending,
+                )
+                return
+            self.__lastPublish = now
+        self.__write(state)
+
+    def close(self):
+        if self.__handle is not None:
+            self.__handle.cancel()
+            self.__publishPending()
+        self.__map.close()
+
+    def __publishPending(self):
+        self.__handle = None
+        self.__lastPublish = time.monotonic()
+        state, self.__pendingState = self.__pendingState, Undefined
+        if state is not Undefined:
+            self.__write(state)
+
+    def __write(self, state):
+        root, buffer = self.__encodeState(state, self.__end)
+        end = self.__end + len(buffer)
+        self.__version += 1
+        if end <= self.capacity:
+            self.__map[self.__end : end] = buffer
+            self.__end = end
+            self.__writeHeader(self.__map, root)
+            return
+
+        # Start over in a new file, with room for the state to grow. The
+        # offsets remembered for the old file no longer apply.
+        old_map = self.__map
+        self.__token = object()
+        root, buffer = self.__encodeState(state, _header.size)
+        self.__newFile(
+            buffer, root, max(self.capacity, 2 * (_header.size + len(buffer)))
+        )
+        self.__writeHeader(old_map, 0, superseded=1)
+        old_map.close()
+
+    def __newFile(self, data, root, capacity):
+        temp_filename = f"{ self.filename }.new"
+        fd = os.open(temp_filename, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, capacity)
+            self.__map = mmap.mmap(fd, capacity)
+        finally:
+            os.close(fd)
+        self.capacity = capacity
+        self.__end = _header.size + len(data)
+        self.__map[_header.size : self.__end] = data
+        self.__generation = time.time_ns()
+        self.__writeHeader(self.__map, root)
+        os.replace(temp_filename, self.filename)
+
+    def __writeHeader(self, m, root, *, superseded=0):
+        sequence = _sequence.unpack_from(m, 8)[0] + 1
+        _sequence.pack_into(m, 8, sequence)
+        _header.pack_into(
+            m,
+            0,
+            MAGIC,
+            sequence,
+            self.__version,
+            root,
+            self.__end,
+            self.__generation,
+            superseded,
+        )
+        _sequence.pack_into(m, 8, sequence + 1)
+
+    def __encodeState(self, state, base):
+        buffer = bytearray()
+        try:
+            return self.__encode(state, buffer, base), buffer
+        except Exception:
+            # Offsets were remembered for nodes that are not written now
+            self.__token = object()
+            raise
+        finally:
+            self.__strings = {}
+
+    def __encode(self, node, buffer, base):
+        # Objects and lists that were written to the current file before are
+        # reused. Their offset is kept in their meta, along with a token
+        # identifying the file. Strings are only shared within one version.
+        t = type(node)
+        if t is ImmutableDict or t is ImmutableList:
+            entry = node.meta.get("snapshot-offset")
+            if entry is not None and entry[0] is self.__token:
+                return entry[1]
+        elif t is str:
+            offset = self.__strings.get(node)
+            if offset is not None:
+                return offset
+
+        if t is ImmutableDict:
+            items = sorted(
+                (key.encode(), key, value) for key, value in node.items()
+            )
+            offsets = []
+            for _, key, value in items:
+                offsets.append(self.__encode(key, buffer, base))
+                offsets.append(self.__encode(value, buffer, base))
+            offset = base + len(buffer)
+            buffer += TAG_DICT + _count.pack(len(items))
+            buffer += struct.pack(f"<{ len(offsets) }Q", *offsets)
+        elif t is ImmutableList:
+            offsets = [self.__encode(x, buffer, base) for x in node]
+            offset = base + len(buffer)
+            buffer += TAG_LIST + _count.pack(len(offsets))
+            buffer += struct.pack(f"<{ len(offsets) }Q", *offsets)
+        else:
+            offset = base + len(buffer)
+            if node is None:
+                buffer += TAG_NULL
+            elif node is False:
+                buffer += TAG_FALSE
+            elif node is True:
+                buffer += TAG_TRUE
+            elif t is str:
+                data = node.encode()
+                buffer += TAG_STR + _count.pack(len(data)) + data
+            elif t is int and -(1 << 63) <= node < (1 << 63):
+                buffer += TAG_INT + _int.pack(node)
+            elif t is float:
+                buffer += TAG_FLOAT + _float.pack(node)
+            else:
+                data = json.dumps(node).encode()
+                buffer += TAG_JSON + _count.pack(len(data)) + data
+            if t is str:
+                self.__strings[node] = offset
+            return offset
+
+        node.meta["snapshot-offset"] = self.__token, offset
+        return offset
+
+
+class SnapshotReader:
+    """Read the state published by a ``SnapshotWriter`` in another process
+
+    ``get`` looks up a path in the memory-mapped file, decoding only the
+    data at that path. ``version`` tells whether a new version has been
+    published, and ``identity`` whether the data at a path changed: it
+    stays the same as long as the subtree is unchanged.
+    """
+
+    __slots__ = "filename", "__map", "__generation"
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.__map = None
+        self.__open()
+
+    @property
+    def version(self):
+        return self.__header()[0]
+
+    def get(self, path: PathType, default=Undefined):
+        offset = self.__lookup(path)
+        if offset is None:
+            return default
+        return self.__decode(offset)
+
+    def identity(self, path: PathType):
+        offset = self.__lookup(path)
+        return None if offset is None else (self.__generation, offset)
+
+    def close(self):
+        self.__map.close()
+
+    def __open(self):
+        with open(self.filename, "rb") as f:
+            new_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if new_map[:8] != MAGIC:
+            new_map.close()
+            raise Exception(f"{ self.filename } is not a state snapshot")
+        if self.__map is not None:
+            self.__map.close()
+        self.__map = new_map
+
+    def __header(self):
+        delay = 0.0
+        while True:
+            (
+                _,
+                sequence,
+                version,
+                root,
+                _,
+                generation,
+                superseded,
+            ) = _header.unpack_from(self.__map, 0)
+            if sequence & 1 or _sequence.unpack_from(self.__map, 8)[0] != (
+                sequence
+            ):
+                # The header is being written: yield to other threads, then
+                # back off exponentially in case the writer was interrupted
+                time.sleep(delay)
+                delay = min(2 * delay or 1e-6, 1e-3)
+                continue
+            if superseded:
+                self.__open()
+                continue
+            self.__generation = generation
+            return version, root
+
+    def __lookup(self, path):
+        _, offset = self.__header()
+        if not offset:
+            return None
+        m = self.__map
+        for p in makePath(path):
+            tag = m[offset : offset + 1]
+            if tag == TAG_LIST and type(p) is int:
+                if not 0 <= p < _count.unpack_from(m, offset + 1)[0]:
+                    return None
+                offset = _offset.unpack_from(m, offset + 5 + 8 * p)[0]
+            elif tag == TAG_DICT and type(p) is str:
+                offset = self.__search(
+                    offset + 5,
+                    _count.unpack_from(m, offset + 1)[0],
+                    p.encode(),
+                )
+                if offset is None:
+                    return None
+            else:
+                return None
+        return offset
+
+    def __search(self, entries, count, key):
+        m = self.__map
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            key_offset = _offset.unpack_from(m, entries + 16 * middle)[0]
+            length = _count.unpack_from(m, key_offset + 1)[0]
+            k = m[key_offset + 5 : key_offset + 5 + length]
+            if k == key:
+                return _offset.unpack_from(m, entries + 16 * middle + 8)[0]
+            if k < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+    def __decode(self, offset):
+        m = self.__map
+        tag = m[offset : offset + 1]
+        if tag == TAG_NULL:
+            return None
+        if tag == TAG_FALSE:
+            return False
+        if tag == TAG_TRUE:
+            return True
+        if tag == TAG_INT:
+            return _int.unpack_from(m, offset + 1)[0]
+        if tag == TAG_FLOAT:
+            return _float.unpack_from(m, offset + 1)[0]
+        count = _count.unpack_from(m, offset + 1)[0]
+        if tag == TAG_STR:
+            return str(m[offset + 5 : offset + 5 + count], "utf-8")
+        if tag == TAG_JSON:
+            return json.loads(m[offset + 5 : offset + 5 + count])
+        offsets = struct.unpack_from(
+            f"<{ 2 * count if tag == TAG_DICT else count }Q", m, offset + 5
+        )
+        if tag == TAG_LIST:
+            return [self.__decode(o) for o in offsets]
+        return {
+            self.__decode(offsets[i]): self.__decode(offsets[i + 1])
+            for i in range(0, len(offsets), 2)
+        }
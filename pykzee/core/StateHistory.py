@@ -0,0 +1,172 @@
+import bisect
+import collections
+import sys
+
+from pyimmutable import ImmutableDict, ImmutableList
+from pykzee.core.common import getDataForPath, PathType, Undefined
+
+
+class StateHistory:
+    """Ring buffer of recent root states
+
+    States are immutable and share structure, so the memory cost of keeping
+    a state is the size of the nodes it does not share with any other state
+    kept in the history. When ``max_bytes`` is set, this is measured by
+    reference counting the unique nodes of all retained states, which only
+    visits nodes that are new (when adding a state) or no longer used (when
+    dropping one). Without a byte limit no per-node accounting is done.
+
+    The newest entry is always the current state. Entries are dropped, oldest
+    first, when there are more than ``max_count`` of them, when they were
+    superseded more than ``max_age`` seconds ago, or when the unique nodes of
+    all entries take more than ``max_bytes`` bytes.
+    """
+
+    __slots__ = (
+        "__timestamps",
+        "__states",
+        "__nodes",
+        "__bytes",
+        "__maxBytes",
+        "maxCount",
+        "maxAge",
+    )
+
+    def __init__(self, *, max_count=1, max_age=None, max_bytes=None):
+        self.__timestamps = collections.deque()
+        self.__states = collections.deque()
+        self.__nodes = {}  # id(node) -> [node, refcount, size]
+        self.__bytes = 0
+        self.maxCount = max(1, max_count)
+        self.maxAge = max_age
+        self.__maxBytes = None
+        self.maxBytes = max_bytes
+
+    def __len__(self):
+        return len(self.__states)
+
+    @property
+    def maxBytes(self):
+        return self.__maxBytes
+
+    @maxBytes.setter
+    def maxBytes(self, max_bytes):
+        if (max_bytes is None) is not (self.__maxBytes is None):
+            # Start or stop accounting for the states already retained
+            self.__nodes = {}
+            self.__bytes = 0
+            if max_bytes is not None:
+                for state in self.__states:
+                    self.__addRef(state)
+        self.__maxBytes = max_bytes
+
+    @property
+    def memoryUsage(self):
+        """Approximate size in bytes of all unique nodes in the history
+
+        This is ``None`` unless ``max_bytes`` is set.
+        """
+        return None if self.__maxBytes is None else self.__bytes
+
+    def record(self, timestamp, state):
+        if self.__states and self.__states[-1] is state:
+            return
+        if (
+            self.maxCount == 1
+            and self.maxAge is None
+            and self.__maxBytes is None
+        ):
+            # Only the current state is kept
+            self.__timestamps.clear()
+            self.__states.clear()
+            self.__timestamps.append(timestamp)
+            self.__states.append(state)
+            return
+
+        self.__timestamps.append(timestamp)
+        self.__states.append(state)
+        if self.__maxBytes is not None:
+            self.__addRef(state)
+
+        while len(self.__states) > self.maxCount:
+            self.__dropOldest()
+        if self.maxAge is not None:
+            cutoff = timestamp - self.maxAge
+            while len(self.__states) > 1 and self.__timestamps[1] <= cutoff:
+                self.__dropOldest()
+        if self.__maxBytes is not None:
+            while len(self.__states) > 1 and self.__bytes > self.__maxBytes:
+                self.__dropOldest()
+
+    def stateAt(self, timestamp):
+        """Return the state that was current at ``timestamp``
+
+        Returns ``Undefined`` if that state is no longer (or not yet) part of
+        the history.
+        """
+        idx = bisect.bisect_right(self.__timestamps, timestamp)
+        if idx == 0:
+            return Undefined
+        return self.__states[idx - 1]
+
+    def get(self, path: PathType, at):
+        return getDataForPath(self.stateAt(at), path)
+
+    def history(self, path: PathType, since=None):
+        """List of ``(timestamp, value)`` pairs for every change of ``path``
+
+        The first pair holds the value that was current at ``since`` (or the
+        oldest value retained, if ``since`` is ``None``), and its timestamp
+        may therefore be earlier than ``since``.
+        """
+        start = 0
+        if since is not None:
+            start = max(0, bisect.bisect_right(self.__timestamps, since) - 1)
+
+        result = []
+        previous = Undefined
+        for idx in range(start, len(self.__states)):
+            value = getDataForPath(self.__states[idx], path)
+            if not result or value is not previous:
+                result.append((self.__timestamps[idx], value))
+                previous = value
+        return result
+
+    def __dropOldest(self):
+        self.__timestamps.popleft()
+        state = self.__states.popleft()
+        if self.__maxBytes is not None:
+            self.__releaseRef(state)
+
+    def __addRef(self, node):
+        if type(node) not in (ImmutableDict, ImmutableList):
+            return
+        entry = self.__nodes.get(id(node))
+        if entry is not None:
+            entry[1] += 1
+            return
+
+        size = sys.getsizeof(node)
+        children = node.values() if type(node) is ImmutableDict else node
+        if type(node) is ImmutableDict:
+            size += sum(sys.getsizeof(key) for key in node.keys())
+        for child in children:
+            if type(child) in (ImmutableDict, ImmutableList):
+                self.__addRef(child)
+            else:
+                size += sys.getsizeof(child)
+        self.__nodes[id(node)] = [node, 1, size]
+        self.__bytes += size
+
+    def __releaseRef(self, node):
+        if type(node) not in (ImmutableDict, ImmutableList):
+            return
+        entry = self.__nodes[id(node)]
+        entry[1] -= 1
+        if entry[1]:
+            return
+
+        del self.__nodes[id(node)]
+        self.__bytes -= entry[2]
+        for child in node.values() if type(node) is ImmutableDict else node:
+            self.__releaseRef(child)
@@ -0,0 +1,198 @@
+import asyncio
+import collections
+import json
+import logging
+import os
+import re
+
+from pykzee.core.common import (
+    diffState,
+    dumpJson,
+    getDataForPath,
+    makePath,
+    Path,
+    PathType,
+    sanitize,
+    setDataForPath,
+    StateEdits,
+    Undefined,
+    writeJson,
+)
+
+
+class StateJournal:
+    """Append-only journal of the state published by plugins
+
+    Every change a plugin makes to its state is appended to a journal file as
+    one JSON line, holding the plugin path, the path within the plugin state
+    and the new value:
+
+    * ``[plugin_path, path, value]``: ``value`` was set at ``path``
+    * ``[plugin_path, path]``: ``path`` was deleted
+    * ``[plugin_path]``: the plugin was removed, forget its state
+
+    Writes made during one iteration of the event loop are written to disk
+    together. Once the journal grows beyond ``max_journal_bytes``, the state
+    of all plugins is written to a checkpoint file, and a new, empty journal
+    is started. Checkpoint and journal carry a generation number, so a crash
+    at any point during compaction leaves a consistent pair of files behind.
+    """
+
+    def __init__(self, directory, *, max_journal_bytes=8 << 20, sync=False):
+        self.__directory = directory
+        self.__maxJournalBytes = max_journal_bytes
+        self.__sync = sync
+        self.__states = {}  # Path -> plugin state
+        self.__buffer = []
+        self.__flushScheduled = False
+        os.makedirs(directory, exist_ok=True)
+
+        self.__generation = self.__loadCheckpoint()
+        self.__removeStaleJournals()
+        self.__replayJournal()
+        self.__file = open(self.__journalPath(self.__generation), "a")
+        self.__journalBytes = self.__file.tell()
+
+    def state(self, path: PathType):
+        """Return the last state recorded for the plugin at ``path``"""
+        return self.__states.get(makePath(path), Undefined)
+
+    def record(self, plugin_path: Path, path: PathType, value, new_state):
+        """Record that ``value`` was set at ``path`` in a plugin state
+
+        The value is taken from ``new_state``, so what is journaled is what
+        the plugin state holds (list operations already applied). For
+        ``StateEdits``, one entry is journaled for every path that changed.
+        """
+        old_state = self.__states.get(plugin_path, Undefined)
+        self.__states[plugin_path] = new_state
+        if type(value) is StateEdits:
+            changes = diffState(
+                getDataForPath(old_state, path),
+                getDataForPath(new_state, path),
+                path,
+            )
+        else:
+            changes = ((path, getDataForPath(new_state, path)),)
+        for changed_path, changed_value in changes:
+            if changed_value is Undefined:
+                entry = [plugin_path.string, list(changed_path)]
+            else:
+                entry = [plugin_path.string, list(changed_path), changed_value]
+            self.__append(entry)
+
+    def discard(self, plugin_path: Path):
+        if self.__states.pop(plugin_path, Undefined) is not Undefined:
+            self.__append([plugin_path.string])
+
+    def flush(self):
+        self.__flushScheduled = False
+        if not self.__buffer:
+            return
+        data = "".join(self.__buffer)
+        self.__buffer = []
+        self.__file.write(data)
+        self.__file.flush()
+        if self.__sync:
+            os.fsync(self.__file.fileno())
+        self.__journalBytes += len(data)
+        if self.__journalBytes > self.__maxJournalBytes:
+            self.compact()
+
+    def compact(self):
+        """Write a checkpoint and start a new, empty journal"""
+        self.flush()
+        generation = self.__generation + 1
+        checkpoint = {
+            "generation": generation,
+            "states": {
+                path.string: state for path, state in self.__states.items()
+            },
+        }
+        checkpoint_path = os.path.join(self.__directory, "checkpoint.json")
+        tmp_path = checkpoint_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            writeJson(checkpoint, f.write)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, checkpoint_path)
+
+        old_journal_path = self.__journalPath(self.__generation)
+        self.__file.close()
+        self.__generation = generation
+        self.__file = open(self.__journalPath(generation), "w")
+        self.__journalBytes = 0
+        os.unlink(old_journal_path)
+
+    def close(self):
+        self.flush()
+        self.__file.close()
+
+    def __append(self, entry):
+        self.__buffer.append(dumpJson(entry) + "\n")
+        if not self.__flushScheduled:
+            self.__flushScheduled = True
+            asyncio.get_event_loop().call_soon(self.flush)
+
+    def __journalPath(self, generation):
+        return os.path.join(self.__directory, f"journal-{ generation }.jsonl")
+
+    def __loadCheckpoint(self):
+        try:
+            with open(os.path.join(self.__directory, "checkpoint.json")) as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            return 0
+        for path, state in checkpoint["states"].items():
+            self.__states[makePath(path)] = sanitize(state)
+        return checkpoint["generation"]
+
+    def __removeStaleJournals(self):
+        # A crash during compaction, after the new checkpoint was written,
+        # can leave the journal of the previous generation behind
+        for filename in os.listdir(self.__directory):
+            match = re.fullmatch(r"journal-(\d+)\.jsonl", filename)
+            if match and int(match.group(1)) < self.__generation:
+                os.unlink(os.path.join(self.__directory, filename))
+
+    def __replayJournal(self):
+        # Collect the entries for each plugin first, so that everything
+        # before the last entry that replaces (or discards) the whole plugin
+        # state can be skipped.
+        entries = collections.defaultdict(list)
+        try:
+            with open(self.__journalPath(self.__generation)) as f:
+                for lineno, line in enumerate(f, 1):
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn write at the end of the journal
+                        logging.warning(
+                            f"StateJournal: ignoring invalid entry in line "
+                            f"{ lineno } of the journal"
+                        )
+                        continue
+                    plugin_entries = entries[entry[0]]
+                    if len(entry) == 1 or not entry[1]:
+                        plugin_entries.clear()
+                    plugin_entries.append(entry)
+        except FileNotFoundError:
+            return
+
+        for path_string, plugin_entries in entries.items():
+            path = makePath(path_string)
+            state = self.__states.get(path)
+            for entry in plugin_entries:
+                if len(entry) == 1:
+                    state = Undefined
+                    continue
+                if state is Undefined:
+                    state = None
+                value = entry[2] if len(entry) == 3 else Undefined
+                state = setDataForPath(
+                    state, makePath(entry[1]), value, undefined=None
+                )
+            if state is Undefined:
+                self.__states.pop(path, None)
+            else:
+                self.__states[path] = state
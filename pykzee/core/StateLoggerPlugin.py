@@ -1,70 +1,124 @@
+import asyncio
 import logging
+import logging.handlers
+import queue
+import time
 
-from pyimmutable import ImmutableDict, ImmutableList
-from pykzee.core.common import makePath
+from pykzee.core.common import diffState, dumpJson, makePath, Undefined
 from pykzee.core.Plugin import Plugin
 
 
 class StateLoggerPlugin(Plugin):
+    """Log the state tree (or a subtree of it) on every change
+
+    Configuration keys:
+
+    * ``path``: the subtree to log (defaults to the root)
+    * ``pretty``: pretty-print the full state
+    * ``diff``: only log the paths that changed since the last output
+    * ``file``: write to this file instead of the ``logging`` module. Output
+      is written from a background thread, and the file is rotated once it
+      grows beyond ``max_bytes`` (keeping ``backup_count`` old files)
+    * ``max_rate``: maximum number of outputs per second. Updates arriving
+      faster than that are coalesced into the next output.
+    """
+
     def init(self, config):
-        self.__pretty = bool(config.get("pretty", False))
-        self.unsubscribe = self.subscribe(
-            self.stateUpdate, makePath(config.get("path", ()))
-        )
+        self.__listener = None
+        self.__flushHandle = None
+        self.unsubscribe = None
+        self.__configure(config)
 
     def updateConfig(self, new_config):
-        self.unsubscribe()
-        self.__pretty = new_config["pretty"]
-        self.unsubscribe = self.subscribe(
-            self.stateUpdate, new_config.get("path", ())
-        )
+        self.shutdown()
+        self.__configure(new_config)
         return True
 
+    def shutdown(self):
+        if self.unsubscribe is not None:
+            self.unsubscribe()
+            self.unsubscribe = None
+        if self.__flushHandle is not None:
+            self.__flushHandle.cancel()
+            self.__flushHandle = None
+        if self.__listener is not None:
+            self.__listener.stop()
+            for handler in self.__listener.handlers:
+                handler.close()
+            self.__listener = None
+
+    def __configure(self, config):
+        self.__pretty = bool(config.get("pretty", False))
+        self.__diff = bool(config.get("diff", False))
+        max_rate = config.get("max_rate")
+        self.__minInterval = 1.0 / max_rate if max_rate else 0.0
+        self.__lastOutputTime = None
+        self.__loggedState = Undefined
+        self.__pendingState = Undefined
+
+        filename = config.get("file")
+        if filename is None:
+            self.__write = logging.debug
+        else:
+            handler = logging.handlers.RotatingFileHandler(
+                filename,
+                maxBytes=config.get("max_bytes", 0),
+                backupCount=config.get("backup_count", 0),
+            )
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            log_queue = queue.SimpleQueue()
+            self.__listener = logging.handlers.QueueListener(
+                log_queue, handler
+            )
+            self.__listener.start()
+            queue_handler = logging.handlers.QueueHandler(log_queue)
+            self.__write = lambda msg: queue_handler.handle(
+                logging.makeLogRecord({"msg": msg})
+            )
+
+        self.__path = makePath(config.get("path", ()))
+        self.unsubscribe = self.subscribe(self.stateUpdate, self.__path)
+
     def stateUpdate(self, state):
-        if not self.__pretty:
-            logging.debug(repr(state))
+        self.__pendingState = state
+        if self.__flushHandle is not None:
             return
 
-        logging.debug("StateLoggerPlugin: new state:")
-        pretty_print(state, OutputLines(logging.debug))
+        now = time.monotonic()
+        if self.__lastOutputTime is not None:
+            delay = self.__lastOutputTime + self.__minInterval - now
+            if delay > 0:
+                self.__flushHandle = asyncio.get_event_loop().call_later(
+                    delay, self.__flush
+                )
+                return
 
+        self.__flush()
 
-class OutputLines:
-    def __init__(self, write):
-        self.__write = write
-        self.__data = ""
+    def __flush(self):
+        self.__flushHandle = None
+        self.__lastOutputTime = time.monotonic()
+        state = self.__pendingState
 
-    def __call__(self, x):
-        self.__data += x
-        pos = self.__data.rfind("\n")
-        if pos < 0:
-            return
-        out = self.__data[0:pos]
-        self.__data = self.__data[pos + 1 :]
-        for line in out.split("\n"):
-            self.__write(line)
-
-    def __del__(self):
-        if self.__data:
-            self.__write(self.__data)
-
-
-def pretty_print(data, write, indent=""):
-    if type(data) is ImmutableDict:
-        more_indent = indent + "  "
-        write("{\n")
-        for key, value in data.items():
-            write(f"{ indent }  { key !r}: ")
-            pretty_print(value, write, more_indent)
-            write(",\n")
-        write(f"{ indent }}}")
-    elif type(data) is ImmutableList:
-        more_indent = indent + "  "
-        write("[\n")
-        for value in data:
-            write(more_indent)
-            pretty_print(value, write, more_indent)
-            write(",\n")
-        write(f"{ indent }]")
-    else:
-        write(repr(data))
+        if self.__diff:
+            lines = []
+            diff(self.__loggedState, state, self.__path, lines.append)
+            if lines:
+                self.__write("\n".join(lines))
+        elif self.__pretty:
+            self.__write(
+                "StateLoggerPlugin: new state:\n" + dumpJson(state, indent=2)
+            )
+        else:
+            self.__write(dumpJson(state))
+
+        self.__loggedState = state
+
+
+def diff(old, new, path, write):
+    """Call ``write`` with a line for every path that changed"""
+    for changed_path, value in diffState(old, new, path):
+        if value is Undefined:
+            write(f"del { changed_path.string }")
+        else:
+            write(f"set { changed_path.string } { dumpJson(value) }")
@@ -0,0 +1,59 @@
+import asyncio
+import threading
+import traceback
+
+from pykzee.core.common import makePath, StateEdits
+
+
+class ThreadSafePublisher:
+    """Set state from any thread, in batches
+
+    ``set`` may be called from any thread. Writes are collected in a buffer,
+    and the event loop is woken up once to apply all writes collected until
+    then, as a single ``StateEdits`` batch. Repeated writes to the same path
+    before that only keep the last value. Paths are only parsed on the
+    thread running the event loop.
+
+    Create the publisher on the thread running the event loop.
+    """
+
+    __slots__ = "__set", "__loop", "__lock", "__buffer", "__coalesced"
+
+    def __init__(self, set_state):
+        self.__set = set_state
+        self.__loop = asyncio.get_event_loop()
+        self.__lock = threading.Lock()
+        self.__buffer = {}  # path -> value, in order of the last write
+        self.__coalesced = 0
+
+    @property
+    def coalesced(self):
+        """Number of writes that were superseded before being applied"""
+        return self.__coalesced
+
+    def set(self, path, value):
+        if type(path) is not str:
+            path = tuple(path)
+        with self.__lock:
+            buffer = self.__buffer
+            wakeup = not buffer
+            if buffer.pop(path, buffer) is not buffer:
+                self.__coalesced += 1
+            buffer[path] = value
+        if wakeup:
+            self.__loop.call_soon_threadsafe(self.__drain)
+
+    def __drain(self):
+        with self.__lock:
+            buffer, self.__buffer = self.__buffer, {}
+        edits = StateEdits()
+        for path, value in buffer.items():
+            try:
+                edits.set(makePath(path), value)
+            except Exception:
+                traceback.print_exc()
+        if edits:
+            try:
+                self.__set((), edits)
+            except Exception:
+                traceback.print_exc()
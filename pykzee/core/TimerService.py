@@ -0,0 +1,199 @@
+import asyncio
+import functools
+import heapq
+import inspect
+import itertools
+import random
+import time
+import traceback
+
+from pyimmutable import ImmutableDict
+from pykzee.core.common import print_exception_task_callback
+
+
+class Timer:
+    __slots__ = "plugin", "callback", "due", "interval", "jitter", "cancelled"
+
+    def __init__(self, plugin, callback, due, interval, jitter):
+        self.plugin = plugin
+        self.callback = callback
+        self.due = due  # nominal due time, without jitter
+        self.interval = interval
+        self.jitter = jitter
+        self.cancelled = False
+
+
+class TimerStats:
+    __slots__ = "timers", "load", "runs", "skipped", "busyTime"
+
+    def __init__(self):
+        self.timers = set()
+        self.load = 0.0  # runs per second of the periodic timers
+        self.runs = self.skipped = 0
+        self.busyTime = 0.0
+
+    def info(self):
+        return ImmutableDict(
+            timers=len(self.timers),
+            runs_per_second=round(self.load, 6),
+            runs=self.runs,
+            skipped=self.skipped,
+            busy_seconds=round(self.busyTime, 6),
+        )
+
+
+class TimerService:
+    """Run the timers of all plugins from a single event loop timer
+
+    Timers are kept in a heap ordered by due time, and only the earliest one
+    is scheduled with the event loop. When it fires, all timers due within
+    ``coalesce_window`` seconds are run together. Periodic timers keep their
+    phase (a run that is late does not delay the next one), and each run
+    can be delayed by a random amount of up to ``jitter`` seconds, to spread
+    the load of timers with the same interval.
+
+    Timers of disabled plugins are skipped, and ``cancelPlugin`` cancels
+    all timers of a plugin.
+    """
+
+    __slots__ = (
+        "coalesceWindow",
+        "__heap",
+        "__sequence",
+        "__handle",
+        "__handleDue",
+        "__stats",
+    )
+
+    def __init__(self, *, coalesce_window=0.01):
+        self.coalesceWindow = coalesce_window
+        self.__heap = []  # (due time including jitter, seq, Timer)
+        self.__sequence = itertools.count()
+        self.__handle = None
+        self.__handleDue = None
+        self.__stats = {}  # PluginInfo -> TimerStats
+
+    def after(self, plugin, delay, callback):
+        """Call ``callback`` once, ``delay`` seconds from now"""
+        loop = asyncio.get_event_loop()
+        return self.__add(
+            Timer(plugin, callback, loop.time() + delay, None, 0.0)
+        )
+
+    def at(self, plugin, timestamp, callback):
+        """Call ``callback`` once, at ``timestamp`` (as in ``time.time()``)"""
+        return self.after(plugin, timestamp - time.time(), callback)
+
+    def every(self, plugin, interval, callback, *, jitter=0.0):
+        """Call ``callback`` every ``interval`` seconds
+
+        The first call is ``interval`` seconds from now.
+        """
+        if interval <= 0:
+            raise ValueError("Timer interval must be positive")
+        loop = asyncio.get_event_loop()
+        return self.__add(
+            Timer(plugin, callback, loop.time() + interval, interval, jitter)
+        )
+
+    def cancel(self, timer):
+        if timer.cancelled:
+            return
+        timer.cancelled = True
+        stats = self.__stats.get(timer.plugin)
+        if stats is not None:
+            stats.timers.discard(timer)
+            if timer.interval is not None:
+                stats.load -= 1.0 / timer.interval
+
+    def cancelPlugin(self, plugin):
+        stats = self.__stats.pop(plugin, None)
+        if stats is not None:
+            for timer in stats.timers:
+                timer.cancelled = True
+
+    def stats(self):
+        return ImmutableDict(
+            (plugin.path.string, stats.info())
+            for plugin, stats in self.__stats.items()
+        )
+
+    def __add(self, timer):
+        stats = self.__stats.get(timer.plugin)
+        if stats is None:
+            stats = self.__stats[timer.plugin] = TimerStats()
+        stats.timers.add(timer)
+        if timer.interval is not None:
+            stats.load += 1.0 / timer.interval
+        self.__push(timer)
+        self.__schedule()
+        return functools.partial(self.cancel, timer)
+
+    def __push(self, timer):
+        due = timer.due
+        if timer.jitter:
+            due += random.uniform(0.0, timer.jitter)
+        heapq.heappush(self.__heap, (due, next(self.__sequence), timer))
+
+    def __schedule(self):
+        heap = self.__heap
+        while heap and heap[0][2].cancelled:
+            heapq.heappop(heap)
+        if not heap:
+            if self.__handle is not None:
+                self.__handle.cancel()
+                self.__handle = None
+            return
+        due = heap[0][0]
+        if self.__handle is not None:
+            if self.__handleDue <= due:
+                return
+            self.__handle.cancel()
+        self.__handleDue = due
+        self.__handle = asyncio.get_event_loop().call_at(due, self.__fire)
+
+    def __fire(self):
+        self.__handle = None
+        now = asyncio.get_event_loop().time()
+        limit = now + self.coalesceWindow
+        heap = self.__heap
+        due_timers = []
+        while heap and heap[0][0] <= limit:
+            timer = heapq.heappop(heap)[2]
+            if not timer.cancelled:
+                due_timers.append(timer)
+
+        for timer in due_timers:
+            if timer.interval is None:
+                self.cancel(timer)
+            else:
+                # Requeued only now, so that a periodic timer due again
+                # within the coalesce window does not run twice
+                timer.due += timer.interval
+                if timer.due <= now:
+                    # Skip the runs that were missed
+                    missed = int((now - timer.due) // timer.interval) + 1
+                    timer.due += missed * timer.interval
+                    self.__stats[timer.plugin].skipped += missed
+                self.__push(timer)
+
+        for timer in due_timers:
+            stats = self.__stats.get(timer.plugin)
+            if stats is None:
+                continue
+            if timer.plugin.disabled:
+                stats.skipped += 1
+                continue
+            start = time.perf_counter()
+            try:
+                ret = timer.callback()
+                if inspect.isawaitable(ret):
+                    asyncio.ensure_future(ret).add_done_callback(
+                        print_exception_task_callback
+                    )
+            except Exception:
+                traceback.print_exc()
+            stats.runs += 1
+            stats.busyTime += time.perf_counter() - start
+
+        self.__schedule()
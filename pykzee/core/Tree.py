@@ -1,7 +1,17 @@
+import asyncio
 import collections
+import contextlib
+import heapq
+import itertools
+import traceback
 
 from pyimmutable import ImmutableDict
-from pykzee.core.common import Undefined, setDataForPath
+from pykzee.core.common import (
+    makePath,
+    setDataForPath,
+    StateEdits,
+    Undefined,
+)
 
 
 class Tree:
@@ -20,6 +30,7 @@ class Tree:
             "set",
             "submitState",
             "registerCommand",
+            "registerCommands",
             "createSubtree",
             "clear",
             "deactivate",
@@ -32,15 +43,36 @@ class Tree:
         *,
         parent_set,
         parent_register_command,
-        immediate_updates=True
+        parent_register_commands=None,
+        immediate_updates=True,
+        auto_flush=False,
+        depth=0,
+        flush_queue=None
     ):
-        self.__path = path
+        """Create a subtree of a plugin's state (or of another subtree)
+
+        With ``immediate_updates``, every ``set`` is passed on to the parent
+        straight away. With ``auto_flush``, the accumulated state is passed on
+        once at the end of the current iteration of the event loop, after the
+        state of all auto-flushing subtrees nested inside this one (``depth``
+        is the nesting level, and subtrees share the ``flush_queue`` of the
+        outermost tree). Otherwise, ``submitState`` must be called.
+        """
+        self.__path = makePath(path)
         self.__parentSet = parent_set
         self.__parentRegisterCommand = parent_register_command
+        self.__parentRegisterCommands = (
+            parent_register_commands
+            or self.__registerCommandsWithParentOneByOne
+        )
         self.__state = ImmutableDict()
         self.__reportedState = Undefined
         self.__registeredCommands = {}
-        self.__immediate_updates = immediate_updates
+        self.__immediate_updates = immediate_updates and not auto_flush
+        self.__autoFlush = auto_flush
+        self.__flushPending = False
+        self.__depth = depth
+        self.__flushQueue = flush_queue or FlushQueue()
         self.__deactivated = False
         self.__hidden = False
 
@@ -53,6 +85,7 @@ class Tree:
             self.set,
             self.submitState,
             self.registerCommand,
+            self.registerCommands,
             self.createSubtree,
             self.clear,
             self.deactivate,
@@ -62,20 +95,65 @@ class Tree:
         self.__state = setDataForPath(self.__state, path, value)
         if self.__immediate_updates:
             self.submitState()
+        elif self.__autoFlush and not self.__flushPending:
+            self.__flushPending = True
+            self.__flushQueue.schedule(self, self.__depth)
+
+    @contextlib.contextmanager
+    def edit(self, path=()):
+        """Collect changes below ``path`` and set them all at once
+
+        In ``with self.edit() as edits: ...``, changes are recorded with
+        ``edits.set(path, value)`` and ``edits.delete(path)`` (see
+        ``StateEdits``). When the block exits without an exception, they are
+        passed to ``set`` together, so intermediate states are never built.
+        Nothing is set if no change was recorded.
+        """
+        edits = StateEdits()
+        yield edits
+        if edits:
+            self.set(path, edits)
 
     def registerCommand(self, path, name, function, *, doc=Undefined):
-        if doc is Undefined:
-            doc = function.__doc__
-        existing_rc = self.__registeredCommands.get((path, name))
-        if existing_rc is not None:
-            existing_rc.disabled = True
-            existing_rc.unregister()
+        return self.registerCommands(((path, name, function, doc),))[0]
+
+    def registerCommands(self, commands):
+        """Register many commands at once
+
+        ``commands`` is an iterable of ``(path, name, function)`` or
+        ``(path, name, function, doc)`` tuples. Returns a list of functions
+        that unregister the respective command.
+        """
+        new_commands = []
+        for path, name, function, *doc in commands:
+            path = makePath(path)
+            doc = doc[0] if doc else Undefined
+            if doc is Undefined:
+                doc = function.__doc__
+            new_commands.append((path, name, function, doc))
+
+        for path, name, _, _ in new_commands:
+            existing_rc = self.__registeredCommands.get((path, name))
+            if existing_rc is not None:
+                existing_rc.disabled = True
+                existing_rc.unregister()
+
         if self.__hidden:
-            unregister = no_op
+            unregisters = [no_op] * len(new_commands)
         else:
-            unregister = self.__parentRegisterCommand(
-                self.__path + path, name, function, doc=doc
+            unregisters = self.__parentRegisterCommands(
+                (self.__path + path, name, function, doc)
+                for path, name, function, doc in new_commands
+            )
+
+        return [
+            self.__addRegisteredCommand(path, name, function, doc, unregister)
+            for (path, name, function, doc), unregister in zip(
+                new_commands, unregisters
             )
+        ]
+
+    def __addRegisteredCommand(self, path, name, function, doc, unregister):
         rc = self.RegisteredCommand(function, doc, unregister)
         self.__registeredCommands[path, name] = rc
 
@@ -87,15 +165,26 @@ class Tree:
 
         return unregister_command
 
-    def createSubtree(self, path, *, immediate_updates=True):
+    def __registerCommandsWithParentOneByOne(self, commands):
+        return [
+            self.__parentRegisterCommand(path, name, function, doc=doc)
+            for path, name, function, doc in commands
+        ]
+
+    def createSubtree(self, path, *, immediate_updates=True, auto_flush=False):
         return Tree(
             path,
             parent_set=self.set,
             parent_register_command=self.registerCommand,
+            parent_register_commands=self.registerCommands,
             immediate_updates=immediate_updates,
+            auto_flush=auto_flush,
+            depth=self.__depth + 1,
+            flush_queue=self.__flushQueue,
         )
 
     def clear(self):
+        self.__flushPending = False
         for rc in self.__registeredCommands.values():
             rc.disabled = True
             rc.unregister()
@@ -107,7 +196,9 @@ class Tree:
     def deactivate(self):
         if not self.__deactivated:
             self.clear()
-            self.__parentSet = self.__parentRegisterCommand = raise_deactivated
+            self.__parentSet = raise_deactivated
+            self.__parentRegisterCommand = raise_deactivated
+            self.__parentRegisterCommands = raise_deactivated
             self.__deactivated = True
 
     def hide(self):
@@ -120,6 +211,8 @@ class Tree:
         self.__hidden = True
 
     def show(self, new_path=None):
+        if new_path is not None:
+            new_path = makePath(new_path)
         if not self.__hidden and (new_path is None or new_path == self.__path):
             return
         self.hide()
@@ -128,10 +221,19 @@ class Tree:
         self.__parentSet(self.__path, self.__state)
         self.__hidden = False
         self.__reportedState = self.__state
-        for (path, name), rc in self.__registeredCommands.items():
-            rc.unregister = self.__parentRegisterCommand(
-                self.__path + path, name, rc.function, rc.doc
-            )
+        registered_commands = list(self.__registeredCommands.items())
+        unregisters = self.__parentRegisterCommands(
+            (self.__path + path, name, rc.function, rc.doc)
+            for (path, name), rc in registered_commands
+        )
+        for (_, rc), unregister in zip(registered_commands, unregisters):
+            rc.unregister = unregister
+
+    def flush(self):
+        if self.__flushPending:
+            self.__flushPending = False
+            if not self.__deactivated:
+                self.submitState()
 
     def submitState(self):
         if self.__reportedState is not self.__state and not self.__hidden:
@@ -139,6 +241,39 @@ class Tree:
             self.__reportedState = self.__state
 
 
+class FlushQueue:
+    """Auto-flushing trees waiting for the end of the current loop iteration
+
+    The most deeply nested trees are flushed first, so that each tree passes
+    the state of all its flushed subtrees on to its parent at once.
+    """
+
+    __slots__ = "__queue", "__sequence", "__scheduled"
+
+    def __init__(self):
+        self.__queue = []  # heap of (-depth, sequence number, tree)
+        self.__sequence = itertools.count()
+        self.__scheduled = False
+
+    def schedule(self, tree, depth):
+        heapq.heappush(self.__queue, (-depth, next(self.__sequence), tree))
+        if not self.__scheduled:
+            self.__scheduled = True
+            asyncio.get_event_loop().call_soon(self.flush)
+
+    def flush(self):
+        queue = self.__queue
+        try:
+            while queue:
+                _, _, tree = heapq.heappop(queue)
+                try:
+                    tree.flush()
+                except Exception:
+                    traceback.print_exc()
+        finally:
+            self.__scheduled = False
+
+
 def raise_deactivated(*args, **kwargs):
     raise Exception("Subtree has been deactivated")
 
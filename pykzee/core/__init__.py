@@ -1,2 +1,4 @@
 from .CodePlugin import CodePlugin  # noqa: F401
 from .StateLoggerPlugin import StateLoggerPlugin  # noqa: F401
+from .ReplicationClientPlugin import ReplicationClientPlugin  # noqa: F401
+from .ReplicationServerPlugin import ReplicationServerPlugin  # noqa: F401
@@ -4,8 +4,13 @@ import logging
 import os
 
 
+from pykzee.core import AttachedInfo
+from pykzee.core.ChangefeedRecorder import ChangefeedRecorder
+from pykzee.core.CodeCache import codeCache
 from pykzee.core.RawStateLoader import RawStateLoader
 from pykzee.core.ManagedTree import ManagedTree
+from pykzee.core.SharedSnapshot import SnapshotWriter
+from pykzee.core.StateJournal import StateJournal
 
 logging.getLogger().setLevel(logging.DEBUG)
 
@@ -22,17 +27,109 @@ parser.add_argument(
     "--config",
     help="path to config directory (defaults to current working directory)",
 )
+parser.add_argument(
+    "--history-count",
+    type=int,
+    default=1,
+    help="maximum number of states kept in the state history",
+)
+parser.add_argument(
+    "--history-age",
+    type=float,
+    help="maximum age in seconds of states kept in the state history",
+)
+parser.add_argument(
+    "--history-memory",
+    type=int,
+    help="maximum memory in bytes used by the state history",
+)
+parser.add_argument(
+    "--journal",
+    help=(
+        "directory (outside the config directory) for a journal of the "
+        "state published by plug-ins, which is restored on restart"
+    ),
+)
+parser.add_argument(
+    "--record-changefeed",
+    metavar="FILE",
+    help=(
+        "record all changes of the raw state and of plug-in states to FILE, "
+        "for replaying with `python -m pykzee.core.ChangefeedReplay`"
+    ),
+)
+parser.add_argument(
+    "--snapshot",
+    metavar="FILE",
+    help=(
+        "publish the resolved state to the memory-mapped FILE, for reading "
+        "by other processes with pykzee.core.SharedSnapshot.SnapshotReader"
+    ),
+)
+parser.add_argument(
+    "--snapshot-interval",
+    type=float,
+    default=0.0,
+    help="minimum interval in seconds between snapshots",
+)
+parser.add_argument(
+    "--meta-cache-entries",
+    type=int,
+    help=(
+        "maximum total number of entries in the caches attached to nodes "
+        "of the state tree"
+    ),
+)
+parser.add_argument(
+    "--code-cache",
+    help="directory for caching compiled code of CodePlugin snippets",
+)
 options = parser.parse_args()
 
 
 async def amain():
+    journal = None
+    if options.journal:
+        journal = StateJournal(os.path.abspath(options.journal))
+
+    changefeed = None
+    if options.record_changefeed:
+        changefeed = ChangefeedRecorder(
+            os.path.abspath(options.record_changefeed)
+        )
+
+    snapshot = None
+    if options.snapshot:
+        snapshot = SnapshotWriter(
+            os.path.abspath(options.snapshot),
+            min_interval=options.snapshot_interval,
+        )
+
+    if options.meta_cache_entries is not None:
+        AttachedInfo.cachePolicy.maxTotalEntries = options.meta_cache_entries
+
+    if options.code_cache:
+        codeCache.directory = os.path.abspath(options.code_cache)
+
     if options.config:
         os.chdir(options.config)
 
-    mtree = ManagedTree()
+    mtree = ManagedTree(
+        history_max_count=options.history_count,
+        history_max_age=options.history_age,
+        history_max_bytes=options.history_memory,
+        journal=journal,
+        changefeed=changefeed,
+        snapshot=snapshot,
+    )
     raw_state_loader = RawStateLoader(mtree.setRawState)
-    await raw_state_loader.readStateFromDisk()
-    await raw_state_loader.run()
+    try:
+        await raw_state_loader.readStateFromDisk()
+        await raw_state_loader.run()
+    finally:
+        for output in (changefeed, journal, snapshot):
+            if output is not None:
+                output.close()
 
 
 def main():
@@ -1,7 +1,10 @@
 import asyncio
 from collections.abc import Mapping, Sequence
+import functools
 import inspect
+import json
 import re
+import sys
 import typing
 import urllib.parse
 
@@ -9,8 +12,11 @@ from pyimmutable import ImmutableDict, ImmutableList
 
 
 __all__ = (
-    "Undefined PathType InvalidPathElement PathElementTypeMismatch "
-    "sanitize getDataForPath setDataForPath "
+    "Undefined Path PathType InvalidPathElement PathElementTypeMismatch "
+    "StateQuotaExceeded "
+    "sanitize getDataForPath setDataForPath diffState dumpJson writeJson "
+    "ListOperation listSplice listInsert listRemoveRange listMove "
+    "listAppendCapped StateEdits "
     "makePath stringToPathElement pathToString "
     "waitForOne call_soon print_exception_task_callback".split()
 )
@@ -49,6 +55,122 @@ class PathElementTypeMismatch(Exception):
         )
 
 
+class StateQuotaExceeded(Exception):
+    def __init__(self, path, limit, value):
+        super(StateQuotaExceeded, self).__init__(
+            f"State of plugin { pathToString(path) } would exceed its quota "
+            f"({ limit }: { value })"
+        )
+
+
+class Path(tuple):
+    """Immutable, interned path into the state tree
+
+    A ``Path`` is a tuple of path elements (``str`` or ``int``), so it can be
+    used wherever a plain tuple is accepted, and compares and hashes equal to
+    the plain tuple of its elements. Equal paths are the same object, which
+    allows the hash, the string form, the parent and the prefixes of a path to
+    be computed at most once.
+    """
+
+    __interned = {}
+    __pruneThreshold = 4096
+
+    def __new__(cls, elements=()):
+        if type(elements) is Path:
+            return elements
+        elements = tuple(elements)
+        # Check the elements before the lookup: True == 1, so (True,) would
+        # otherwise find the interned (1,)
+        for e in elements:
+            if type(e) is not str and type(e) is not int:
+                raise InvalidPathElement(e)
+
+        interned = Path.__interned
+        try:
+            return interned[elements]
+        except KeyError:
+            ...
+
+        if len(interned) >= Path.__pruneThreshold:
+            Path.__prune()
+
+        self = tuple.__new__(cls, elements)
+        self.__hash = tuple.__hash__(self)
+        self.__string = None
+        self.__parent = Undefined
+        self.__ancestors = None
+        interned[elements] = self
+        return self
+
+    @staticmethod
+    def __prune():
+        # Drop interned paths that are not referenced anywhere else. A child
+        # path keeps its parent alive, so repeat until nothing changes.
+        interned = Path.__interned
+        while True:
+            unused = [
+                key for key in interned if sys.getrefcount(interned[key]) <= 2
+            ]
+            if not unused:
+                break
+            for key in unused:
+                del interned[key]
+        Path.__pruneThreshold = max(4096, 2 * len(interned))
+
+    def __hash__(self):
+        return self.__hash
+
+    def __add__(self, other):
+        return Path(tuple.__add__(self, tuple(other)))
+
+    def __reduce__(self):
+        return Path, (tuple(self),)
+
+    def __repr__(self):
+        return f"Path({ self.string !r})"
+
+    def __str__(self):
+        return self.string
+
+    @property
+    def string(self) -> str:
+        s = self.__string
+        if s is None:
+            s = self.__string = "/" + "/".join(
+                pathElementToString(e) for e in self
+            )
+        return s
+
+    @property
+    def parent(self) -> typing.Optional["Path"]:
+        parent = self.__parent
+        if parent is Undefined:
+            parent = self.__parent = Path(self[:-1]) if self else None
+        return parent
+
+    @property
+    def ancestors(self) -> typing.Tuple["Path", ...]:
+        """All proper prefixes of this path, starting with the root path"""
+        ancestors = self.__ancestors
+        if ancestors is None:
+            parent = self.parent
+            ancestors = self.__ancestors = (
+                () if parent is None else parent.ancestors + (parent,)
+            )
+        return ancestors
+
+    def child(self, element: PathElementType) -> "Path":
+        return Path(tuple.__add__(self, (element,)))
+
+    def startswith(self, prefix) -> bool:
+        """Test whether ``prefix`` is equal to or an ancestor of this path"""
+        n = len(prefix)
+        if n >= len(self):
+            return n == len(self) and self == prefix
+        return self.ancestors[n] is Path(prefix)
+
+
 def sanitize(data):
     t = type(data)
     if (t is ImmutableList or t is ImmutableDict) and data.isImmutableJson:
@@ -89,10 +211,133 @@ def getDataForPath(data, path: PathType):
     return data
 
 
+class ListOperation:
+    """An edit of a list, to be passed as the value to ``setDataForPath``
+
+    Use ``listSplice``, ``listInsert``, ``listRemoveRange``, ``listMove`` or
+    ``listAppendCapped`` to create one. Each operation builds the new list
+    from slices of the old one rather than element by element. A list
+    operation on a path that does not exist (or is ``null``) applies to an
+    empty list.
+    """
+
+    __slots__ = "__function", "__args"
+
+    def __init__(self, function, *args):
+        self.__function = function
+        self.__args = args
+
+    def __repr__(self):
+        return f"{ self.__function.__name__ }{ self.__args !r}"
+
+    def apply(self, data):
+        if data is Undefined or data is None:
+            data = ImmutableList()
+        elif type(data) is not ImmutableList:
+            raise TypeError(
+                f"List operation applied to { type(data).__name__ }"
+            )
+        return self.__function(data, *self.__args)
+
+
+def _splice(data, start, delete_count, items):
+    length = len(data)
+    start = slice(start, None).indices(length)[0]
+    stop = min(start + max(delete_count, 0), length)
+    if stop == start and not items:
+        return data
+    if start == 0 and not items:
+        return data[stop:]
+    # Slicing and concatenating immutable lists is done in C and faster than
+    # building a new list element by element
+    result = data[:start] if start < length else data
+    if items:
+        result = result.extend(items)
+    if stop < length:
+        result = result + data[stop:]
+    return result
+
+
+def _removeRange(data, start, stop):
+    start, stop, _ = slice(start, stop).indices(len(data))
+    return _splice(data, start, stop - start, ())
+
+
+def _move(data, source, destination):
+    length = len(data)
+    if not (-length <= source < length and -length <= destination < length):
+        raise IndexError("list index out of range")
+    source %= length
+    destination %= length
+    if source == destination:
+        return data
+    item = data[source]
+    if source < destination:
+        return (
+            data[:source]
+            + data[source + 1 : destination + 1].append(item)
+            + data[destination + 1 :]
+        )
+    return (
+        data[:destination].append(item)
+        + data[destination:source]
+        + data[source + 1 :]
+    )
+
+
+def _appendCapped(data, items, max_length):
+    excess = len(data) + len(items) - max_length
+    if excess <= 0:
+        return data.extend(items)
+    if excess >= len(data):
+        return ImmutableList(items[len(items) - max_length :])
+    return data[excess:].extend(items)
+
+
+def listSplice(start: int, delete_count: int, items=()) -> ListOperation:
+    """Replace ``delete_count`` elements from ``start`` on with ``items``"""
+    return ListOperation(_splice, start, delete_count, _sanitizeItems(items))
+
+
+def listInsert(index: int, *items) -> ListOperation:
+    """Insert ``items`` before the element at ``index``"""
+    return ListOperation(_splice, index, 0, _sanitizeItems(items))
+
+
+def listRemoveRange(start: int, stop: int) -> ListOperation:
+    """Remove the elements from ``start`` up to (excluding) ``stop``"""
+    return ListOperation(_removeRange, start, stop)
+
+
+def listMove(source: int, destination: int) -> ListOperation:
+    """Move the element at ``source`` so that it ends up at ``destination``"""
+    return ListOperation(_move, source, destination)
+
+
+def listAppendCapped(max_length: int, *items) -> ListOperation:
+    """Append ``items``, then drop elements from the front of the list to
+    make it at most ``max_length`` elements long (a ring buffer)"""
+    return ListOperation(_appendCapped, _sanitizeItems(items), max_length)
+
+
+def _sanitizeItems(items):
+    return tuple(sanitize(x) for x in items if x is not Undefined)
+
+
 def setDataForPath(data, path: PathType, value, *, undefined=ImmutableDict()):
+    """Return ``data`` with ``value`` set at ``path``
+
+    ``value`` may be ``Undefined`` (to delete ``path``), a
+    ``ListOperation`` (to edit the list at ``path``) or ``StateEdits`` (to
+    make several changes below ``path``).
+    """
     if not path:
         if value is Undefined:
             return undefined
+        elif type(value) is ListOperation:
+            return value.apply(data)
+        elif type(value) is StateEdits:
+            return value.apply(data, undefined=undefined)
         else:
             return sanitize(value)
     p, path = path[0], path[1:]
@@ -110,48 +355,267 @@ def setDataForPath(data, path: PathType, value, *, undefined=ImmutableDict()):
             raise PathElementTypeMismatch(p, data)
         if value is Undefined and not path:
             if 0 <= p < len(data):
-                return data[0:p] + data[p + 1 :]
+                return _splice(data, p, 1, ())
             else:
                 return data
         if p < 0 or p > len(data):
             raise IndexError
         if p == len(data):
             return data.append(setDataForPath(Undefined, path, value))
+        return data.set(p, setDataForPath(data[p], path, value))
     else:
         raise InvalidPathElement(p)
     return data.set(p, setDataForPath(data.get(p, Undefined), path, value))
 
 
+class StateEdits:
+    """A batch of changes, to be passed as the value to ``setDataForPath``
+
+    ``set`` and ``delete`` record changes relative to the path the batch is
+    applied to. ``apply`` makes all of them in a single pass over the data:
+    every node on the way to a changed path is rebuilt once, instead of once
+    per change, and unchanged nodes keep their identity. The result is the
+    same as that of calling ``setDataForPath`` for each change in order.
+    """
+
+    __slots__ = ("__root", "__count")
+
+    def __init__(self):
+        self.__root = _EditNode()
+        self.__count = 0
+
+    def __len__(self):
+        return self.__count
+
+    def set(self, path: PathType, value):
+        path = makePath(path)
+        self.__count += 1
+        delete_element = value is Undefined and path and type(path[-1]) is int
+        node = self.__root
+        for p in path[:-1] if delete_element else path:
+            child = node.children.get(p)
+            if child is None:
+                child = node.children[p] = _EditNode()
+                node.steps.append((p, child))
+            node = child
+        if delete_element:
+            # Deleting a list element shifts the elements after it, so later
+            # changes in this list cannot be merged with earlier ones
+            node.steps.append((path[-1], None))
+            node.children = {}
+        else:
+            node.value = value
+            node.steps = []
+            node.children = {}
+
+    def delete(self, path: PathType):
+        self.set(path, Undefined)
+
+    def apply(self, data, *, undefined=ImmutableDict()):
+        return _applyEdits(data, self.__root, undefined)
+
+
+class _EditNode:
+    __slots__ = "value", "steps", "children"
+
+    def __init__(self):
+        self.value = _unchanged
+        self.steps = []  # (path element, _EditNode or None to delete)
+        self.children = {}  # path element -> _EditNode, for merging
+
+
+_unchanged = _make_atom("unchanged")
+
+
+def _applyEdits(data, node, undefined):
+    if node.value is not _unchanged:
+        data = setDataForPath(data, (), node.value, undefined=undefined)
+    steps = node.steps
+    if not steps:
+        return data
+
+    if type(steps[0][0]) is str:
+        if data is Undefined:
+            data = ImmutableDict()
+        elif type(data) is not ImmutableDict:
+            raise PathElementTypeMismatch(steps[0][0], data)
+        updates = []
+        for p, child in steps:
+            if type(p) is not str:
+                raise PathElementTypeMismatch(p, data)
+            value = _applyEdits(data.get(p, Undefined), child, Undefined)
+            if value is Undefined:
+                data = data.discard(p)
+            else:
+                updates.append((p, value))
+        return data.update(updates) if updates else data
+
+    if data is Undefined:
+        data = ImmutableList()
+    elif type(data) is not ImmutableList:
+        raise PathElementTypeMismatch(steps[0][0], data)
+    for p, child in steps:
+        if type(p) is not int:
+            raise PathElementTypeMismatch(p, data)
+        if child is None:
+            if 0 <= p < len(data):
+                data = _splice(data, p, 1, ())
+        elif p < 0 or p > len(data):
+            raise IndexError
+        elif p == len(data):
+            data = data.append(_applyEdits(Undefined, child, ImmutableDict()))
+        else:
+            data = data.set(p, _applyEdits(data[p], child, ImmutableDict()))
+    return data
+
+
+def diffState(old, new, path: PathType = ()):
+    """Yield ``(path, value)`` for every path that changed from old to new
+
+    ``value`` is ``Undefined`` for deleted paths. Applying the changes in
+    order with ``setDataForPath`` turns ``old`` into ``new``. Unchanged
+    subtrees are skipped by identity, so the cost is proportional to the
+    size of the change, not the size of the state.
+    """
+    if old is new:
+        return
+    path = makePath(path)
+    told, tnew = type(old), type(new)
+    if told is tnew is ImmutableDict:
+        for key, value in new.items():
+            yield from diffState(
+                old.get(key, Undefined), value, path.child(key)
+            )
+        for key in old.keys():
+            if key not in new:
+                yield path.child(key), Undefined
+    elif told is tnew is ImmutableList:
+        for idx in range(min(len(old), len(new))):
+            yield from diffState(old[idx], new[idx], path.child(idx))
+        for idx in range(len(old), len(new)):
+            yield path.child(idx), new[idx]
+        for idx in range(len(old) - 1, len(new) - 1, -1):
+            yield path.child(idx), Undefined
+    else:
+        yield path, new
+
+
+def dumpJson(data, *, indent=None) -> str:
+    """Encode json data as JSON
+
+    The output is compact, or, if ``indent`` is given, pretty-printed like
+    ``json.dumps(data, indent=indent)``. The encoding of every
+    ``ImmutableDict`` and ``ImmutableList`` is cached in a ``MetaCache`` in
+    its ``meta``, so encoding a new state only encodes the nodes along the
+    paths that changed, and reuses the cached encoding of all other nodes.
+    Plain lists, tuples and dicts are encoded without being cached, so a
+    message built around immutable data should not be sanitized first.
+    """
+    t = type(data)
+    if t is ImmutableDict or t is ImmutableList:
+        cache = _jsonCache(data)
+        result = cache.get(indent)
+        if result is None:
+            result = "".join(_jsonChunks(data, indent))
+            cache.put(indent, result)
+        return result
+    if t is list or t is tuple or t is dict:
+        return "".join(_jsonChunks(data, indent))
+    return json.dumps(data)
+
+
+def writeJson(data, write, *, indent=None):
+    """Write the JSON encoding of ``data`` by calling ``write`` repeatedly
+
+    Like ``dumpJson``, but the encoding of the top-level node is not built
+    as a whole (unless it is cached already): ``write`` is called with the
+    encoding of each of its children in turn.
+    """
+    t = type(data)
+    if t is ImmutableDict or t is ImmutableList:
+        cached = _jsonCache(data).get(indent)
+        if cached is not None:
+            write(cached)
+            return
+    elif not (t is list or t is tuple or t is dict):
+        write(json.dumps(data))
+        return
+    for chunk in _jsonChunks(data, indent):
+        write(chunk)
+
+
+def _jsonCache(data):
+    meta = data.meta
+    try:
+        return meta["json-cache"]
+    except KeyError:
+        # AttachedInfo imports this module, so it cannot be imported before
+        from pykzee.core.AttachedInfo import MetaCache
+
+        cache = meta["json-cache"] = MetaCache("json")
+        return cache
+
+
+def _jsonChunks(data, indent):
+    is_dict = type(data) is ImmutableDict or type(data) is dict
+    if not data:
+        yield "{}" if is_dict else "[]"
+        return
+    if indent is None:
+        newline, separator, colon = "", ",", ":"
+    else:
+        newline = "\n" + " " * indent
+        separator, colon = "," + newline, ": "
+    yield ("{" if is_dict else "[") + newline
+    first = True
+    for item in data.items() if is_dict else data:
+        chunk = dumpJson(item[1] if is_dict else item, indent=indent)
+        if indent is not None:
+            chunk = chunk.replace("\n", newline)
+        if is_dict:
+            key = json.dumps(enforceKeyType(item[0]))
+            chunk = f"{ key }{ colon }{ chunk }"
+        yield chunk if first else separator + chunk
+        first = False
+    yield ("\n" if indent is not None else "") + ("}" if is_dict else "]")
+
+
 def makePath(
     s: typing.Union[str, typing.Sequence[PathElementType]],
     *,
     relativeTo: PathType = (),
-) -> PathType:
-    if type(s) is str:
-        absolute = s.startswith("/")
-        s = s.strip("/")
-        if not s:
-            return () if absolute else relativeTo
-        result = [] if absolute else list(relativeTo)
-        for e in s.split("/"):
-            if e == "..":
-                if result:
-                    result.pop()
-            elif e != ".":
-                result.append(stringToPathElement(e))
-        return tuple(result)
+) -> Path:
+    if type(s) is Path:
+        return s
+    elif type(s) is str:
+        return _parsePath(s, makePath(relativeTo))
     elif isinstance(s, Sequence):
-        result = tuple(s)
-        for i in result:
-            if type(i) not in (str, int):
-                raise TypeError(
-                    "Path sequence must only contain str and int elements"
-                )
-        return result
+        try:
+            return Path(s)
+        except InvalidPathElement:
+            raise TypeError(
+                "Path sequence must only contain str and int elements"
+            ) from None
     else:
         raise TypeError(f"Cannot convert type { type(s).__name__ } to path")
 
 
+@functools.lru_cache(maxsize=4096)
+def _parsePath(s: str, relativeTo: Path) -> Path:
+    absolute = s.startswith("/")
+    s = s.strip("/")
+    if not s:
+        return Path() if absolute else relativeTo
+    result = [] if absolute else list(relativeTo)
+    for e in s.split("/"):
+        if e == "..":
+            if result:
+                result.pop()
+        elif e != ".":
+            result.append(stringToPathElement(e))
+    return Path(result)
+
+
 _rex_integer_element = re.compile(r"^\[(\d+)\]$")
 
 
@@ -163,7 +627,7 @@ def stringToPathElement(e: str) -> PathElementType:
 
 
 def pathToString(path: PathType) -> str:
-    return "/" + "/".join(pathElementToString(e) for e in path)
+    return Path(path).string
 
 
 def pathElementToString(e: PathElementType) -> str:
@@ -3,7 +3,7 @@ import unittest
 from pyimmutable import ImmutableDict, ImmutableList
 
 from pykzee.core import AttachedInfo
-from pykzee.core.common import sanitize
+from pykzee.core.common import makePath, sanitize
 
 # Instantiante an empty ImmutableDict, since pykzee modules may or may not do
 # that anyway. This way we know what instance counts to expect in the tests
@@ -49,6 +49,97 @@ class TestResolved(unittest.TestCase):
         self.assertEqual(immutables_count(), 1)
 
 
+class TestSymlinkTrie(unittest.TestCase):
+    def test_realpath(self):
+        trie = AttachedInfo.SymlinkTrie(
+            [
+                (makePath("/a"), makePath("/x/y")),
+                (makePath("/x/y/z"), makePath("/b")),
+                (makePath("/b"), makePath("/c")),
+            ]
+        )
+        self.assertTrue(trie.realpath(makePath("/a/q")) is makePath("/x/y/q"))
+        self.assertTrue(trie.realpath(makePath("/a/z/w")) is makePath("/c/w"))
+        self.assertTrue(trie.realpath(makePath("/x")) is makePath("/x"))
+        self.assertTrue(trie.realpath(()) is makePath("/"))
+
+    def test_cycle(self):
+        trie = AttachedInfo.SymlinkTrie(
+            [
+                (makePath("/a"), makePath("/b/c")),
+                (makePath("/b"), makePath("/a")),
+                (makePath("/d"), makePath("/d/e")),
+            ]
+        )
+        self.assertIsNone(trie.realpath(makePath("/a")))
+        self.assertIsNone(trie.realpath(makePath("/b/x")))
+        self.assertIsNone(trie.realpath(makePath("/d/e")))
+        self.assertTrue(trie.realpath(makePath("/c")) is makePath("/c"))
+
+    def test_memo_limit(self):
+        policy = AttachedInfo.cachePolicy
+        self.addCleanup(
+            setattr, policy, "maxRealpathEntries", policy.maxRealpathEntries
+        )
+        policy.maxRealpathEntries = 10
+        total = policy.totalEntries
+        trie = AttachedInfo.SymlinkTrie([(makePath("/a"), makePath("/b"))])
+        self.assertTrue(trie.realpath(makePath("/a/x")) is makePath("/b/x"))
+        self.assertEqual(len(trie), 3)
+        self.assertEqual(policy.totalEntries, total + 3)
+        for n in range(20):
+            trie.realpath(makePath(f"/c/{ n }"))
+            self.assertLessEqual(len(trie), 11)
+        self.assertTrue(trie.realpath(makePath("/a/y")) is makePath("/b/y"))
+        trie = None
+        self.assertEqual(policy.totalEntries, total)
+
+
+class TestMetaCache(unittest.TestCase):
+    def setUp(self):
+        policy = AttachedInfo.cachePolicy
+        limits = policy.maxNodeEntries, policy.maxTotalEntries
+        self.addCleanup(setattr, policy, "maxNodeEntries", limits[0])
+        self.addCleanup(setattr, policy, "maxTotalEntries", limits[1])
+
+    def test_node_limit(self):
+        AttachedInfo.cachePolicy.maxNodeEntries = 2
+        stats = AttachedInfo.cachePolicy.stats["test-cache"]
+        evictions = stats.evictions
+        cache = AttachedInfo.MetaCache("test-cache")
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(stats.evictions, evictions + 1)
+
+    def test_total_budget(self):
+        policy = AttachedInfo.cachePolicy
+        policy.maxTotalEntries = policy.totalEntries + 3
+        first = AttachedInfo.MetaCache("test-cache")
+        second = AttachedInfo.MetaCache("test-cache")
+        first.put("a", 1)
+        first.put("b", 2)
+        second.put("a", 1)
+        second.put("b", 2)
+        self.assertEqual(len(first), 0)
+        self.assertEqual(len(second), 2)
+        total = policy.totalEntries
+        second = None
+        self.assertEqual(policy.totalEntries, total - 2)
+
+    def test_subtree_cache(self):
+        data = sanitize({"a": {"b": [1, 2]}})
+        stats = AttachedInfo.cachePolicy.stats["subtree-cache"]
+        hits = stats.hits
+        self.assertEqual(AttachedInfo.getSubtree(data, ("a", "b", 1)), 2)
+        self.assertEqual(AttachedInfo.getSubtree(data, ("a", "b", 1)), 2)
+        self.assertEqual(stats.hits, hits + 1)
+
+
 def immutables_count():
     return (
         ImmutableDict._get_instance_count()
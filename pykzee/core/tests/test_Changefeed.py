@@ -0,0 +1,103 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from pykzee.core.ChangefeedRecorder import ChangefeedRecorder
+from pykzee.core.ChangefeedReplay import (
+    ChangefeedReplay,
+    replacePlugins,
+    replacePluginsAt,
+)
+from pykzee.core.common import diffState, sanitize
+from pykzee.core.ManagedTree import ManagedTree
+
+CODE = """
+def double(value):
+    history = (get(path) or {}).get("history", ())
+    set_state((), {"double": value * 2, "history": [*history, value]})
+
+subscribe(double, "/value")
+"""
+
+
+async def record(filename):
+    recorder = ChangefeedRecorder(filename)
+    mt = ManagedTree(changefeed=recorder)
+    code = {"__plugin__": "pykzee.core.CodePlugin", "code.py": CODE}
+    for value in (0, 1, 2, 3, 10):
+        mt.setRawState({"value": value, "code": code})
+        await asyncio.sleep(0.01)
+    mt.setRawState({"value": 10, "code": code, "other": 1})
+    await asyncio.sleep(0.01)
+    recorder.close()
+    return mt.get("/").discard("sys")
+
+
+async def replay(filename, speed):
+    changefeed_replay = ChangefeedReplay(filename, speed=speed)
+    await changefeed_replay.run()
+    return changefeed_replay
+
+
+class TestChangefeed(unittest.TestCase):
+    def check_replay(self, filename, speed):
+        final_state = asyncio.run(record(filename))
+        self.assertEqual(
+            list(final_state["code"]["history"]), [0, 1, 2, 3, 10]
+        )
+        changefeed_replay = asyncio.run(replay(filename, speed))
+        self.assertTrue(
+            changefeed_replay.managedTree.get("/").discard("sys")
+            is final_state
+        )
+        self.assertTrue(changefeed_replay.cycles)
+        self.assertIn("update cycles", changefeed_replay.report())
+
+    def test_replay_fast(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.check_replay(os.path.join(directory, "feed.jsonl"), None)
+
+    def test_replay_timed_compressed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.check_replay(os.path.join(directory, "feed.jsonl.gz"), 2.0)
+
+    def test_replay_truncated_compressed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "feed.jsonl.gz")
+            final_state = asyncio.run(record(filename))
+            # Cut off the end of the gzip stream, as if the recording
+            # process had been killed
+            with open(filename, "rb") as f:
+                data = f.read()
+            with open(filename, "wb") as f:
+                f.write(data[:-8])
+            with self.assertLogs(level="WARNING"):
+                changefeed_replay = asyncio.run(replay(filename, None))
+            self.assertTrue(
+                changefeed_replay.managedTree.get("/").discard("sys")
+                is final_state
+            )
+
+    def test_replace_plugins_incrementally(self):
+        plugin = {"__plugin__": "x.Y", "config": [1, 2]}
+        states = [
+            {},
+            {"a": {"b": plugin}, "c": 1},
+            {"a": {"b": dict(plugin, config=[1])}, "c": 1},
+            {"a": {"b": {"config": [1]}}, "c": 1},
+            {"a": {"b": {"config": [1], "__plugin__": "x.Z"}}, "c": [1, 2]},
+            {"a": {"b": plugin, "d": {"e": plugin}}, "c": [1]},
+            {"a": [plugin, plugin], "c": [1]},
+            {"a": [plugin], "c": []},
+        ]
+        raw_state = replaced = sanitize(states[0])
+        for state in map(sanitize, states[1:]):
+            for path, _ in diffState(raw_state, state):
+                replaced = replacePluginsAt(replaced, state, path, "r.R")
+            raw_state = state
+            self.assertTrue(replaced is replacePlugins(state, "r.R"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import asyncio
+import os
+import tempfile
+import unittest
+
+from pykzee.core.CodeCache import codeCache
+from pykzee.core.ManagedTree import ManagedTree
+
+CODE = """
+set_state((), {"n": 0})
+
+def inc():
+    set_state(("n",), get(path + ("n",)) + 1)
+
+register_command((), "inc", inc)
+"""
+
+
+def code_plugin(**kwargs):
+    return dict(
+        kwargs, __plugin__="pykzee.core.CodePlugin", **{"code.py": CODE}
+    )
+
+
+class TestCodePlugin(unittest.TestCase):
+    def setUp(self):
+        codeCache.clear()
+        self.addCleanup(codeCache.clear)
+
+    def test_cache_hit_for_new_instance(self):
+        async def run():
+            mt = ManagedTree()
+            mt.setRawState({"p": code_plugin()})
+            await asyncio.sleep(0.01)
+            hits, misses = codeCache.hits, codeCache.misses
+            mt.setRawState({})
+            await asyncio.sleep(0.01)
+            mt.setRawState({"p": code_plugin()})
+            await asyncio.sleep(0.01)
+            self.assertEqual(mt.get("/p/n"), 0)
+            self.assertEqual(codeCache.hits, hits + 1)
+            self.assertEqual(codeCache.misses, misses)
+
+        asyncio.run(run())
+
+    def test_disk_cache(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        codeCache.directory = directory.name
+        self.addCleanup(setattr, codeCache, "directory", None)
+
+        async def run():
+            mt = ManagedTree()
+            mt.setRawState({"p": code_plugin()})
+            await asyncio.sleep(0.01)
+            self.assertEqual(len(os.listdir(directory.name)), 1)
+
+            # Compiled code is loaded from disk when it is not in memory
+            codeCache.clear()
+            misses = codeCache.misses
+            mt.setRawState({})
+            await asyncio.sleep(0.01)
+            mt.setRawState({"p": code_plugin()})
+            await asyncio.sleep(0.01)
+            self.assertEqual(mt.get("/p/n"), 0)
+            self.assertEqual(codeCache.misses, misses)
+
+        asyncio.run(run())
+
+    def test_update_config_in_place(self):
+        async def run():
+            mt = ManagedTree()
+            mt.setRawState({"p": code_plugin()})
+            await asyncio.sleep(0.01)
+            mt.command("/p", "inc")()
+            await asyncio.sleep(0.01)
+            self.assertEqual(mt.get("/p/n"), 1)
+
+            # Changing other keys than the code keeps the plugin running
+            mt.setRawState({"p": code_plugin(other=1)})
+            await asyncio.sleep(0.01)
+            self.assertEqual(mt.get("/p/n"), 1)
+
+            mt.setRawState(
+                {"p": dict(code_plugin(), **{"code.py": CODE + "\n"})}
+            )
+            await asyncio.sleep(0.01)
+            self.assertEqual(mt.get("/p/n"), 0)
+
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+import asyncio
+import unittest
+
+from pykzee.core.common import Path
+from pykzee.core.ManagedTree import ManagedTree, PluginInfo
+
+CODE = """
+set_state((), {"value": 42})
+
+def double(x):
+    return 2 * x
+
+register_command((), "double", double)
+"""
+
+
+def lazy_plugin(lazy=True):
+    return {
+        "__plugin__": "pykzee.core.CodePlugin",
+        "__lazy__": lazy,
+        "code.py": CODE,
+    }
+
+
+class TestLazyPlugins(unittest.TestCase):
+    def test_started_by_get(self):
+        async def run():
+            mt = ManagedTree()
+            mt.setRawState({"diag": lazy_plugin()})
+            await asyncio.sleep(0.01)
+            self.assertEqual(
+                mt.get("/sys/lazy_plugins")["/diag"]["active"], False
+            )
+            self.assertNotIn("/diag", mt.get("/sys/commands"))
+
+            self.assertEqual(mt.get("/diag/value"), 42)
+            await asyncio.sleep(0.01)
+            self.assertEqual(
+                mt.get("/sys/lazy_plugins")["/diag"]["active"], True
+            )
+            self.assertIn("double", mt.get("/sys/commands")["/diag"])
+
+        asyncio.run(run())
+
+    def test_started_by_get_through_symlink(self):
+        async def run():
+            mt = ManagedTree()
+            mt.setRawState(
+                {
+                    "tools": {"diag": lazy_plugin()},
+                    "link": {"__symlink__": "/tools/diag"},
+                }
+            )
+            await asyncio.sleep(0.01)
+            self.assertEqual(mt.get("/link/value"), 42)
+            await asyncio.sleep(0.01)
+            self.assertEqual(
+                mt.get("/sys/lazy_plugins")["/tools/diag"]["active"], True
+            )
+            self.assertEqual(mt.get("/link/value"), 42)
+
+        asyncio.run(run())
+
+    def test_started_by_command(self):
+        async def run():
+            mt = ManagedTree()
+            mt.setRawState({"diag": lazy_plugin({"commands": ["double"]})})
+            await asyncio.sleep(0.01)
+            self.assertIn("double", mt.get("/sys/commands")["/diag"])
+            self.assertEqual(
+                mt.get("/sys/lazy_plugins")["/diag"]["active"], False
+            )
+            self.assertEqual(mt.command("/diag", "double")(4), 8)
+            await asyncio.sleep(0.01)
+            self.assertEqual(mt.get("/diag/value"), 42)
+
+        asyncio.run(run())
+
+    def test_started_by_subscription_and_idle_timeout(self):
+        async def run():
+            mt = ManagedTree()
+            mt.setRawState(
+                {
+                    "diag": lazy_plugin({"idle_timeout": 0.05}),
+                    "user": {
+                        "__plugin__": "pykzee.core.CodePlugin",
+                        "code.py": "unsubscribe = subscribe("
+                        "lambda v: set_state((), {'seen': v}), '/diag/value')"
+                        "\nregister_command((), 'stop', unsubscribe)",
+                    },
+                }
+            )
+            await asyncio.sleep(0.02)
+            self.assertEqual(mt.get("/user/seen"), 42)
+
+            # The subscription keeps the plugin running
+            await asyncio.sleep(0.1)
+            self.assertEqual(
+                mt.get("/sys/lazy_plugins")["/diag"]["active"], True
+            )
+
+            mt.command("/user", "stop")()
+            await asyncio.sleep(0.15)
+            self.assertEqual(
+                mt.get("/sys/lazy_plugins")["/diag"]["active"], False
+            )
+
+        asyncio.run(run())
+
+    def test_subscription_through_symlink_keeps_plugin_running(self):
+        async def run(link, path):
+            mt = ManagedTree()
+            mt.setRawState(
+                {
+                    "tools": {"diag": lazy_plugin({"idle_timeout": 0.05})},
+                    "link": {"__symlink__": link},
+                }
+            )
+            await asyncio.sleep(0.01)
+            plugin = PluginInfo(path=Path(("p",)), configuration={})
+            calls = []
+            unsubscribe = mt.subscribe(plugin, (path,), calls.append)
+            await asyncio.sleep(0.15)
+            self.assertEqual(calls, [42])
+            self.assertEqual(
+                mt.get("/sys/lazy_plugins")["/tools/diag"]["active"], True
+            )
+
+            unsubscribe()
+            await asyncio.sleep(0.15)
+            self.assertEqual(
+                mt.get("/sys/lazy_plugins")["/tools/diag"]["active"], False
+            )
+
+        for link, path in (
+            ("/tools/diag", "/link/value"),
+            ("/tools", "/link/diag/value"),
+        ):
+            with self.subTest(link=link):
+                asyncio.run(run(link, path))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,206 @@
+import asyncio
+import unittest
+
+from pykzee.core.common import Path, sanitize, StateQuotaExceeded
+from pykzee.core.ManagedTree import ManagedTree, PluginInfo
+
+
+class TestLazySys(unittest.TestCase):
+    def test_get(self):
+        async def run():
+            mt = ManagedTree()
+            mt.setRawState({"a": {"b": 1}})
+            await asyncio.sleep(0.01)
+            raw = sanitize({"a": {"b": 1}})
+            self.assertTrue(mt.get("/sys/raw") is raw)
+            self.assertEqual(mt.get("/sys/raw/a/b"), 1)
+            self.assertTrue(ManagedTree.lazySysEntries <= set(mt.get("/sys")))
+            self.assertTrue(mt.get(())["sys"]["raw"] is raw)
+
+        asyncio.run(run())
+
+    def test_subscription_and_symlink(self):
+        async def run():
+            mt = ManagedTree()
+            plugin = PluginInfo(path=Path(("p",)), configuration={})
+            calls = []
+            mt.subscribe(plugin, ("/sys/raw/a",), calls.append, initial=True)
+            mt.setRawState({"a": 1, "link": {"__symlink__": "/sys/raw/a"}})
+            await asyncio.sleep(0.01)
+            self.assertEqual(mt.get("/link"), 1)
+            mt.setRawState({"a": 2, "link": {"__symlink__": "/sys/raw/a"}})
+            await asyncio.sleep(0.01)
+            self.assertEqual(mt.get("/link"), 2)
+            self.assertEqual(calls[-2:], [1, 2])
+
+        asyncio.run(run())
+
+
+class TestCommands(unittest.TestCase):
+    def test_register_commands(self):
+        async def run():
+            cycles = []
+            mt = ManagedTree(
+                update_cycle_callback=lambda duration, updated: cycles.append(
+                    updated
+                )
+            )
+            plugin = PluginInfo(path=Path(("p",)), configuration={})
+            await asyncio.sleep(0.01)
+            cycles.clear()
+            unregister = mt.registerCommands(
+                plugin,
+                [(("x", str(i)), "cmd", lambda i=i: i) for i in range(100)]
+                + [((), "doc", lambda: None, "Documented")],
+            )
+            await asyncio.sleep(0.01)
+            # All commands are published with a single state update
+            self.assertEqual(cycles, [True])
+            commands = mt.get("/sys/commands")
+            self.assertEqual(len(commands), 101)
+            self.assertEqual(commands["/p"]["doc"]["doc"], "Documented")
+            self.assertEqual(mt.command("/p/x/7", "cmd")(), 7)
+
+            for function in unregister[:50]:
+                function()
+            unregister[0]()
+            await asyncio.sleep(0.01)
+            self.assertEqual(len(mt.get("/sys/commands")), 51)
+            self.assertEqual(len(plugin.registeredCommands), 51)
+
+        asyncio.run(run())
+
+    def test_failed_batch_is_rolled_back(self):
+        async def run():
+            mt = ManagedTree()
+            plugin = PluginInfo(path=Path(("p",)), configuration={})
+            mt.registerCommand(plugin, (), "b", lambda: None)
+            with self.assertRaises(Exception):
+                mt.registerCommands(
+                    plugin, [((), "a", lambda: None), ((), "b", lambda: None)]
+                )
+            await asyncio.sleep(0.01)
+            self.assertEqual(list(mt.get("/sys/commands")["/p"]), ["b"])
+
+        asyncio.run(run())
+
+
+class TestQueries(unittest.TestCase):
+    def test_results_in_same_cycle(self):
+        async def run():
+            cycles = []
+            mt = ManagedTree(
+                update_cycle_callback=lambda duration, updated: cycles.append(
+                    updated
+                )
+            )
+            plugin = PluginInfo(path=Path(("p",)), configuration={})
+            link = {"__symlink__": "/sys/queries/low"}
+            mt.setRawState({"d": {"x": 5, "y": 50}, "link": link})
+            await asyncio.sleep(0.01)
+            mt.registerQuery(
+                plugin, "low", {"path": "/d", "where": [["", "<", 10]]}
+            )
+            await asyncio.sleep(0.01)
+            self.assertEqual(dict(mt.get("/link")), {"x": 5})
+
+            calls = []
+            mt.subscribe(plugin, ("/sys/queries/low",), calls.append)
+            cycles.clear()
+            mt.setRawState({"d": {"x": 5, "y": 1}, "link": link})
+            await asyncio.sleep(0.01)
+            # The changed result is part of the state it was computed from
+            self.assertEqual(cycles, [True])
+            self.assertEqual(dict(mt.get("/link")), {"x": 5, "y": 1})
+            self.assertEqual(
+                [dict(result) for result in calls], [{"x": 5, "y": 1}]
+            )
+
+            with self.assertRaises(Exception):
+                mt.registerQuery(plugin, "low", {"path": "/d"})
+
+        asyncio.run(run())
+
+
+QUOTA_CODE = """
+def put(n):
+    set_state((), {"items": list(range(n))})
+
+register_command((), "put", put)
+"""
+
+
+def quota_plugin(**quota):
+    return {
+        "__plugin__": "pykzee.core.CodePlugin",
+        "__quota__": quota,
+        "code.py": QUOTA_CODE,
+    }
+
+
+class TestQuotas(unittest.TestCase):
+    def test_sizes(self):
+        async def run():
+            mt = ManagedTree()
+            mt.setRawState({"p": quota_plugin(), "data": {"a": [1, 2]}})
+            await asyncio.sleep(0.01)
+            mt.command("/p", "put")(3)
+            await asyncio.sleep(0.01)
+            sizes = mt.get("/sys/sizes")
+            self.assertEqual(sizes["plugins"]["/p"]["nodes"], 5)
+            self.assertEqual(sizes["plugins"]["/p"]["quota_violations"], 0)
+            self.assertEqual(sizes["tree"]["data"]["nodes"], 4)
+            self.assertGreater(sizes["tree"]["data"]["bytes"], 0)
+
+        asyncio.run(run())
+
+    def test_reject(self):
+        async def run():
+            mt = ManagedTree()
+            mt.setRawState({"p": quota_plugin(nodes=10)})
+            await asyncio.sleep(0.01)
+            mt.command("/p", "put")(5)
+            with self.assertRaises(StateQuotaExceeded):
+                mt.command("/p", "put")(20)
+            await asyncio.sleep(0.01)
+            self.assertEqual(len(mt.get("/p/items")), 5)
+            self.assertEqual(
+                mt.get("/sys/sizes/plugins")["/p"]["quota_violations"], 1
+            )
+
+        asyncio.run(run())
+
+    def test_throttle(self):
+        async def run():
+            mt = ManagedTree()
+            mt.setRawState(
+                {
+                    "p": quota_plugin(
+                        nodes=10, action="throttle", throttle_interval=0.2
+                    )
+                }
+            )
+            await asyncio.sleep(0.01)
+            put = mt.command("/p", "put")
+            put(20)
+            await asyncio.sleep(0.01)
+            # The first update over the quota is published right away...
+            self.assertEqual(len(mt.get("/p/items")), 20)
+            put(21)
+            put(22)
+            await asyncio.sleep(0.01)
+            # ...the next ones only once the interval has passed
+            self.assertEqual(len(mt.get("/p/items")), 20)
+            await asyncio.sleep(0.3)
+            self.assertEqual(len(mt.get("/p/items")), 22)
+
+            # Updates within the quota are published immediately
+            put(3)
+            await asyncio.sleep(0.01)
+            self.assertEqual(len(mt.get("/p/items")), 3)
+
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    unittest.main()
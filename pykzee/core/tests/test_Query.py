@@ -0,0 +1,82 @@
+import unittest
+
+from pykzee.core.common import sanitize, setDataForPath, Undefined
+from pykzee.core.Query import Query
+
+DEVICES = {
+    "d1": {"battery": 10, "room": "kitchen", "floor": 0},
+    "d2": {"battery": 80, "room": "bath", "floor": 1},
+    "d3": {"battery": 15, "room": "attic", "floor": 2},
+    "d4": {"room": "hall", "floor": 0},
+}
+
+
+class TestQuery(unittest.TestCase):
+    def setUp(self):
+        self.state = sanitize({"devices": DEVICES})
+
+    def test_filter_and_select(self):
+        query = Query(
+            {
+                "path": "/devices",
+                "where": [["battery", "<", 20]],
+                "select": {"level": "battery"},
+            }
+        )
+        self.assertTrue(query.update(self.state))
+        self.assertTrue(
+            query.result
+            is sanitize({"d1": {"level": 10}, "d3": {"level": 15}})
+        )
+
+        # Unrelated changes leave the result alone
+        result = query.result
+        state = setDataForPath(self.state, ("devices", "d2", "battery"), 70)
+        self.assertFalse(query.update(state))
+        self.assertTrue(query.result is result)
+
+        state = setDataForPath(state, ("devices", "d1", "battery"), 90)
+        state = setDataForPath(state, ("devices", "d3"), Undefined)
+        self.assertTrue(query.update(state))
+        self.assertTrue(query.result is sanitize({}))
+
+    def test_group_by(self):
+        query = Query(
+            {
+                "path": "/devices",
+                "where": [["room", "exists"]],
+                "select": "room",
+                "group_by": "floor",
+            }
+        )
+        query.update(self.state)
+        self.assertTrue(
+            query.result
+            is sanitize(
+                {
+                    "0": {"d1": "kitchen", "d4": "hall"},
+                    "1": {"d2": "bath"},
+                    "2": {"d3": "attic"},
+                }
+            )
+        )
+
+        state = setDataForPath(self.state, ("devices", "d2", "floor"), 0)
+        self.assertTrue(query.update(state))
+        self.assertTrue(
+            query.result
+            is sanitize(
+                {
+                    "0": {"d1": "kitchen", "d2": "bath", "d4": "hall"},
+                    "2": {"d3": "attic"},
+                }
+            )
+        )
+
+    def test_invalid(self):
+        with self.assertRaises(Exception):
+            Query({"path": "/devices", "where": [["battery", "~", 1]]})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import asyncio
+import unittest
+
+from pykzee.core.common import makePath, Path
+from pykzee.core.ManagedTree import ManagedTree, PluginInfo
+from pykzee.core.ReactiveComputation import ReactiveComputation
+
+
+class TestReactiveComputation(unittest.TestCase):
+    def computation(self, mt, function):
+        plugin = PluginInfo(path=Path(("p",)), configuration={})
+        results, runs = [], []
+
+        def tracked(get):
+            runs.append(None)
+            return function(get)
+
+        computation = ReactiveComputation(
+            get=mt.get,
+            subscribe=lambda callback, *paths, initial: mt.subscribe(
+                plugin, paths, callback, initial=initial
+            ),
+            function=tracked,
+            callback=results.append,
+        )
+        computation.start()
+        return computation, results, runs
+
+    def test_dependencies(self):
+        async def run():
+            mt = ManagedTree()
+            mt.setRawState({"flag": True, "a": 1, "b": 2})
+            await asyncio.sleep(0.01)
+            computation, results, runs = self.computation(
+                mt, lambda get: get("/a") if get("/flag") else get("/b")
+            )
+            await asyncio.sleep(0.01)
+            self.assertEqual(results, [1])
+            self.assertEqual(
+                computation.dependencies, {makePath("/flag"), makePath("/a")}
+            )
+
+            # Changes to paths that were not read do not cause a run
+            mt.setRawState({"flag": True, "a": 1, "b": 3})
+            await asyncio.sleep(0.01)
+            self.assertEqual(len(runs), 1)
+
+            mt.setRawState({"flag": False, "a": 1, "b": 3})
+            await asyncio.sleep(0.01)
+            self.assertEqual(results, [1, 3])
+            self.assertEqual(
+                computation.dependencies, {makePath("/flag"), makePath("/b")}
+            )
+
+            computation.stop()
+            mt.setRawState({"flag": False, "a": 1, "b": 4})
+            await asyncio.sleep(0.01)
+            self.assertEqual(results, [1, 3])
+
+        asyncio.run(run())
+
+    def test_nested_reads(self):
+        async def run():
+            mt = ManagedTree()
+            mt.setRawState({"x": {"y": 1, "z": 2}})
+            await asyncio.sleep(0.01)
+            computation, results, _ = self.computation(
+                mt, lambda get: (get("/x/y"), len(get("/x")))
+            )
+            await asyncio.sleep(0.01)
+            self.assertEqual(results, [(1, 2)])
+            # Only the outermost path read is subscribed to
+            self.assertEqual(computation.dependencies, {makePath("/x")})
+
+            mt.setRawState({"x": {"y": 1, "z": 2, "w": 3}})
+            await asyncio.sleep(0.01)
+            self.assertEqual(results, [(1, 2), (1, 3)])
+
+        asyncio.run(run())
+
+    def test_change_during_async_run(self):
+        async def run():
+            mt = ManagedTree()
+            mt.setRawState({"a": 1})
+            await asyncio.sleep(0.01)
+
+            async def function(get):
+                value = get("/a")
+                await asyncio.sleep(0.02)
+                return value
+
+            _, results, _ = self.computation(mt, function)
+            await asyncio.sleep(0.01)
+            mt.setRawState({"a": 2})
+            await asyncio.sleep(0.05)
+            # The run that read the old value is followed by another one
+            self.assertEqual(results, [1, 2])
+
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    unittest.main()
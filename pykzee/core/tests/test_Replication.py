@@ -0,0 +1,193 @@
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+
+from pykzee.core.common import Path, sanitize, setDataForPath, Undefined
+from pykzee.core.ManagedTree import ManagedTree
+from pykzee.core.ReplicationServerPlugin import Export
+
+SERVER = textwrap.dedent("""
+    import asyncio, sys
+    from pykzee.core.ManagedTree import ManagedTree
+
+    code = '''
+    set_state((), {"n": 0, "items": ["a"]})
+
+    def inc(amount=1):
+        n = get(path + ("n",)) + amount
+        items = get(path + ("items",))
+        set_state(("n",), n)
+        set_state(("items", len(items)), str(n))
+        return n
+
+    register_command((), "inc", inc)
+    '''
+
+    async def main():
+        mt = ManagedTree()
+        mt.setRawState({
+            "data": {"__plugin__": "pykzee.core.CodePlugin", "code.py": code},
+            "replication": {
+                "__plugin__": "pykzee.core.ReplicationServerPlugin",
+                "socket": sys.argv[1],
+                "export": {"data": "/data"},
+            },
+        })
+        await asyncio.Future()
+
+    asyncio.run(main())
+    """)
+
+
+async def wait_for(predicate, timeout=10):
+    loop = asyncio.get_event_loop()
+    deadline = loop.time() + timeout
+    while not predicate():
+        if loop.time() > deadline:
+            raise TimeoutError
+        await asyncio.sleep(0.01)
+
+
+class TestReplication(unittest.TestCase):
+    def start_server(self, socket_path):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = subprocess.Popen(
+            [sys.executable, "-c", SERVER, socket_path],
+            env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)),
+        )
+        self.addCleanup(server.wait)
+        self.addCleanup(server.kill)
+        return server
+
+    def test_two_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            socket_path = os.path.join(directory, "replication.sock")
+            asyncio.run(self.run_client(socket_path))
+
+    async def run_client(self, socket_path):
+        server = self.start_server(socket_path)
+        mt = ManagedTree()
+        mt.setRawState(
+            {
+                "remote": {
+                    "__plugin__": "pykzee.core.ReplicationClientPlugin",
+                    "socket": socket_path,
+                    "export": "data",
+                    "reconnect_interval": 0.05,
+                }
+            }
+        )
+
+        await wait_for(lambda: mt.get("/remote/n") == 0)
+        self.assertEqual(list(mt.get("/remote/items")), ["a"])
+
+        await wait_for(lambda: "/remote" in mt.get("/sys/commands"))
+        self.assertEqual(await mt.command("/remote", "inc")(2), 2)
+        await wait_for(lambda: mt.get("/remote/n") == 2)
+        self.assertEqual(list(mt.get("/remote/items")), ["a", "2"])
+
+        # After a server restart, the client resynchronises
+        server.kill()
+        server.wait()
+        with self.assertRaises(Exception):
+            await mt.command("/remote", "inc")()
+        self.start_server(socket_path)
+        await wait_for(lambda: mt.get("/remote/n") == 0)
+        self.assertEqual(list(mt.get("/remote/items")), ["a"])
+
+    def test_slow_client(self):
+        with tempfile.TemporaryDirectory() as directory:
+            asyncio.run(
+                self.run_slow_client(os.path.join(directory, "slow.sock"))
+            )
+
+    async def run_slow_client(self, socket_path):
+        mt = ManagedTree()
+        server = {
+            "__plugin__": "pykzee.core.ReplicationServerPlugin",
+            "socket": socket_path,
+            "export": {"data": "/data"},
+            "max_buffer": 1 << 16,
+        }
+        mt.setRawState({"data": {"n": 0}, "server": server})
+        await wait_for(lambda: mt.get("/server/listening"))
+
+        client = socket.socket(socket.AF_UNIX)
+        client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        client.connect(socket_path)
+        client.setblocking(False)
+        client.send(b'["subscribe","data",null,0]\n')
+        await wait_for(lambda: mt.get("/server/connections") == 1)
+        await asyncio.sleep(0.01)
+
+        # The client does not read while the state changes, so the server
+        # stops sending it updates
+        for n in range(1, 51):
+            mt.setRawState(
+                {"data": {"n": n, "x": "x" * 20000}, "server": server}
+            )
+            await asyncio.sleep(0.001)
+        self.assertGreater(mt.get("/server/exports/data/resyncs"), 0)
+
+        # Once the client reads again, it catches up with the latest state
+        buffer, state, version = b"", None, None
+        while version != mt.get("/server/exports/data/version"):
+            await asyncio.sleep(0.001)
+            try:
+                buffer += client.recv(1 << 20)
+            except BlockingIOError:
+                continue
+            *lines, buffer = buffer.split(b"\n")
+            for message in map(json.loads, lines):
+                if message[0] == "snapshot":
+                    state, version = sanitize(message[4]), message[3]
+                elif message[0] == "delta":
+                    self.assertEqual(message[2], version + 1)
+                    for path, *value in message[3]:
+                        state = setDataForPath(
+                            state,
+                            tuple(path),
+                            value[0] if value else Undefined,
+                        )
+                    version = message[2]
+        self.assertEqual(state["n"], 50)
+        self.assertEqual(mt.get("/server/exports/data/clients"), 1)
+
+        # Removing the server closes its connections
+        mt.setRawState({})
+        await asyncio.sleep(0.01)
+        client.setblocking(True)
+        while client.recv(1 << 20):
+            pass
+        client.close()
+        self.assertFalse(
+            [
+                task
+                for task in asyncio.all_tasks()
+                if "ReplicationServerPlugin" in task.get_coro().__qualname__
+            ]
+        )
+
+    def test_deltas_since(self):
+        export = Export("data", Path(("data",)), 2)
+        self.assertEqual(export.deltasSince(0), ())
+        self.assertIsNone(export.deltasSince(1))
+        for version in range(1, 4):
+            export.version = version
+            export.backlog.append((version, [[["n"], version]]))
+        self.assertEqual(export.deltasSince(3), ())
+        self.assertEqual(
+            export.deltasSince(1), [(2, [[["n"], 2]]), (3, [[["n"], 3]])]
+        )
+        self.assertIsNone(export.deltasSince(0))
+
+
+if __name__ == "__main__":
+    unittest.main()
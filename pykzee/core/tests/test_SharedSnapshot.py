@@ -0,0 +1,140 @@
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+
+from pyimmutable import ImmutableDict, ImmutableList
+from pykzee.core.common import sanitize, setDataForPath, Undefined
+from pykzee.core.ManagedTree import ManagedTree
+from pykzee.core.SharedSnapshot import SnapshotReader, SnapshotWriter
+
+STATE = {
+    "devices": {
+        "lamp": {"on": True, "level": 0.5, "tags": ["a", "b"]},
+        "sensor": {"value": -3, "big": 1 << 70, "unit": None},
+    },
+    "name": "häus",
+    "empty": {},
+}
+
+
+class TestSharedSnapshot(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.filename = os.path.join(directory.name, "state.snapshot")
+
+    def test_lookup(self):
+        writer = SnapshotWriter(self.filename)
+        reader = SnapshotReader(self.filename)
+        self.assertEqual(reader.version, 0)
+        self.assertIs(reader.get("/devices"), Undefined)
+
+        writer.publish(sanitize(STATE))
+        self.assertEqual(reader.version, 1)
+        self.assertEqual(reader.get(()), STATE)
+        self.assertEqual(reader.get(("devices", "lamp", "tags", 1)), "b")
+        self.assertEqual(reader.get("/devices/sensor/big"), 1 << 70)
+        self.assertIsNone(reader.get("/devices/sensor/unit"))
+        self.assertIs(reader.get(("devices", "lamp", "tags", 2)), Undefined)
+        self.assertIs(reader.get("/devices/nothing", None), None)
+        self.assertIs(reader.get("/name/x"), Undefined)
+
+    def test_reuse_unchanged_subtrees(self):
+        writer = SnapshotWriter(self.filename)
+        reader = SnapshotReader(self.filename)
+        state = sanitize(STATE)
+        writer.publish(state)
+        size = os.path.getsize(self.filename)
+        lamp = reader.identity("/devices/lamp")
+        sensor = reader.identity("/devices/sensor")
+
+        state = setDataForPath(state, ("devices", "sensor", "value"), 4)
+        writer.publish(state)
+        self.assertEqual(reader.version, 2)
+        self.assertEqual(reader.identity("/devices/lamp"), lamp)
+        self.assertNotEqual(reader.identity("/devices/sensor"), sensor)
+        self.assertEqual(reader.get("/devices/sensor/value"), 4)
+        self.assertEqual(os.path.getsize(self.filename), size)
+
+    def test_old_states_released(self):
+        writer = SnapshotWriter(self.filename)
+        state = sanitize(STATE)
+        writer.publish(state)
+        count = immutables_count()
+        for i in range(10):
+            writer.publish(
+                setDataForPath(state, ("devices", "sensor", "value"), [i])
+            )
+        # The writer does not keep the published states alive
+        self.assertEqual(immutables_count(), count)
+
+        # Unchanged subtrees are still reused after that
+        reader = SnapshotReader(self.filename)
+        lamp = reader.identity("/devices/lamp")
+        writer.publish(setDataForPath(state, ("name",), "x"))
+        self.assertEqual(reader.identity("/devices/lamp"), lamp)
+        self.assertEqual(reader.get(()), dict(STATE, name="x"))
+
+    def test_new_file_when_full(self):
+        writer = SnapshotWriter(self.filename, capacity=1024)
+        reader = SnapshotReader(self.filename)
+        state = sanitize(STATE)
+        for i in range(100):
+            state = setDataForPath(state, ("counter",), i)
+            writer.publish(state)
+            self.assertEqual(reader.get("/counter"), i)
+        self.assertEqual(reader.get("/devices"), STATE["devices"])
+        self.assertEqual(reader.version, 100)
+        writer.publish(setDataForPath(state, ("list",), [0] * 200))
+        self.assertEqual(reader.get("/list"), [0] * 200)
+        self.assertGreater(writer.capacity, 1024)
+
+    def test_min_interval(self):
+        async def run():
+            writer = SnapshotWriter(self.filename, min_interval=0.02)
+            reader = SnapshotReader(self.filename)
+            for i in range(5):
+                writer.publish(sanitize({"i": i}))
+            self.assertEqual(reader.get("/i"), 0)
+            await asyncio.sleep(0.05)
+            self.assertEqual(reader.get("/i"), 4)
+            self.assertEqual(reader.version, 2)
+
+        asyncio.run(run())
+
+    def test_managed_tree_and_other_process(self):
+        async def run():
+            mt = ManagedTree(snapshot=SnapshotWriter(self.filename))
+            mt.setRawState({"a": {"b": [1, 2, 3]}})
+            await asyncio.sleep(0.01)
+
+        asyncio.run(run())
+        output = subprocess.check_output(
+            [
+                sys.executable,
+                "-c",
+                textwrap.dedent("""
+                    import sys
+                    from pykzee.core.SharedSnapshot import SnapshotReader
+                    print(SnapshotReader(sys.argv[1]).get(("a", "b", 2)))
+                    """),
+                self.filename,
+            ],
+            env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)),
+        )
+        self.assertEqual(output.strip(), b"3")
+
+
+def immutables_count():
+    return (
+        ImmutableDict._get_instance_count()
+        + ImmutableList._get_instance_count()
+    )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+
+from pykzee.core.common import sanitize, Undefined
+from pykzee.core.StateHistory import StateHistory
+
+
+def make_states(n):
+    return [sanitize({"a": i, "shared": list(range(100))}) for i in range(n)]
+
+
+class TestStateHistory(unittest.TestCase):
+    def test_time_travel(self):
+        history = StateHistory(max_count=10)
+        for i, state in enumerate(make_states(5)):
+            history.record(float(i), state)
+
+        self.assertEqual(history.get(("a",), 2.5), 2)
+        self.assertEqual(history.get(("a",), 100.0), 4)
+        self.assertTrue(history.get(("a",), -1.0) is Undefined)
+        self.assertEqual(
+            history.history(("a",), since=2.5), [(2.0, 2), (3.0, 3), (4.0, 4)]
+        )
+        self.assertEqual(history.history(("shared", 0)), [(0.0, 0)])
+
+    def test_max_count(self):
+        history = StateHistory(max_count=3)
+        for i, state in enumerate(make_states(5)):
+            history.record(float(i), state)
+        self.assertEqual(len(history), 3)
+        self.assertTrue(history.get(("a",), 1.0) is Undefined)
+
+    def test_max_age(self):
+        history = StateHistory(max_count=10, max_age=1.5)
+        for i, state in enumerate(make_states(5)):
+            history.record(float(i), state)
+        self.assertEqual(len(history), 3)
+        self.assertEqual(history.get(("a",), 2.5), 2)
+
+    def test_memory(self):
+        states = make_states(5)
+        history = StateHistory(max_count=10, max_bytes=10**9)
+        history.record(0.0, states[0])
+        single = history.memoryUsage
+        history.record(1.0, states[1])
+        # The shared list is only accounted for once
+        self.assertLess(history.memoryUsage, 1.5 * single)
+
+        bounded = StateHistory(max_count=10, max_bytes=single)
+        for i, state in enumerate(states):
+            bounded.record(float(i), state)
+        self.assertEqual(len(bounded), 1)
+        self.assertEqual(bounded.memoryUsage, single)
+
+    def test_no_byte_limit(self):
+        states = make_states(3)
+        history = StateHistory()
+        for i, state in enumerate(states):
+            history.record(float(i), state)
+        # Only the latest state is kept, and its nodes are not accounted for
+        self.assertEqual(len(history), 1)
+        self.assertTrue(history.stateAt(5.0) is states[2])
+        self.assertTrue(history.stateAt(1.0) is Undefined)
+        self.assertIsNone(history.memoryUsage)
+
+        # Setting a byte limit later accounts for the retained states
+        history.maxCount = 10
+        history.record(3.0, states[0])
+        history.maxBytes = 10**9
+        self.assertGreater(history.memoryUsage, 0)
+        history.maxBytes = None
+        self.assertIsNone(history.memoryUsage)
+        self.assertEqual(len(history), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
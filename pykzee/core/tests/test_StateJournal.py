@@ -0,0 +1,156 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+from pykzee.core.ChangefeedRecorder import ChangefeedRecorder
+from pykzee.core.common import (
+    listInsert,
+    Path,
+    sanitize,
+    setDataForPath,
+    StateEdits,
+    Undefined,
+)
+from pykzee.core.ManagedTree import ManagedTree
+from pykzee.core.StateJournal import StateJournal
+
+EDIT_CODE = """
+set_state((), {"l": list(range(1000))})
+
+def change(x):
+    with edit_state() as edits:
+        edits.set(("x",), x)
+        edits.delete(("l", 999))
+
+register_command((), "change", change)
+"""
+
+
+async def write_entries(directory, **kwargs):
+    journal = StateJournal(directory, **kwargs)
+    p1, p2 = Path(("p1",)), Path(("p2",))
+    journal.record(p1, (), {"a": 1}, sanitize({"a": 1}))
+    journal.record(p1, ("b",), [1, 2], sanitize({"a": 1, "b": [1, 2]}))
+    journal.record(p1, ("a",), Undefined, sanitize({"b": [1, 2]}))
+    journal.record(p2, (), 123, 123)
+    journal.discard(p2)
+    await asyncio.sleep(0)
+    journal.close()
+
+
+class TestStateJournal(unittest.TestCase):
+    def check_restored(self, directory):
+        journal = StateJournal(directory)
+        self.assertTrue(journal.state("/p1") is sanitize({"b": [1, 2]}))
+        self.assertTrue(journal.state("/p2") is Undefined)
+        journal.close()
+
+    def test_replay(self):
+        with tempfile.TemporaryDirectory() as directory:
+            asyncio.run(write_entries(directory))
+            self.check_restored(directory)
+
+    def test_compaction(self):
+        with tempfile.TemporaryDirectory() as directory:
+            asyncio.run(write_entries(directory, max_journal_bytes=10))
+            self.check_restored(directory)
+
+    def test_torn_write(self):
+        with tempfile.TemporaryDirectory() as directory:
+            asyncio.run(write_entries(directory))
+            with open(f"{ directory }/journal-0.jsonl", "a") as f:
+                f.write('["/p1",["c"],')
+            self.check_restored(directory)
+
+    def test_journals_stored_value(self):
+        async def run(directory):
+            journal = StateJournal(directory)
+            state = sanitize({"l": [1, 3]})
+            journal.record(Path(("p",)), ("l",), listInsert(1, 2), state)
+            await asyncio.sleep(0)
+            journal.close()
+
+        with tempfile.TemporaryDirectory() as directory:
+            asyncio.run(run(directory))
+            with open(f"{ directory }/journal-0.jsonl") as f:
+                self.assertEqual(json.loads(f.read()), ["/p", ["l"], [1, 3]])
+
+    def test_edits_journal_changed_paths(self):
+        async def run(directory):
+            journal = StateJournal(directory)
+            p = Path(("p",))
+            state = sanitize({"l": list(range(1000)), "d": {"a": 1}})
+            journal.record(p, (), state, state)
+            edits = StateEdits()
+            edits.set(("x",), 1)
+            edits.delete(("d", "a"))
+            new_state = setDataForPath(state, (), edits)
+            journal.record(p, (), edits, new_state)
+            await asyncio.sleep(0)
+            journal.close()
+            return new_state
+
+        with tempfile.TemporaryDirectory() as directory:
+            new_state = asyncio.run(run(directory))
+            with open(f"{ directory }/journal-0.jsonl") as f:
+                lines = f.readlines()
+            self.assertEqual(
+                sorted(map(json.loads, lines[1:])),
+                [["/p", ["d", "a"]], ["/p", ["x"], 1]],
+            )
+            journal = StateJournal(directory)
+            self.assertTrue(journal.state("/p") is new_state)
+            journal.close()
+
+    def test_plugin_edits(self):
+        async def run(directory):
+            journal = StateJournal(directory)
+            changefeed = ChangefeedRecorder(f"{ directory }/changefeed")
+            mt = ManagedTree(journal=journal, changefeed=changefeed)
+            mt.setRawState(
+                {
+                    "p": {
+                        "__plugin__": "pykzee.core.CodePlugin",
+                        "code.py": EDIT_CODE,
+                    }
+                }
+            )
+            await asyncio.sleep(0.01)
+            sizes = [
+                os.path.getsize(f"{ directory }/journal-0.jsonl"),
+                os.path.getsize(f"{ directory }/changefeed"),
+            ]
+            mt.command("/p", "change")(1)
+            await asyncio.sleep(0.01)
+            journal.close()
+            changefeed.close()
+            self.assertEqual(len(mt.get("/p/l")), 999)
+            return sizes
+
+        with tempfile.TemporaryDirectory() as directory:
+            journal_size, changefeed_size = asyncio.run(run(directory))
+            # Only the changed paths are written, not the whole plugin state
+            self.assertLess(
+                os.path.getsize(f"{ directory }/journal-0.jsonl"),
+                journal_size + 100,
+            )
+            self.assertLess(
+                os.path.getsize(f"{ directory }/changefeed"),
+                changefeed_size + 200,
+            )
+
+    def test_stale_journal_removed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            asyncio.run(write_entries(directory, max_journal_bytes=10))
+            # As if the process crashed before removing the old journal
+            stale = f"{ directory }/journal-0.jsonl"
+            with open(stale, "w") as f:
+                f.write('["/p1",["x"],1]\n')
+            self.check_restored(directory)
+            self.assertFalse(os.path.exists(stale))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import asyncio
+import json
+import os
+import re
+import tempfile
+import unittest
+
+from pykzee.core.ManagedTree import ManagedTree
+
+
+class TestStateLoggerPlugin(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.filename = os.path.join(directory.name, "state.log")
+
+    def run_logger(self, config, states, *, delay=0.01, wait=0.0):
+        async def run():
+            mt = ManagedTree()
+            logger = dict(
+                config,
+                __plugin__="pykzee.core.StateLoggerPlugin",
+                path="/data",
+                file=self.filename,
+            )
+            for state in states:
+                mt.setRawState({"data": state, "logger": logger})
+                await asyncio.sleep(delay)
+            await asyncio.sleep(wait)
+            # Removing the plugin flushes and closes the file
+            mt.setRawState({})
+            await asyncio.sleep(0.01)
+
+        asyncio.run(run())
+        with open(self.filename) as f:
+            return re.split(
+                r"^\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3} ", f.read(), flags=re.M
+            )[1:]
+
+    def test_compact(self):
+        outputs = self.run_logger({}, [{"a": [1, 2]}, {"a": [1, 3]}])
+        self.assertEqual(
+            [json.loads(x) for x in outputs], [{"a": [1, 2]}, {"a": [1, 3]}]
+        )
+
+    def test_pretty(self):
+        (output,) = self.run_logger({"pretty": True}, [{"a": {"b": 1}}])
+        self.assertEqual(
+            output,
+            "StateLoggerPlugin: new state:\n"
+            + json.dumps({"a": {"b": 1}}, indent=2)
+            + "\n",
+        )
+
+    def test_diff(self):
+        outputs = self.run_logger(
+            {"diff": True},
+            [{"a": 1, "b": {"c": 2}}, {"a": 1, "b": {"c": 3}}, {"a": 1}],
+        )
+        self.assertEqual(
+            [x.splitlines() for x in outputs[1:]],
+            [["set /data/b/c 3"], ["del /data/b"]],
+        )
+        # The first output sets the whole subtree
+        kind, path, value = outputs[0].split(" ", 2)
+        self.assertEqual((kind, path), ("set", "/data"))
+        self.assertEqual(json.loads(value), {"a": 1, "b": {"c": 2}})
+
+    def test_max_rate(self):
+        # The first update is written right away, the next ones within the
+        # interval are coalesced into a single output when it has passed
+        outputs = self.run_logger(
+            {"max_rate": 2},
+            [{"n": n} for n in range(5)],
+            delay=0.001,
+            wait=0.7,
+        )
+        self.assertEqual(
+            [json.loads(x) for x in outputs], [{"n": 0}, {"n": 4}]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,185 @@
+import asyncio
+import random
+import time
+import unittest
+
+from pykzee.core.common import Path
+from pykzee.core.ManagedTree import (
+    Directory,
+    ManagedTree,
+    PluginInfo,
+    SubscriptionDispatcher,
+)
+
+
+class FakeSubscription:
+    def __init__(self, name, priority, calls, duration=0.0):
+        self.name = name
+        self.priority = priority
+        self.queuedAt = None
+        self.calls = calls
+        self.duration = duration
+
+    def update(self, dispatcher):
+        self.calls.append(self.name)
+        if self.duration:
+            time.sleep(self.duration)
+
+
+class TestDirectory(unittest.TestCase):
+    def test_add_remove(self):
+        root = Directory(None, None)
+        subs = []
+        for i in range(200):
+            directories = (root.get(("a", i % 7)), root.get(("b",)))
+            sub = type("Sub", (), {})()
+            sub.directories = directories
+            sub.positions = [None] * len(directories)
+            for idx, directory in enumerate(directories):
+                directory.addSubscription(sub, idx)
+            subs.append(sub)
+
+        random.seed(1)
+        random.shuffle(subs)
+        for n, sub in enumerate(subs):
+            for idx, directory in enumerate(sub.directories):
+                directory.removeSubscription(sub, idx)
+                directory.garbageCollect()
+            remaining = subs[n + 1 :]
+            for other in remaining:
+                for idx, directory in enumerate(other.directories):
+                    position = other.positions[idx]
+                    self.assertIs(directory.subscriptions[position], other)
+                    self.assertEqual(directory.indices[position], idx)
+            if remaining:
+                self.assertEqual(
+                    len(root.get(("b",)).subscriptions), len(remaining)
+                )
+        self.assertEqual(root.subdirectories, {})
+
+
+class TestSubscriptions(unittest.TestCase):
+    def test_notify_after_unsubscribe(self):
+        async def run():
+            mt = ManagedTree()
+            plugin = PluginInfo(path=Path(("p",)), configuration={})
+            calls = []
+            unsubscribe = [
+                mt.subscribe(
+                    plugin,
+                    ("/a/x", "/a/y"),
+                    lambda x, y, i=i: calls.append((i, x, y)),
+                    initial=False,
+                )
+                for i in range(3)
+            ]
+            unsubscribe[0]()
+            mt.setRawState({"a": {"x": 1, "y": 2}})
+            await asyncio.sleep(0.01)
+            self.assertCountEqual(calls, [(1, 1, 2), (2, 1, 2)])
+            unsubscribe[1]()
+            unsubscribe[1]()
+            self.assertEqual(len(plugin.subscriptions), 1)
+
+        asyncio.run(run())
+
+    def test_priorities_and_reentrant_callbacks(self):
+        async def run():
+            mt = ManagedTree()
+            plugin = PluginInfo(path=Path(("p",)), configuration={})
+            calls = []
+
+            def low(x):
+                calls.append("low")
+
+            def high(x):
+                # Cancels a subscription with a lower priority, and
+                # changes the state from within the callback
+                calls.append("high")
+                cancel_other()
+                if x == 1:
+                    mt.setRawState({"a": 2})
+
+            mt.subscribe(plugin, ("/a",), low, initial=False, priority=-1)
+            mt.subscribe(plugin, ("/a",), high, initial=False, priority=1)
+            cancel_other = mt.subscribe(
+                plugin, ("/a",), calls.append, initial=False, priority=0
+            )
+            mt.setRawState({"a": 1})
+            await asyncio.sleep(0.01)
+            self.assertEqual(calls, ["high", "low", "high", "low"])
+            self.assertEqual(mt.get("/a"), 2)
+            self.assertEqual(mt.get("/sys/dispatch")["1"]["queued"], 0)
+
+        asyncio.run(run())
+
+    def test_coalesce_slow_async_callback(self):
+        async def run():
+            mt = ManagedTree()
+            plugin = PluginInfo(path=Path(("p",)), configuration={})
+            calls = []
+            release = asyncio.Event()
+
+            async def callback(x):
+                calls.append(x)
+                await release.wait()
+
+            mt.subscribe(plugin, ("/a",), callback, initial=False)
+            for n in range(1, 6):
+                mt.setRawState({"a": n})
+                await asyncio.sleep(0.001)
+            self.assertEqual(calls, [1])
+            self.assertEqual(plugin.inFlightNotifications, 1)
+            # The second update is pending, the three after it superseded it
+            self.assertEqual(plugin.droppedNotifications, 3)
+
+            release.set()
+            await asyncio.sleep(0.01)
+            # A single call follows, with the latest state
+            self.assertEqual(calls, [1, 5])
+            self.assertEqual(plugin.inFlightNotifications, 0)
+
+        asyncio.run(run())
+
+
+class TestDispatcher(unittest.TestCase):
+    def test_priority_order(self):
+        calls = []
+        dispatcher = SubscriptionDispatcher()
+        dispatcher.enqueue(
+            FakeSubscription(name, priority, calls)
+            for name, priority in (("a", 0), ("b", 5), ("c", 0), ("d", -1))
+        )
+        dispatcher.enqueue([FakeSubscription("e", 5, calls)])
+        self.assertFalse(dispatcher.dispatch(1.0))
+        self.assertEqual(calls, ["b", "e", "a", "c", "d"])
+
+    def test_budget(self):
+        calls = []
+        dispatcher = SubscriptionDispatcher()
+        dispatcher.enqueue(
+            [FakeSubscription(i, 0, calls, duration=0.002) for i in range(5)]
+        )
+        # No callback is started once the budget is used up, but at least
+        # one is always called
+        self.assertTrue(dispatcher.dispatch(0.001))
+        self.assertEqual(calls, [0])
+        self.assertTrue(dispatcher.dispatch(0.0))
+        self.assertEqual(calls, [0, 1])
+        self.assertFalse(dispatcher.dispatch(1.0))
+        self.assertEqual(calls, [0, 1, 2, 3, 4])
+
+    def test_stats(self):
+        dispatcher = SubscriptionDispatcher()
+        dispatcher.enqueue(FakeSubscription(i, i % 2, []) for i in range(4))
+        self.assertEqual(dispatcher.stats()["1"]["queued"], 2)
+        dispatcher.dispatch(1.0)
+        stats = dispatcher.stats()
+        self.assertEqual(set(stats), {"0", "1"})
+        self.assertEqual(stats["0"]["queued"], 0)
+        self.assertEqual(stats["0"]["dispatched"], 2)
+        self.assertGreaterEqual(stats["0"]["max_lateness"], 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
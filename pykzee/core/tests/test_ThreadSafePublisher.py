@@ -0,0 +1,100 @@
+import asyncio
+import os
+import tempfile
+import threading
+import unittest
+
+from pyimmutable import ImmutableDict
+from pykzee.core.common import setDataForPath
+from pykzee.core.ManagedTree import ManagedTree
+from pykzee.core.StateJournal import StateJournal
+from pykzee.core.ThreadSafePublisher import ThreadSafePublisher
+
+DRIVER_CODE = """
+set_state((), {"history": list(range(1000)), "sensors": {}})
+publisher = create_publisher()
+register_command((), "publisher", lambda: publisher)
+"""
+
+
+async def publish_from_threads():
+    state, calls = ImmutableDict(), []
+
+    def set_state(path, value):
+        nonlocal state
+        calls.append(len(value))
+        state = setDataForPath(state, path, value)
+
+    publisher = ThreadSafePublisher(set_state)
+
+    def worker(n):
+        for i in range(1000):
+            publisher.set(("sensors", str(n)), i)
+            publisher.set(f"/sensors/{ n }", i)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        await asyncio.sleep(0.001)
+    for thread in threads:
+        thread.join()
+    await asyncio.sleep(0)
+    return state, calls, publisher.coalesced
+
+
+class TestThreadSafePublisher(unittest.TestCase):
+    def test_coalescing(self):
+        state, calls, coalesced = asyncio.run(publish_from_threads())
+        # Each batch is set at once, with one write per buffered path
+        self.assertEqual(sum(calls) + coalesced, 8000)
+        # The last value written to each path is applied last
+        self.assertEqual(
+            dict(state["sensors"]), {str(n): 999 for n in range(4)}
+        )
+
+    def test_journal(self):
+        async def run(directory):
+            journal = StateJournal(directory)
+            mt = ManagedTree(journal=journal)
+            mt.setRawState(
+                {
+                    "driver": {
+                        "__plugin__": "pykzee.core.CodePlugin",
+                        "code.py": DRIVER_CODE,
+                    }
+                }
+            )
+            await asyncio.sleep(0.01)
+            size = os.path.getsize(f"{ directory }/journal-0.jsonl")
+            publisher = mt.command("/driver", "publisher")()
+
+            def run():
+                for i in range(200):
+                    publisher.set(("sensors", str(i % 4)), i)
+
+            thread = threading.Thread(target=run)
+            thread.start()
+            while thread.is_alive():
+                await asyncio.sleep(0.001)
+            await asyncio.sleep(0.01)
+            journal.close()
+            self.assertEqual(
+                dict(mt.get("/driver/sensors")),
+                {str(n): 196 + n for n in range(4)},
+            )
+            return size
+
+        with tempfile.TemporaryDirectory() as directory:
+            size = asyncio.run(run(directory))
+            # Each drain journals the sensor values that changed, not the
+            # whole state of the plugin
+            with open(f"{ directory }/journal-0.jsonl") as f:
+                f.seek(size)
+                entries = f.readlines()
+            self.assertLessEqual(len(entries), 200)
+            self.assertTrue(all(len(entry) < 50 for entry in entries))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,142 @@
+import asyncio
+import time
+import unittest
+
+from pykzee.core.common import Path
+from pykzee.core.ManagedTree import ManagedTree
+from pykzee.core.TimerService import TimerService
+
+
+class FakePlugin:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.disabled = False
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    """Event loop whose time only moves on with ``advance``"""
+
+    def __init__(self):
+        super().__init__()
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    async def advance(self, seconds, step=0.001):
+        end = self.now + seconds
+        while self.now < end:
+            self.now = min(self.now + step, end)
+            # One iteration to run the callbacks that became due, and one
+            # for the tasks they woke up
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+
+
+def run_virtual(test):
+    loop = VirtualTimeLoop()
+    try:
+        loop.run_until_complete(test(loop))
+    finally:
+        # Cancel the remaining tasks (such as the update task of a
+        # ManagedTree), like asyncio.run does
+        tasks = asyncio.all_tasks(loop)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            loop.run_until_complete(
+                asyncio.gather(*tasks, return_exceptions=True)
+            )
+        loop.close()
+
+
+class TestTimerService(unittest.TestCase):
+    def test_every_after_at(self):
+        async def run(loop):
+            service = TimerService()
+            plugin = FakePlugin(("p",))
+            calls = []
+            cancel = service.every(plugin, 0.02, lambda: calls.append("e"))
+            service.after(plugin, 0.03, lambda: calls.append("a"))
+            service.at(plugin, time.time() + 0.05, lambda: calls.append("t"))
+            await loop.advance(0.11)
+            cancel()
+            await loop.advance(0.05)
+            self.assertEqual(calls.count("e"), 5)
+            self.assertEqual(calls.count("a"), 1)
+            self.assertEqual(calls.count("t"), 1)
+            info = service.stats()["/p"]
+            self.assertEqual(info["timers"], 0)
+            self.assertEqual(info["runs"], 7)
+            self.assertEqual(info["skipped"], 0)
+
+        run_virtual(run)
+
+    def test_coalescing(self):
+        async def run(loop):
+            service = TimerService(coalesce_window=0.05)
+            plugin = FakePlugin(("p",))
+            times = []
+            service.after(plugin, 0.01, lambda: times.append(loop.time()))
+            service.after(plugin, 0.04, lambda: times.append(loop.time()))
+            service.every(plugin, 0.01, lambda: times.append(None))
+            await loop.advance(0.01)
+            # All ran from the same wakeup, at the time of the first one, and
+            # the periodic timer only once
+            self.assertEqual(sorted(times, key=str), [0.01, 0.01, None])
+
+        run_virtual(run)
+
+    def test_disabled_and_cancel_plugin(self):
+        async def run(loop):
+            service = TimerService()
+            plugin = FakePlugin(("p",))
+            calls = []
+            service.every(plugin, 0.01, lambda: calls.append(1), jitter=0.005)
+            plugin.disabled = True
+            await loop.advance(0.05)
+            self.assertEqual(calls, [])
+            self.assertGreater(service.stats()["/p"]["skipped"], 0)
+            plugin.disabled = False
+            await loop.advance(0.05)
+            self.assertTrue(calls)
+            service.cancelPlugin(plugin)
+            self.assertNotIn("/p", service.stats())
+            count = len(calls)
+            await loop.advance(0.03)
+            self.assertEqual(len(calls), count)
+
+        run_virtual(run)
+
+    def test_managed_tree(self):
+        code = (
+            "every(0.01, lambda: set_state(('n',), get(path + ('n',)) + 1))\n"
+            "set_state((), {'n': 0})\n"
+        )
+
+        async def run(loop):
+            mt = ManagedTree()
+            mt.setRawState(
+                {
+                    "p": {
+                        "__plugin__": "pykzee.core.CodePlugin",
+                        "code.py": code,
+                    }
+                }
+            )
+            await loop.advance(0.001)
+            self.assertEqual(mt.get("/p/n"), 0)
+            await loop.advance(0.05)
+            self.assertEqual(mt.get("/p/n"), 5)
+            self.assertEqual(mt.get("/sys/timers")["/p"]["timers"], 1)
+
+            # Removing the plugin cancels its timers
+            mt.setRawState({})
+            await loop.advance(0.001)
+            self.assertEqual(len(mt.get("/sys/timers")), 0)
+
+        run_virtual(run)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+import asyncio
+import unittest
+
+from pyimmutable import make_mutable
+from pykzee.core.Tree import Tree
+
+
+def make_tree(calls, **kwargs):
+    return Tree(
+        (),
+        parent_set=lambda path, value: calls.append(
+            (tuple(path), make_mutable(value))
+        ),
+        parent_register_command=None,
+        **kwargs
+    )
+
+
+class TestAutoFlush(unittest.TestCase):
+    def test_flush_at_end_of_tick(self):
+        async def run():
+            calls = []
+            tree = make_tree(calls, auto_flush=True)
+            tree.set(("a",), 1)
+            tree.set(("b",), 2)
+            self.assertEqual(calls, [])
+            await asyncio.sleep(0)
+            self.assertEqual(calls, [((), {"a": 1, "b": 2})])
+
+            tree.set(("a",), 3)
+            await asyncio.sleep(0)
+            self.assertEqual(len(calls), 2)
+            self.assertEqual(calls[-1][1], {"a": 3, "b": 2})
+
+        asyncio.run(run())
+
+    def test_nested_subtrees_flush_once(self):
+        async def run():
+            calls = []
+            tree = make_tree(calls, auto_flush=True)
+            child = tree.createSubtree(("c",), auto_flush=True)
+            grandchild = child.createSubtree(("g",), auto_flush=True)
+            grandchild.set(("x",), 1)
+            tree.set(("a",), 1)
+            child.set(("y",), 2)
+            await asyncio.sleep(0)
+            # The innermost subtree is flushed first, so that the root
+            # passes on everything in a single call
+            self.assertEqual(
+                calls, [((), {"a": 1, "c": {"y": 2, "g": {"x": 1}}})]
+            )
+
+        asyncio.run(run())
+
+    def test_separate_event_loops(self):
+        calls = []
+
+        async def run(value):
+            tree = make_tree(calls, auto_flush=True)
+            tree.set(("a",), value)
+            await asyncio.sleep(0)
+
+        asyncio.run(run(1))
+        asyncio.run(run(2))
+        self.assertEqual([value for _, value in calls], [{"a": 1}, {"a": 2}])
+
+
+class TestEdit(unittest.TestCase):
+    def test_edit(self):
+        calls = []
+        tree = make_tree(calls)
+        tree.set((), {"l": [1, 2], "a": 1})
+        with tree.edit() as edits:
+            edits.set("b", 2)
+            edits.delete(("l", 5))
+            edits.delete(("l", 0))
+        self.assertEqual(calls[-1], ((), {"l": [2], "a": 1, "b": 2}))
+        count = len(calls)
+        with tree.edit("a"):
+            pass
+        self.assertEqual(len(calls), count)
+
+
+class TestCommands(unittest.TestCase):
+    def test_batches(self):
+        batches, unregistered = [], []
+
+        def register_commands(commands):
+            commands = list(commands)
+            batches.append(commands)
+            return [lambda c=c: unregistered.append(c[:2]) for c in commands]
+
+        tree = Tree(
+            ("t",),
+            parent_set=lambda path, value: None,
+            parent_register_command=None,
+            parent_register_commands=register_commands,
+        )
+        unregister = tree.registerCommands(
+            [(("a",), "x", lambda: 1), ((), "y", lambda: 2, "Y")]
+        )
+        self.assertEqual(
+            [(path, name, doc) for path, name, _, doc in batches[0]],
+            [(("t", "a"), "x", None), (("t",), "y", "Y")],
+        )
+
+        # Hiding and showing the tree re-registers all commands at once
+        tree.hide()
+        self.assertEqual(len(unregistered), 2)
+        tree.show(("u",))
+        self.assertEqual(len(batches), 2)
+        self.assertEqual(
+            sorted(path for path, _, _, _ in batches[1]),
+            [("u",), ("u", "a")],
+        )
+
+        unregister[1]()
+        self.assertEqual(unregistered[-1], (("u",), "y"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,8 +1,28 @@
+import json
 import unittest
 
-from pyimmutable import ImmutableDict, ImmutableList
+from pyimmutable import ImmutableDict, ImmutableList, make_mutable
 
-from pykzee.core.common import Undefined, sanitize
+from pykzee.core import AttachedInfo
+from pykzee.core.common import (
+    diffState,
+    dumpJson,
+    InvalidPathElement,
+    listAppendCapped,
+    listInsert,
+    listMove,
+    listRemoveRange,
+    listSplice,
+    makePath,
+    Path,
+    PathElementTypeMismatch,
+    pathToString,
+    Undefined,
+    sanitize,
+    setDataForPath,
+    StateEdits,
+    writeJson,
+)
 
 
 class TestUndefined(unittest.TestCase):
@@ -69,5 +89,266 @@ class TestSanitize(unittest.TestCase):
         )
 
 
+class TestPath(unittest.TestCase):
+    def test_interned(self):
+        p = Path(("foo", 1, "bar"))
+        self.assertTrue(Path(["foo", 1, "bar"]) is p)
+        self.assertTrue(Path(p) is p)
+        self.assertTrue(makePath("/foo/[1]/bar") is p)
+        self.assertTrue(makePath(("foo", 1, "bar")) is p)
+        self.assertTrue(Path() is makePath("/"))
+
+    def test_tuple_compatible(self):
+        p = Path(("foo", 1))
+        self.assertEqual(p, ("foo", 1))
+        self.assertEqual(hash(p), hash(("foo", 1)))
+        self.assertEqual({("foo", 1): True}[p], True)
+        self.assertTrue(p + ("x",) is Path(("foo", 1, "x")))
+        self.assertTrue(p.child("x") is Path(("foo", 1, "x")))
+
+    def test_string(self):
+        p = Path(("foo", 1, "a/b", "..", "[x"))
+        self.assertEqual(p.string, "/foo/[1]/a%2Fb/%2E./%5Bx")
+        self.assertEqual(pathToString(p), p.string)
+        self.assertEqual(pathToString(tuple(p)), p.string)
+        self.assertTrue(makePath(p.string) is p)
+
+    def test_parent_and_prefixes(self):
+        p = Path(("a", "b", "c"))
+        self.assertTrue(p.parent is Path(("a", "b")))
+        self.assertTrue(Path().parent is None)
+        self.assertEqual(p.ancestors, (Path(), Path(("a",)), Path(("a", "b"))))
+        self.assertTrue(p.startswith(()))
+        self.assertTrue(p.startswith(("a", "b")))
+        self.assertTrue(p.startswith(p))
+        self.assertFalse(p.startswith(("a", "x")))
+        self.assertFalse(Path(("a",)).startswith(p))
+
+    def test_relative(self):
+        base = Path(("a", "b"))
+        self.assertTrue(makePath("c", relativeTo=base) is base.child("c"))
+        self.assertTrue(makePath("../c", relativeTo=base) is Path(("a", "c")))
+        self.assertTrue(makePath("", relativeTo=base) is base)
+
+    def test_invalid(self):
+        with self.assertRaises(TypeError):
+            makePath(("a", 1.5))
+        with self.assertRaises(TypeError):
+            makePath(None)
+        Path((1,))
+        with self.assertRaises(InvalidPathElement):
+            Path((True,))
+
+
+class TestDiffState(unittest.TestCase):
+    def check(self, old, new):
+        old, new = sanitize(old), sanitize(new)
+        changes = list(diffState(old, new))
+        state = old
+        for path, value in changes:
+            state = setDataForPath(state, path, value)
+        self.assertTrue(state is new)
+        return [(path.string, value) for path, value in changes]
+
+    def test_unchanged(self):
+        self.assertEqual(self.check({"a": [1, 2]}, {"a": [1, 2]}), [])
+
+    def test_changes(self):
+        self.assertCountEqual(
+            self.check(
+                {"a": {"x": 1, "y": 2}, "b": [1, 2, 3], "c": 1},
+                {"a": {"x": 1, "y": 3}, "b": [0, 2], "d": [1]},
+            ),
+            [
+                ("/a/y", 3),
+                ("/b/[0]", 0),
+                ("/b/[2]", Undefined),
+                ("/d", sanitize([1])),
+                ("/c", Undefined),
+            ],
+        )
+        self.check([1], [1, 2, 3])
+        self.check({"a": [1]}, {"a": {"b": 1}})
+
+
+class TestListOperations(unittest.TestCase):
+    def apply(self, data, operation):
+        return setDataForPath(sanitize({"l": data}), ("l",), operation)["l"]
+
+    def test_operations(self):
+        data = [0, 1, 2, 3, 4]
+        for operation, expected in (
+            (listInsert(2, "a", "b"), [0, 1, "a", "b", 2, 3, 4]),
+            (listInsert(5, "a"), [0, 1, 2, 3, 4, "a"]),
+            (listRemoveRange(1, 3), [0, 3, 4]),
+            (listRemoveRange(1, -1), [0, 4]),
+            (listRemoveRange(-3, 10), [0, 1]),
+            (listRemoveRange(-2, 1), [0, 1, 2, 3, 4]),
+            (listSplice(-2, 1, ["x"]), [0, 1, 2, "x", 4]),
+            (listMove(0, 3), [1, 2, 3, 0, 4]),
+            (listMove(4, 1), [0, 4, 1, 2, 3]),
+            (listAppendCapped(6, 5, 6), [1, 2, 3, 4, 5, 6]),
+            (listAppendCapped(2, 5, 6, 7), [6, 7]),
+        ):
+            self.assertTrue(
+                self.apply(data, operation) is sanitize(expected),
+                operation,
+            )
+
+    def test_unchanged(self):
+        data = sanitize([1, 2])
+        self.assertTrue(self.apply(data, listRemoveRange(1, 1)) is data)
+        self.assertTrue(self.apply(data, listMove(1, -1)) is data)
+
+    def test_missing_list(self):
+        self.assertTrue(
+            setDataForPath(ImmutableDict(), ("l",), listInsert(0, 1))
+            is sanitize({"l": [1]})
+        )
+        with self.assertRaises(TypeError):
+            setDataForPath(sanitize({"l": {}}), ("l",), listInsert(0, 1))
+
+    def test_delete_element(self):
+        data = sanitize([[1], [2], [3]])
+        self.assertTrue(
+            setDataForPath(data, (1,), Undefined) is sanitize([[1], [3]])
+        )
+        self.assertTrue(
+            setDataForPath(data, (1, 0), 5) is sanitize([[1], [5], [3]])
+        )
+
+    def test_null_is_not_a_container(self):
+        # Only list operations treat null as an empty list
+        for path in ((0,), ("a",)):
+            with self.assertRaises(PathElementTypeMismatch):
+                setDataForPath(None, path, 1)
+            edits = StateEdits()
+            edits.set(path, 1)
+            with self.assertRaises(PathElementTypeMismatch):
+                edits.apply(None)
+        self.assertTrue(
+            setDataForPath(None, (), listInsert(0, 1)) is sanitize([1])
+        )
+
+
+class TestStateEdits(unittest.TestCase):
+    changes = (
+        ("a/b", 2),
+        (("a", "c", 0), Undefined),
+        (("a", "c", 0), 9),
+        (("a", "c", 2), {"x": 1, "y": 2}),
+        (("a", "c", 2, "x"), Undefined),
+        ("x", Undefined),
+        ("n/m", 5),
+        ("n/m", Undefined),
+        ("l", listInsert(0, "first")),
+        (("l", 1), [1]),
+        (("l", 1, 0), 2),
+    )
+
+    def test_same_as_setDataForPath(self):
+        data = sanitize({"a": {"b": 1, "c": [1, 2, 3]}, "x": 1, "l": ["y"]})
+        expected = data
+        edits = StateEdits()
+        for path, value in self.changes:
+            expected = setDataForPath(expected, makePath(path), value)
+            edits.set(path, value)
+            self.assertTrue(setDataForPath(data, (), edits) is expected)
+        self.assertEqual(len(edits), len(self.changes))
+
+    def test_unchanged(self):
+        data = sanitize({"a": {"b": 1}, "l": [1, 2]})
+        edits = StateEdits()
+        edits.set("a/b", 1)
+        edits.set(("l", 1), 2)
+        edits.delete("missing")
+        self.assertTrue(edits.apply(data) is data)
+
+    def test_subtree_and_root(self):
+        data = sanitize({"a": {"b": 1}})
+        edits = StateEdits()
+        edits.set("c", 3)
+        self.assertTrue(
+            setDataForPath(data, ("a",), edits)
+            is sanitize({"a": {"b": 1, "c": 3}})
+        )
+        edits.delete(())
+        self.assertTrue(edits.apply(data, undefined=None) is None)
+
+    def test_delete_missing_element(self):
+        data = sanitize({"l": [1, 2]})
+        edits = StateEdits()
+        edits.delete(("l", 5))
+        edits.delete(("l", -1))
+        self.assertTrue(edits.apply(data) is data)
+        edits.set(("l", 2), 3)
+        edits.delete(("l", 0))
+        self.assertTrue(edits.apply(data) is sanitize({"l": [2, 3]}))
+
+
+class TestJson(unittest.TestCase):
+    def setUp(self):
+        self.data = sanitize(
+            {
+                "a": {"b": [1, 2.5, None, True], "c": 'ä\n"', "e": {}},
+                "l": [[], [{"x": False}]],
+            }
+        )
+
+    def test_encoding(self):
+        for indent in (None, 2, 4):
+            expected = json.dumps(
+                make_mutable(self.data),
+                indent=indent,
+                separators=(",", ":") if indent is None else None,
+            )
+            self.assertEqual(dumpJson(self.data, indent=indent), expected)
+            output = []
+            writeJson(self.data, output.append, indent=indent)
+            self.assertEqual("".join(output), expected)
+        self.assertEqual(dumpJson("x"), '"x"')
+
+    def test_cache(self):
+        data = sanitize({"a": {"b": 1}, "l": [2, 3]})
+        self.assertEqual(dumpJson(data["l"]), "[2,3]")
+        # Unchanged nodes are not encoded again
+        data["l"].meta["json-cache"].put(None, "cached")
+        changed = setDataForPath(data, ("a", "b"), 4)
+        self.assertEqual(
+            json.loads(dumpJson(changed).replace("cached", "null")),
+            {"a": {"b": 4}, "l": None},
+        )
+        self.assertEqual(dumpJson(changed["a"]), '{"b":4}')
+        data["l"].meta["json-cache"].clear()
+
+    def test_plain_containers(self):
+        message = ["delta", ("x", 1), {"state": self.data}]
+        self.assertEqual(
+            dumpJson(message),
+            json.dumps(
+                ["delta", ["x", 1], {"state": make_mutable(self.data)}],
+                separators=(",", ":"),
+            ),
+        )
+        self.assertIn("json-cache", self.data.meta)
+        with self.assertRaises(TypeError):
+            dumpJson({1: 2})
+
+    def test_cache_budget(self):
+        policy = AttachedInfo.cachePolicy
+        self.addCleanup(
+            setattr, policy, "maxTotalEntries", policy.maxTotalEntries
+        )
+        policy.maxTotalEntries = policy.totalEntries + 5
+        data = sanitize([[n] for n in range(10)])
+        for indent in (None, 2):
+            dumpJson(data, indent=indent)
+        # Least recently used encodings were dropped to stay within budget
+        self.assertLessEqual(policy.totalEntries, policy.maxTotalEntries)
+        self.assertEqual(
+            dumpJson(data, indent=2), json.dumps(make_mutable(data), indent=2)
+        )
+
+
 if __name__ == "__main__":
     unittest.main()